@@ -0,0 +1,161 @@
+import datetime
+import os
+import pytz
+from firebase_admin import firestore
+from google.api_core import exceptions
+from task_queue import task_name_for
+
+# Far-future work waits here, indexed by UTC hour, until it is inside the materialize window
+DEFERRED_COLLECTION = 'DeferredFlowTasks'
+SWEEP_STATE_COLLECTION = 'SchedulerState'
+SWEEP_STATE_DOCUMENT = 'deferred_sweep'
+
+# Only dispatches this close are created as Cloud Tasks; must stay well under the 30-day queue limit
+MATERIALIZE_WINDOW = datetime.timedelta(hours=int(os.environ.get('SCHEDULER_MATERIALIZE_HOURS', 72)))
+# How far back the first sweep looks when no cursor has been stored yet
+INITIAL_LOOKBACK = datetime.timedelta(days=7)
+
+BUCKET_FORMAT = '%Y-%m-%dT%H'
+
+# Sweeps that retry an entry whose materialize raised, before it is left as failed
+MAX_MATERIALIZE_ATTEMPTS = int(os.environ.get('SCHEDULER_MATERIALIZE_ATTEMPTS', 3))
+# Conditional writes of the contact's activeFlows before giving up on concurrent updates
+CONTACT_WRITE_ATTEMPTS = 5
+
+
+def floor_hour(dt):
+    return dt.astimezone(pytz.UTC).replace(minute=0, second=0, microsecond=0)
+
+
+def bucket_key(dt):
+    return floor_hour(dt).strftime(BUCKET_FORMAT)
+
+
+def materialize_horizon(now):
+    """
+    First instant that is deferred instead of queued. The sweeper's cursor never passes the hour
+    before it, so anything deferred lands in a bucket that has not been swept yet.
+    """
+    return floor_hour(now + MATERIALIZE_WINDOW) + datetime.timedelta(hours=1)
+
+
+def should_defer(dispatch_datetime, now):
+    return dispatch_datetime >= materialize_horizon(now)
+
+
+def deferred_task_ref(db, flow_id, contact_id):
+    # One entry per flow and contact, so rescheduling a deferred contact overwrites it
+    return db.collection(DEFERRED_COLLECTION).document(f"{flow_id}_{contact_id}")
+
+
+def defer_task(db, task_type, payload, dispatch_datetime):
+    """Stores a task for the sweeper to create once it enters the materialize window."""
+    deferred_task_ref(db, payload['flow_id'], payload['contact_id']).set({
+        'task_type': task_type,
+        'payload': payload,
+        'dispatch_time': dispatch_datetime.isoformat(),
+        'bucket': bucket_key(dispatch_datetime),
+        'status': 'deferred',
+        'created_at': firestore.SERVER_TIMESTAMP
+    })
+
+
+def materialize_deferred_task(db, entry, queue):
+    """
+    Creates the Cloud Task for a deferred entry and records it on the contact's active flow.
+
+    Returns None without creating anything if the contact's flow no longer points at this entry,
+    i.e. the flow was canceled or rescheduled after it was deferred. activeFlows is written with a
+    last_update_time precondition and re-read when the contact changed in between.
+    """
+    payload = entry['payload']
+    contact_ref = db.collection('Contacts').document(payload['contact_id'])
+    task_id = None
+    for _ in range(CONTACT_WRITE_ATTEMPTS):
+        snapshot = contact_ref.get()
+        active_flows = (snapshot.to_dict() or {}).get('activeFlows', []) if snapshot.exists else []
+        active_flow = next((flow for flow in active_flows if flow.get('flow_id') == payload['flow_id']), None)
+        if not active_flow or not active_flow.get('deferred') or active_flow.get('schedule_generation') != payload.get('schedule_generation'):
+            if task_id:
+                # Superseded while we were writing; the task's name is only reused by this generation
+                try:
+                    queue.delete(task_id)
+                except (exceptions.NotFound, KeyError):
+                    pass
+            return None
+
+        if task_id is None:
+            task_name = task_name_for(payload['flow_id'], payload['contact_id'], payload['schedule_generation'])
+            task_id = queue.create(entry['task_type'], payload, datetime.datetime.fromisoformat(entry['dispatch_time']), task_name)
+        active_flow['cloud_task_id'] = task_id
+        active_flow['deferred'] = False
+        try:
+            contact_ref.update({'activeFlows': active_flows}, option=db.write_option(last_update_time=snapshot.update_time))
+            return task_id
+        except exceptions.FailedPrecondition:
+            print(f"Contact {payload['contact_id']} changed while materializing its task, re-reading")
+    raise RuntimeError(f"Contact {payload['contact_id']} kept changing; task {task_id} not recorded")
+
+
+def _materialize_entries(entries, materialize, counts):
+    for entry in entries:
+        data = entry.to_dict()
+        try:
+            task_id = materialize(data)
+        except Exception as e:
+            # One bad entry must not stop the cursor; it is retried by later sweeps up to the limit
+            print(f"Error materializing deferred task {entry.reference.id}: {str(e)}")
+            entry.reference.update({
+                'status': 'failed',
+                'error': str(e),
+                'attempts': data.get('attempts', 0) + 1,
+                'failed_at': firestore.SERVER_TIMESTAMP
+            })
+            counts['failed'] += 1
+            continue
+        if task_id is None:
+            entry.reference.update({'status': 'superseded'})
+            counts['skipped'] += 1
+        else:
+            entry.reference.update({'status': 'materialized', 'task_id': task_id, 'materialized_at': firestore.SERVER_TIMESTAMP})
+            counts['materialized'] += 1
+
+
+def sweep_deferred_tasks(db, materialize, now=None):
+    """
+    Materializes deferred tasks whose hour bucket is inside the window.
+
+    Walks hour buckets from the stored cursor up to the window's last hour, so each run only reads
+    buckets it has not seen. materialize(entry) creates the Cloud Task and returns its ID, or returns
+    None if the entry has been superseded by a later reschedule or cancel. An entry whose materialize
+    raises is marked failed with the error and its attempts; it is retried on the following sweeps
+    until MAX_MATERIALIZE_ATTEMPTS, while the cursor moves on.
+
+    Returns:
+        (materialized_count, skipped_count, failed_count)
+    """
+    now = now or datetime.datetime.now(pytz.UTC)
+    state_ref = db.collection(SWEEP_STATE_COLLECTION).document(SWEEP_STATE_DOCUMENT)
+    state = state_ref.get()
+    swept_through = (state.to_dict() or {}).get('swept_through') if state.exists else None
+
+    if swept_through:
+        bucket = datetime.datetime.strptime(swept_through, BUCKET_FORMAT).replace(tzinfo=pytz.UTC) + datetime.timedelta(hours=1)
+    else:
+        bucket = floor_hour(now - INITIAL_LOOKBACK)
+    last_bucket = materialize_horizon(now) - datetime.timedelta(hours=1)
+
+    counts = {'materialized': 0, 'skipped': 0, 'failed': 0}
+    # Entries that failed on an earlier sweep, before their bucket was passed
+    retries = db.collection(DEFERRED_COLLECTION).where('status', '==', 'failed').where('attempts', '<', MAX_MATERIALIZE_ATTEMPTS).stream()
+    _materialize_entries(retries, materialize, counts)
+
+    while bucket <= last_bucket:
+        key = bucket.strftime(BUCKET_FORMAT)
+        entries = db.collection(DEFERRED_COLLECTION).where('bucket', '==', key).where('status', '==', 'deferred').stream()
+        _materialize_entries(entries, materialize, counts)
+        # Checkpoint after every bucket so a timed-out sweep resumes where it stopped
+        state_ref.set({'swept_through': key, 'updated_at': firestore.SERVER_TIMESTAMP}, merge=True)
+        bucket += datetime.timedelta(hours=1)
+
+    return counts['materialized'], counts['skipped'], counts['failed']
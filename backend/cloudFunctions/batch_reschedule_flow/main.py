@@ -1,12 +1,13 @@
 import firebase_admin
 from firebase_admin import credentials, firestore
-from google.cloud import tasks_v2
-from google.protobuf import timestamp_pb2, field_mask_pb2
 import datetime
 import pytz
-import random
 import json
 import functions_framework
+from google.api_core import exceptions
+from slot_allocator import CallingHours, SlotTable, allocate_slots, dispatch_window_start, held_slot, release_slots, slot_holder, window_key
+from task_queue import get_task_queue, task_name_for
+from deferred_scheduler import defer_task, materialize_deferred_task, should_defer, sweep_deferred_tasks
 
 # Initialize the Firebase Admin SDK if not already initialized
 if not firebase_admin._apps:
@@ -35,19 +36,21 @@ def query_document(doc_id, collection):
         print(f"Error querying document {doc_id} in {collection}: {str(e)}")
         return None
 
-def schedule_cloud_task(task_type, scheduled_for, payload):
-    """Schedule or reschedule a Cloud Task to trigger a workflow at a random time within the specified hour."""
+def schedule_cloud_task(task_type, scheduled_for, payload, dispatch_time=None, queue=None, previous_task_id=None):
+    """
+    Schedule or reschedule a Cloud Task to trigger a workflow.
+
+    dispatch_time is the slot assigned by slot_allocator within the scheduled hour; without one the
+    task runs at scheduled_for. Dispatches beyond the materialize window are stored in
+    DeferredFlowTasks instead and created later by sweep_deferred_flows; their task ID is None.
+
+    The task name is derived from flow, contact and payload['schedule_generation'], so a retried call
+    dedups server-side. previous_task_id (the cloud_task_id stored on the contact's active flow) is
+    deleted, best effort, because a surviving older task would dial the contact again.
+    """
     print(f"Scheduling/Rescheduling Cloud Task for type: {task_type}, scheduled for: {scheduled_for} with payload: {payload}")
-    project_id = 'heyisaai'
-    location = 'us-central1'
-    queue_name = 'scheduled-flows'
-    service_account_email = "54875993561-compute@developer.gserviceaccount.com"
-    url_map = {
-        'Engage': "https://us-central1-heyisaai.cloudfunctions.net/scheduled_engage",
-        'Revive': "https://us-central1-heyisaai.cloudfunctions.net/scheduled_revive"
-    }
+    queue = queue or get_task_queue()
     
-    # Calculate the schedule time with random offset
     tz = pytz.timezone(payload['timezone'])
     scheduled_datetime = datetime.datetime.fromisoformat(scheduled_for).astimezone(tz)
     
@@ -55,60 +58,52 @@ def schedule_cloud_task(task_type, scheduled_for, payload):
     now = datetime.datetime.now(tz)
     if scheduled_datetime < now:
         raise ValueError("Cannot schedule a task in the past")
-    
-    # Check if the scheduled time is more than 30 days in the future
-    max_future_time = now + datetime.timedelta(days=30)
-    if scheduled_datetime > max_future_time:
-        print(f"Warning: Scheduled time {scheduled_datetime} is more than 30 days in the future. Capping at {max_future_time}")
-        scheduled_datetime = max_future_time
-    
-    # Generate a random offset within the hour (0 to 59 minutes, 0 to 59 seconds)
-    random_offset = datetime.timedelta(minutes=random.randint(0, 59), seconds=random.randint(0, 59))
-    randomized_datetime = scheduled_datetime.replace(minute=0, second=0, microsecond=0) + random_offset
-    
-    schedule_time = timestamp_pb2.Timestamp()
-    schedule_time.FromDatetime(randomized_datetime.astimezone(pytz.UTC))
 
-    # Prepare Cloud Tasks client
-    client = tasks_v2.CloudTasksClient()
-    parent = client.queue_path(project_id, location, queue_name)
-    
-    # Construct the task
-    task = {
-        "schedule_time": schedule_time,
-        "http_request": {
-            "http_method": tasks_v2.HttpMethod.POST,
-            "url": url_map[task_type],
-            "oidc_token": {
-                "service_account_email": service_account_email
-            },
-            "headers": {"Content-Type": "application/json"},
-            "body": json.dumps(payload).encode()
-        }
-    }
+    dispatch_datetime = dispatch_time.astimezone(tz) if dispatch_time else scheduled_datetime
 
-    # Check if a task already exists for this flow and contact
-    existing_task_id = payload.get('cloud_task_id')
-    if existing_task_id:
-        try:
-            # Try to delete the existing task
-            task_name = client.task_path(project_id, location, queue_name, existing_task_id)
-            client.delete_task(name=task_name)
-            print(f"Existing task {existing_task_id} deleted successfully")
-        except Exception as e:
-            print(f"Error deleting existing task {existing_task_id}: {str(e)}")
-            # Continue with creating a new task even if deletion fails
+    if should_defer(dispatch_datetime, now):
+        defer_task(db, task_type, payload, dispatch_datetime)
+        print(f"Deferred {task_type} task for contact {payload['contact_id']} until {dispatch_datetime}")
+        if previous_task_id:
+            delete_previous_task(queue, previous_task_id)
+        return None, dispatch_datetime.isoformat()
 
     # Create a new task
     try:
-        response = client.create_task(parent=parent, task=task)
-        print(f"New task created: {response.name} for {task_type} with scheduled time {randomized_datetime}")
-        task_id = response.name.split('/')[-1]
+        task_id = queue.create(task_type, payload, dispatch_datetime, scheduled_task_name(payload))
+        print(f"New task created: {task_id} for {task_type} with scheduled time {dispatch_datetime}")
     except Exception as e:
         print(f"Error creating new task: {str(e)}")
         raise
 
-    return task_id, randomized_datetime.isoformat()
+    if previous_task_id and previous_task_id != task_id:
+        delete_previous_task(queue, previous_task_id)
+
+    return task_id, dispatch_datetime.isoformat()
+
+def delete_previous_task(queue, task_id):
+    """Deletes a superseded task; one that already ran or was deleted is fine."""
+    try:
+        queue.delete(task_id)
+        print(f"Deleted previous task: {task_id}")
+    except (exceptions.NotFound, KeyError):
+        print(f"Previous task {task_id} not found. It may have already been executed or deleted.")
+    except Exception as e:
+        print(f"Error deleting previous task {task_id}: {str(e)}")
+
+def scheduled_task_name(payload):
+    return task_name_for(payload['flow_id'], payload['contact_id'], payload['schedule_generation'])
+
+@firestore.transactional
+def _increment_schedule_generation(transaction, flow_ref):
+    snapshot = flow_ref.get(transaction=transaction)
+    generation = (snapshot.to_dict() or {}).get('schedule_generation', 0) + 1
+    transaction.update(flow_ref, {'schedule_generation': generation})
+    return generation
+
+def next_schedule_generation(flow_id):
+    """Bumps and returns Flows/{flow_id}.schedule_generation."""
+    return _increment_schedule_generation(db.transaction(), db.collection('Flows').document(flow_id))
 
 def batch_reschedule_flow(flow_id, new_scheduled_time, batch_size=500):
     # Get flow information
@@ -129,11 +124,19 @@ def batch_reschedule_flow(flow_id, new_scheduled_time, batch_size=500):
         print(error_message)
         return error_message
 
+    # Every reschedule is a new generation, which names its tasks; the previous task is still deleted below
+    generation = next_schedule_generation(flow_id)
+
     # Get all contacts for this flow
     flow_contacts = db.collection('Flows').document(flow_id).collection('flow_contacts').stream()
     
     rescheduled_count = 0
     errors = []
+    organizations = {}
+    # (organization_id, window_start, timezone) -> [(contact_ref, contact_data, payload)]
+    pending = {}
+    # Slots held from the previous schedule, freed before the new ones are reserved
+    previous_slots = []
 
     for flow_contact in flow_contacts:
         contact_id = flow_contact.id
@@ -145,7 +148,9 @@ def batch_reschedule_flow(flow_id, new_scheduled_time, batch_size=500):
             continue
 
         organization_id = contact_data.get('organization_id')
-        organization_info = query_document(organization_id, 'Organizations')
+        if organization_id not in organizations:
+            organizations[organization_id] = query_document(organization_id, 'Organizations')
+        organization_info = organizations[organization_id]
 
         if not organization_info:
             errors.append(f"Organization info not found for organization_id: {organization_id}")
@@ -161,58 +166,112 @@ def batch_reschedule_flow(flow_id, new_scheduled_time, batch_size=500):
             'general_knowledgebase_id': prompt_parameters.get('general_knowledgebase_id', ''),
             'specific_knowledgebase_id': prompt_parameters.get('specific_knowledgebase_id', ''),
             'organization_id': organization_id,
-            'timezone': organization_info.get('timezone', 'UTC')
+            'timezone': contact_data.get('timezone') or organization_info.get('timezone', 'UTC'),
+            'schedule_generation': generation
         }
 
-        # Add existing cloud_task_id to payload if it exists
-        existing_flow = next((flow for flow in contact_data.get('activeFlows', []) if flow['flow_id'] == flow_id), None)
-        if existing_flow and 'cloud_task_id' in existing_flow:
-            payload['cloud_task_id'] = existing_flow['cloud_task_id']
-
-        # Schedule new Cloud Task or update existing one
         try:
-            task_id, actual_scheduled_time = schedule_cloud_task(task_type, new_scheduled_time, payload)
-        except ValueError as e:
+            window_start = dispatch_window_start(new_scheduled_time, payload['timezone'])
+        except Exception as e:
             errors.append(f"Error scheduling Cloud Task for contact {contact_id}: {str(e)}")
             continue
+        pending.setdefault((organization_id, window_start, payload['timezone']), []).append((contact_ref, contact_data, payload))
+        previous_flow = next((flow for flow in contact_data.get('activeFlows', []) if flow.get('flow_id') == flow_id), None)
+        previous_slot = held_slot(previous_flow, flow_id, contact_id)
+        if previous_slot:
+            previous_slots.append(previous_slot)
+
+    try:
+        release_slots(db, previous_slots)
+    except Exception as e:
+        errors.append(f"Error releasing previous dispatch slots: {str(e)}")
+
+    # Slots are reserved per organization window, spaced to the organization's call capacity and
+    # kept within its calling hours; overflow spills into the following windows
+    queue = get_task_queue()
+    slot_tables = {}
+    calling_hours = {}
+    for (organization_id, window_start, timezone_str), window_contacts in pending.items():
+        if organization_id not in slot_tables:
+            slot_tables[organization_id] = SlotTable.for_organization(organizations[organization_id])
+        try:
+            if organization_id not in calling_hours:
+                calling_hours[organization_id] = CallingHours.for_organization(organizations[organization_id])
+            holders = [slot_holder(flow_id, payload['contact_id']) for _, _, payload in window_contacts]
+            # Slots earlier in the hour than the requested time, or already past, would all fire at once
+            not_before = max(new_scheduled_datetime, datetime.datetime.now(pytz.UTC))
+            placed = allocate_slots(
+                db, organization_id, window_start, holders, slot_tables[organization_id], timezone_str,
+                calling_hours[organization_id], not_before
+            )
         except Exception as e:
-            errors.append(f"Unexpected error scheduling Cloud Task for contact {contact_id}: {str(e)}")
+            errors.append(f"Error allocating dispatch slots for organization {organization_id}: {str(e)}")
             continue
 
-        # Update activeFlow in contact document
-        active_flows = contact_data.get('activeFlows', [])
-        flow_updated = False
-
-        for flow in active_flows:
-            if flow['flow_id'] == flow_id:
-                flow['nextStepTime'] = new_scheduled_time
-                flow['actualScheduledTime'] = actual_scheduled_time
-                flow['status'] = 'scheduled'
-                flow['cloud_task_id'] = task_id
-                flow_updated = True
-                break
-
-        if not flow_updated:
-            # If the flow wasn't in activeFlows, add it
-            active_flows.append({
-                'flow_id': flow_id,
-                'nextStepTime': new_scheduled_time,
-                'actualScheduledTime': actual_scheduled_time,
-                'status': 'scheduled',
-                'cloud_task_id': task_id,
-                'type': task_type
-            })
-
-        # Update the contact document
-        contact_ref.update({'activeFlows': active_flows})
-
-        rescheduled_count += 1
-
-        # Print progress for every batch
-        if rescheduled_count % batch_size == 0:
-            print(f"Processed {rescheduled_count} contacts")
-        # After processing all contacts, update the flow document
+        for contact_ref, contact_data, payload in window_contacts:
+            contact_id = payload['contact_id']
+            slot = placed.get(slot_holder(flow_id, contact_id))
+            if slot is None:
+                errors.append(f"No dispatch slot within calling hours for contact {contact_id}")
+                continue
+            slot_window_start, slot_index, dispatch_time = slot
+            dispatch_slot = {'window': window_key(organization_id, slot_window_start), 'index': slot_index}
+            previous_flow = next((flow for flow in contact_data.get('activeFlows', []) if flow.get('flow_id') == flow_id), None)
+
+            # Schedule new Cloud Task or update existing one
+            try:
+                task_id, actual_scheduled_time = schedule_cloud_task(
+                    task_type, new_scheduled_time, payload, dispatch_time, queue, (previous_flow or {}).get('cloud_task_id')
+                )
+            except ValueError as e:
+                errors.append(f"Error scheduling Cloud Task for contact {contact_id}: {str(e)}")
+                release_slots(db, [held_slot({'dispatch_slot': dispatch_slot}, flow_id, contact_id)])
+                continue
+            except Exception as e:
+                errors.append(f"Unexpected error scheduling Cloud Task for contact {contact_id}: {str(e)}")
+                release_slots(db, [held_slot({'dispatch_slot': dispatch_slot}, flow_id, contact_id)])
+                continue
+
+            # Update activeFlow in contact document
+            active_flows = contact_data.get('activeFlows', [])
+            flow_updated = False
+
+            for flow in active_flows:
+                if flow['flow_id'] == flow_id:
+                    flow['nextStepTime'] = new_scheduled_time
+                    flow['actualScheduledTime'] = actual_scheduled_time
+                    flow['status'] = 'scheduled'
+                    flow['cloud_task_id'] = task_id
+                    flow['deferred'] = task_id is None
+                    flow['schedule_generation'] = generation
+                    flow['dispatch_slot'] = dispatch_slot
+                    flow_updated = True
+                    break
 
+            if not flow_updated:
+                # If the flow wasn't in activeFlows, add it
+                active_flows.append({
+                    'flow_id': flow_id,
+                    'nextStepTime': new_scheduled_time,
+                    'actualScheduledTime': actual_scheduled_time,
+                    'status': 'scheduled',
+                    'cloud_task_id': task_id,
+                    'deferred': task_id is None,
+                    'schedule_generation': generation,
+                    'dispatch_slot': dispatch_slot,
+                    'type': task_type
+                })
+
+            # Update the contact document
+            contact_ref.update({'activeFlows': active_flows})
+
+            rescheduled_count += 1
+
+            # Print progress for every batch
+            if rescheduled_count % batch_size == 0:
+                print(f"Processed {rescheduled_count} contacts")
+
+    # After processing all contacts, update the flow document
     flow_ref = db.collection('Flows').document(flow_id)
     flow_ref.update({
         'scheduled_for': new_scheduled_time,
@@ -247,4 +306,15 @@ def reschedule_flow(request):
         result = batch_reschedule_flow(flow_id, new_scheduled_time)
         return json.dumps({'result': result}), 200, {'Content-Type': 'application/json'}
     except Exception as e:
-        return json.dumps({'error': str(e)}), 500, {'Content-Type': 'application/json'}
\ No newline at end of file
+        return json.dumps({'error': str(e)}), 500, {'Content-Type': 'application/json'}
+
+@functions_framework.http
+def sweep_deferred_flows(request):
+    """Cloud Scheduler entry point (hourly): creates Cloud Tasks for deferred flows entering the window."""
+    try:
+        queue = get_task_queue()
+        materialized, skipped, failed = sweep_deferred_tasks(db, lambda entry: materialize_deferred_task(db, entry, queue))
+        print(f"Materialized {materialized} deferred tasks, skipped {skipped} superseded entries, {failed} failed")
+        return json.dumps({'materialized': materialized, 'skipped': skipped, 'failed': failed}), 200, {'Content-Type': 'application/json'}
+    except Exception as e:
+        return json.dumps({'error': str(e)}), 500, {'Content-Type': 'application/json'}
@@ -0,0 +1,206 @@
+import datetime
+import os
+import pytz
+from firebase_admin import firestore
+
+# Persisted per organization and dispatch window, so flows sharing an org share its capacity
+SLOT_COLLECTION = 'DispatchSchedules'
+
+DEFAULT_MAX_CONCURRENT_CALLS = int(os.environ.get('DEFAULT_MAX_CONCURRENT_CALLS', 10))
+# Expected call length; with max_concurrent_calls it sets the sustainable dial rate
+AVERAGE_CALL_SECONDS = int(os.environ.get('AVERAGE_CALL_SECONDS', 120))
+WINDOW_SECONDS = 3600
+
+# Used when an organization has no call_settings.calling_hours (same shape as function-1's window rules)
+DEFAULT_CALLING_HOURS = {'window_start': '08:00', 'window_end': '21:00', 'weekdays': [0, 1, 2, 3, 4, 5, 6]}
+# How far overflow may spill before the remaining contacts are reported as unscheduled
+MAX_SPILL_WINDOWS = int(os.environ.get('MAX_SPILL_WINDOWS', 24 * 14))
+
+
+class SlotTable:
+    """
+    Evenly spaced dispatch offsets for one organization's capacity, computed once per batch.
+    Slot i of a window starts at window_start + offsets[i]; a window holds len(offsets) slots.
+    """
+
+    def __init__(self, max_concurrent_calls=None, calls_per_second=None, average_call_seconds=AVERAGE_CALL_SECONDS):
+        max_concurrent_calls = max(1, int(max_concurrent_calls or DEFAULT_MAX_CONCURRENT_CALLS))
+        interval = average_call_seconds / max_concurrent_calls
+        if calls_per_second:
+            interval = max(interval, 1.0 / calls_per_second)
+        self.interval_seconds = interval
+        self.offsets = [datetime.timedelta(seconds=i * interval) for i in range(int(WINDOW_SECONDS // interval) or 1)]
+
+    @classmethod
+    def for_organization(cls, organization_info):
+        call_settings = organization_info.get('call_settings', {}) or {}
+        return cls(call_settings.get('max_concurrent_calls'), call_settings.get('calls_per_second'))
+
+    def slot_time(self, window_start, index):
+        return window_start + self.offsets[index]
+
+
+def _seconds_of_day(value):
+    hours, minutes = (int(part) for part in value.split(':'))
+    if not (0 <= hours <= 24 and 0 <= minutes < 60) or hours * 3600 + minutes * 60 > 86400:
+        raise ValueError(f"Invalid time of day: {value}")
+    return hours * 3600 + minutes * 60
+
+
+class CallingHours:
+    """An organization's local dialing window: one daily range on a set of weekdays (Monday=0)."""
+
+    def __init__(self, rules=None):
+        rules = {**DEFAULT_CALLING_HOURS, **(rules or {})}
+        self.start = _seconds_of_day(rules['window_start'])
+        self.end = _seconds_of_day(rules['window_end'])
+        if self.start >= self.end:
+            raise ValueError("Calling hours must start before they end")
+        self.weekdays = {int(weekday) for weekday in rules.get('weekdays') or []}
+        if not self.weekdays:
+            raise ValueError("Calling hours need at least one weekday")
+
+    @classmethod
+    def for_organization(cls, organization_info):
+        call_settings = organization_info.get('call_settings', {}) or {}
+        return cls(call_settings.get('calling_hours'))
+
+    def allowed_slots(self, window_start, slot_table, tz, not_before=None):
+        """
+        Indices of the window's slots that fall inside calling hours and not before not_before (empty
+        for windows outside them), so a slot is never handed out for a time that has already passed.
+        """
+        local = window_start.astimezone(tz)
+        if local.weekday() not in self.weekdays:
+            return []
+        hour_start = local.hour * 3600 + local.minute * 60
+        if hour_start >= self.end or hour_start + WINDOW_SECONDS <= self.start:
+            return []
+        return [
+            index for index, offset in enumerate(slot_table.offsets)
+            if self.start <= hour_start + offset.total_seconds() < self.end
+            and (not_before is None or window_start + offset >= not_before)
+        ]
+
+
+def dispatch_window_start(scheduled_for, timezone_str):
+    """Top of the local hour containing scheduled_for, as an aware UTC datetime."""
+    tz = pytz.timezone(timezone_str)
+    local = datetime.datetime.fromisoformat(scheduled_for).astimezone(tz)
+    return local.replace(minute=0, second=0, microsecond=0).astimezone(pytz.UTC)
+
+
+def next_window_start(window_start, timezone_str):
+    """Start of the local hour after window_start."""
+    return dispatch_window_start((window_start + datetime.timedelta(seconds=WINDOW_SECONDS)).isoformat(), timezone_str)
+
+
+def window_key(organization_id, window_start):
+    return f"{organization_id}_{window_start.strftime('%Y%m%dT%H%MZ')}"
+
+
+def slot_holder(flow_id, contact_id):
+    """Identifies who holds a slot, so reschedules and cancels release exactly their own."""
+    return f"{flow_id}_{contact_id}"
+
+
+@firestore.transactional
+def _reserve_slots(transaction, slot_ref, holders, allowed_indices, window_start, organization_id, interval_seconds):
+    snapshot = slot_ref.get(transaction=transaction)
+    data = snapshot.to_dict() if snapshot.exists else {}
+    slots = dict(data.get('slots') or {})
+    held = {holder: int(index) for index, holder in slots.items()}
+
+    assigned = {}
+    free = iter([index for index in allowed_indices if str(index) not in slots])
+    for holder in holders:
+        if holder in held:
+            assigned[holder] = held[holder]
+            continue
+        index = next(free, None)
+        if index is None:
+            continue
+        slots[str(index)] = holder
+        assigned[holder] = index
+
+    transaction.set(slot_ref, {
+        'organization_id': organization_id,
+        'window_start': window_start,
+        'interval_seconds': interval_seconds,
+        'slots': slots,
+        'reserved': len(slots),
+        'updated_at': firestore.SERVER_TIMESTAMP
+    })
+    return assigned
+
+
+def allocate_slots(db, organization_id, window_start, holders, slot_table, timezone_str, calling_hours, not_before=None):
+    """
+    Reserves one dispatch slot per holder, starting at window_start and spilling hour by hour.
+
+    Each window is a transaction on DispatchSchedules/{org}_{window} that records the holder of every
+    reserved slot, so concurrent reschedules of different flows for the same organization interleave
+    and spilled contacts count against the window they land in. Only slots inside calling_hours are
+    used, and none earlier than not_before (the requested time or now, whichever is later), since Cloud
+    Tasks would run every past-due task at once. A holder that already holds a slot in a window keeps it.
+
+    Returns:
+        dict of holder -> (window_start, slot_index, dispatch_time). Holders that could not be placed
+        within MAX_SPILL_WINDOWS windows are missing.
+    """
+    tz = pytz.timezone(timezone_str)
+    remaining = list(holders)
+    placed = {}
+    for _ in range(MAX_SPILL_WINDOWS):
+        if not remaining:
+            break
+        allowed_indices = calling_hours.allowed_slots(window_start, slot_table, tz, not_before)
+        if allowed_indices:
+            slot_ref = db.collection(SLOT_COLLECTION).document(window_key(organization_id, window_start))
+            assigned = _reserve_slots(
+                db.transaction(), slot_ref, remaining, allowed_indices, window_start, organization_id, slot_table.interval_seconds
+            )
+            for holder, index in assigned.items():
+                placed[holder] = (window_start, index, slot_table.slot_time(window_start, index))
+            remaining = [holder for holder in remaining if holder not in assigned]
+        window_start = next_window_start(window_start, timezone_str)
+    return placed
+
+
+@firestore.transactional
+def _release_slots(transaction, slot_ref, releases):
+    snapshot = slot_ref.get(transaction=transaction)
+    if not snapshot.exists:
+        return 0
+    slots = dict((snapshot.to_dict() or {}).get('slots') or {})
+    released = 0
+    for index, holder in releases:
+        if slots.get(str(index)) == holder:
+            del slots[str(index)]
+            released += 1
+    if released:
+        transaction.update(slot_ref, {'slots': slots, 'reserved': len(slots), 'updated_at': firestore.SERVER_TIMESTAMP})
+    return released
+
+
+def release_slots(db, held_slots):
+    """
+    Frees slots when their contact is rescheduled or its flow canceled. held_slots is an iterable of
+    (window_key, slot_index, holder); a slot is only freed while it still belongs to that holder.
+    Returns the number of slots released.
+    """
+    by_window = {}
+    for key, index, holder in held_slots:
+        by_window.setdefault(key, []).append((index, holder))
+    released = 0
+    for key, releases in by_window.items():
+        released += _release_slots(db.transaction(), db.collection(SLOT_COLLECTION).document(key), releases)
+    return released
+
+
+def held_slot(active_flow, flow_id, contact_id):
+    """(window_key, slot_index, holder) recorded on an active flow by batch_reschedule_flow, or None."""
+    dispatch_slot = (active_flow or {}).get('dispatch_slot')
+    if not dispatch_slot:
+        return None
+    return dispatch_slot['window'], dispatch_slot['index'], slot_holder(flow_id, contact_id)
@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import uuid
+import pytz
+from google.api_core import exceptions
+from google.cloud import tasks_v2
+from google.protobuf import timestamp_pb2
+
+PROJECT_ID = 'heyisaai'
+LOCATION = 'us-central1'
+QUEUE_NAME = 'scheduled-flows'
+SERVICE_ACCOUNT_EMAIL = "54875993561-compute@developer.gserviceaccount.com"
+URL_MAP = {
+    'Engage': "https://us-central1-heyisaai.cloudfunctions.net/scheduled_engage",
+    'Revive': "https://us-central1-heyisaai.cloudfunctions.net/scheduled_revive"
+}
+
+
+def task_name_for(flow_id, contact_id, generation):
+    """
+    Deterministic task ID for one contact of one flow schedule generation. Creating the same name
+    twice is rejected by Cloud Tasks, so retries and repeated sweeps cannot enqueue duplicates.
+    """
+    base = re.sub(r'[^A-Za-z0-9_-]', '_', f"{flow_id}-{contact_id}-g{generation}")
+    # A hash prefix spreads names across the queue's key range instead of clustering on flow_id
+    prefix = hashlib.sha1(base.encode('utf-8')).hexdigest()[:8]
+    return f"{prefix}-{base}"[:500]
+
+
+class CloudTasksQueue:
+    """The scheduled-flows Cloud Tasks queue."""
+
+    def __init__(self, project_id=PROJECT_ID, location=LOCATION, queue_name=QUEUE_NAME):
+        self.project_id = project_id
+        self.location = location
+        self.queue_name = queue_name
+        self.client = tasks_v2.CloudTasksClient()
+
+    def create(self, task_type, payload, dispatch_datetime, task_id=None):
+        """
+        Creates an HTTP task that fires at dispatch_datetime and returns its task ID. With a task_id,
+        a task that already exists under that name is kept and its ID returned.
+        """
+        schedule_time = timestamp_pb2.Timestamp()
+        schedule_time.FromDatetime(dispatch_datetime.astimezone(pytz.UTC))
+
+        task = {
+            "schedule_time": schedule_time,
+            "http_request": {
+                "http_method": tasks_v2.HttpMethod.POST,
+                "url": URL_MAP[task_type],
+                "oidc_token": {
+                    "service_account_email": SERVICE_ACCOUNT_EMAIL
+                },
+                "headers": {"Content-Type": "application/json"},
+                "body": json.dumps(payload).encode()
+            }
+        }
+        if task_id:
+            task["name"] = self.client.task_path(self.project_id, self.location, self.queue_name, task_id)
+        parent = self.client.queue_path(self.project_id, self.location, self.queue_name)
+        try:
+            response = self.client.create_task(parent=parent, task=task)
+        except exceptions.AlreadyExists:
+            return task_id
+        return response.name.split('/')[-1]
+
+    def delete(self, task_id):
+        self.client.delete_task(name=self.client.task_path(self.project_id, self.location, self.queue_name, task_id))
+
+
+class LocalTaskQueue:
+    """In-memory stand-in for CloudTasksQueue, for local runs and tests (SCHEDULER_QUEUE=local)."""
+
+    def __init__(self):
+        self.tasks = {}
+        self._lock = threading.Lock()
+
+    def create(self, task_type, payload, dispatch_datetime, task_id=None):
+        if task_type not in URL_MAP:
+            raise KeyError(task_type)
+        task_id = task_id or uuid.uuid4().hex
+        with self._lock:
+            if task_id in self.tasks:
+                return task_id
+            self.tasks[task_id] = {
+                "task_type": task_type,
+                "payload": json.loads(json.dumps(payload)),
+                "schedule_time": dispatch_datetime.astimezone(pytz.UTC)
+            }
+        return task_id
+
+    def delete(self, task_id):
+        with self._lock:
+            if self.tasks.pop(task_id, None) is None:
+                raise KeyError(task_id)
+
+    def due(self, now):
+        """Tasks whose schedule time has passed, oldest first."""
+        with self._lock:
+            return sorted(
+                ((task_id, task) for task_id, task in self.tasks.items() if task["schedule_time"] <= now),
+                key=lambda item: item[1]["schedule_time"]
+            )
+
+
+_local_queue = LocalTaskQueue()
+
+
+def get_task_queue():
+    if os.environ.get('SCHEDULER_QUEUE', 'cloud_tasks') == 'local':
+        return _local_queue
+    return CloudTasksQueue()
@@ -0,0 +1,243 @@
+import copy
+import datetime
+
+import pytest
+import pytz
+
+pytest.importorskip('firebase_admin')
+pytest.importorskip('google.cloud.tasks_v2')
+
+from google.api_core import exceptions
+
+import deferred_scheduler
+from deferred_scheduler import DEFERRED_COLLECTION, defer_task, materialize_deferred_task, sweep_deferred_tasks
+from task_queue import LocalTaskQueue, task_name_for
+
+NOW = datetime.datetime(2026, 3, 2, 12, 0, tzinfo=pytz.UTC)
+
+
+class FakeSnapshot:
+    def __init__(self, ref, data, update_time):
+        self.reference = ref
+        self.id = ref.id
+        self.exists = data is not None
+        self.update_time = update_time
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+
+class FakeDocumentRef:
+    def __init__(self, db, collection, document_id):
+        self._db = db
+        self.collection_name = collection
+        self.id = document_id
+        self.path = f"{collection}/{document_id}"
+
+    def get(self):
+        data = self._db.documents.get(self.path)
+        return FakeSnapshot(self, data, self._db.update_times.get(self.path))
+
+    def set(self, data, merge=False):
+        current = self._db.documents.get(self.path, {}) if merge else {}
+        self._db.write(self.path, {**current, **data})
+
+    def update(self, data, option=None):
+        if self.path not in self._db.documents:
+            raise exceptions.NotFound(self.path)
+        if option is not None and option != self._db.update_times.get(self.path):
+            raise exceptions.FailedPrecondition(self.path)
+        self._db.write(self.path, {**self._db.documents[self.path], **data})
+
+
+class FakeQuery:
+    OPERATORS = {'==': lambda a, b: a == b, '<': lambda a, b: a is not None and a < b}
+
+    def __init__(self, db, collection, filters=()):
+        self._db = db
+        self._collection = collection
+        self._filters = filters
+
+    def where(self, field, op, value):
+        return FakeQuery(self._db, self._collection, self._filters + ((field, op, value),))
+
+    def stream(self):
+        prefix = f"{self._collection}/"
+        for path in sorted(self._db.documents):
+            data = self._db.documents[path]
+            if path.startswith(prefix) and all(self.OPERATORS[op](data.get(field), value) for field, op, value in self._filters):
+                yield FakeDocumentRef(self._db, self._collection, path[len(prefix):]).get()
+
+
+class FakeCollection(FakeQuery):
+    def document(self, document_id):
+        return FakeDocumentRef(self._db, self._collection, document_id)
+
+
+class FakeDB:
+    """Enough of the Firestore client for the sweeper: documents, equality/less-than queries, preconditions."""
+
+    def __init__(self):
+        self.documents = {}
+        self.update_times = {}
+        self._clock = 0
+
+    def write(self, path, data):
+        self._clock += 1
+        self.documents[path] = data
+        self.update_times[path] = self._clock
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def write_option(self, last_update_time):
+        return last_update_time
+
+
+def payload(contact_id, generation=1):
+    return {'flow_id': 'f1', 'contact_id': contact_id, 'schedule_generation': generation}
+
+
+def deferred_contact(db, contact_id, generation=1):
+    db.write(f"Contacts/{contact_id}", {
+        'activeFlows': [{'flow_id': 'f1', 'deferred': True, 'schedule_generation': generation, 'cloud_task_id': None}]
+    })
+
+
+@pytest.fixture
+def db():
+    return FakeDB()
+
+
+@pytest.fixture
+def queue():
+    return LocalTaskQueue()
+
+
+def test_defer_writes_one_entry_per_flow_and_contact(db):
+    dispatch = NOW + datetime.timedelta(days=10, minutes=17)
+    defer_task(db, 'Engage', payload('c1'), dispatch)
+    defer_task(db, 'Engage', payload('c1', generation=2), dispatch + datetime.timedelta(hours=1))
+
+    entries = [path for path in db.documents if path.startswith(DEFERRED_COLLECTION)]
+    assert entries == [f"{DEFERRED_COLLECTION}/f1_c1"]
+    entry = db.documents[entries[0]]
+    assert entry['status'] == 'deferred'
+    assert entry['bucket'] == '2026-03-12T13'
+    assert entry['payload']['schedule_generation'] == 2
+
+
+def test_should_defer_only_past_the_window():
+    assert not deferred_scheduler.should_defer(NOW + datetime.timedelta(hours=1), NOW)
+    assert deferred_scheduler.should_defer(NOW + deferred_scheduler.MATERIALIZE_WINDOW + datetime.timedelta(hours=2), NOW)
+
+
+def test_sweep_materializes_entries_inside_the_window(db, queue):
+    dispatch = NOW + datetime.timedelta(hours=5)
+    deferred_contact(db, 'c1')
+    defer_task(db, 'Engage', payload('c1'), dispatch)
+    # Outside the window: stays deferred
+    deferred_contact(db, 'c2')
+    defer_task(db, 'Engage', payload('c2'), NOW + datetime.timedelta(days=20))
+
+    result = sweep_deferred_tasks(db, lambda entry: materialize_deferred_task(db, entry, queue), now=NOW)
+
+    assert result == (1, 0, 0)
+    task_id = task_name_for('f1', 'c1', 1)
+    assert queue.tasks[task_id]['schedule_time'] == dispatch
+    assert db.documents[f"{DEFERRED_COLLECTION}/f1_c1"]['status'] == 'materialized'
+    assert db.documents[f"{DEFERRED_COLLECTION}/f1_c2"]['status'] == 'deferred'
+    active_flow = db.documents['Contacts/c1']['activeFlows'][0]
+    assert active_flow['cloud_task_id'] == task_id and active_flow['deferred'] is False
+
+    # The cursor has passed the bucket, so a second sweep reads nothing new
+    assert sweep_deferred_tasks(db, lambda entry: materialize_deferred_task(db, entry, queue), now=NOW) == (0, 0, 0)
+
+
+def test_superseded_entry_creates_no_task(db, queue):
+    deferred_contact(db, 'c1', generation=2)  # rescheduled after the entry was written
+    defer_task(db, 'Engage', payload('c1', generation=1), NOW + datetime.timedelta(hours=5))
+
+    result = sweep_deferred_tasks(db, lambda entry: materialize_deferred_task(db, entry, queue), now=NOW)
+
+    assert result == (0, 1, 0)
+    assert queue.tasks == {}
+    assert db.documents[f"{DEFERRED_COLLECTION}/f1_c1"]['status'] == 'superseded'
+
+
+def test_failing_entry_does_not_block_the_cursor(db, queue):
+    for contact_id, hours in (('c1', 3), ('c2', 4)):
+        deferred_contact(db, contact_id)
+        defer_task(db, 'Engage', payload(contact_id), NOW + datetime.timedelta(hours=hours))
+    db.documents[f"{DEFERRED_COLLECTION}/f1_c1"]['dispatch_time'] = 'not a time'
+
+    result = sweep_deferred_tasks(db, lambda entry: materialize_deferred_task(db, entry, queue), now=NOW)
+
+    assert result == (1, 0, 1)
+    failed = db.documents[f"{DEFERRED_COLLECTION}/f1_c1"]
+    assert failed['status'] == 'failed' and failed['attempts'] == 1 and 'not a time' in failed['error']
+    assert db.documents[f"{DEFERRED_COLLECTION}/f1_c2"]['status'] == 'materialized'
+    last_bucket = deferred_scheduler.materialize_horizon(NOW) - datetime.timedelta(hours=1)
+    assert db.documents['SchedulerState/deferred_sweep']['swept_through'] == last_bucket.strftime(deferred_scheduler.BUCKET_FORMAT)
+
+    # Retried on later sweeps until the attempt limit, then left alone
+    for _ in range(deferred_scheduler.MAX_MATERIALIZE_ATTEMPTS + 2):
+        sweep_deferred_tasks(db, lambda entry: materialize_deferred_task(db, entry, queue), now=NOW)
+    assert db.documents[f"{DEFERRED_COLLECTION}/f1_c1"]['attempts'] == deferred_scheduler.MAX_MATERIALIZE_ATTEMPTS
+
+
+def test_failed_entry_is_retried_and_materialized(db, queue):
+    deferred_contact(db, 'c1')
+    defer_task(db, 'Engage', payload('c1'), NOW + datetime.timedelta(hours=3))
+    calls = []
+
+    def flaky(entry):
+        calls.append(entry)
+        if len(calls) == 1:
+            raise exceptions.ServiceUnavailable('queue unavailable')
+        return materialize_deferred_task(db, entry, queue)
+
+    assert sweep_deferred_tasks(db, flaky, now=NOW) == (0, 0, 1)
+    assert sweep_deferred_tasks(db, flaky, now=NOW) == (1, 0, 0)
+    assert db.documents[f"{DEFERRED_COLLECTION}/f1_c1"]['status'] == 'materialized'
+
+
+def test_concurrent_contact_update_is_kept(db, queue, monkeypatch):
+    deferred_contact(db, 'c1')
+    defer_task(db, 'Engage', payload('c1'), NOW + datetime.timedelta(hours=3))
+    entry = db.documents[f"{DEFERRED_COLLECTION}/f1_c1"]
+
+    create = queue.create
+
+    def create_then_contact_changes(*args):
+        task_id = create(*args)
+        contact = db.documents['Contacts/c1']
+        db.write('Contacts/c1', {**contact, 'status': 'replied'})
+        return task_id
+
+    monkeypatch.setattr(queue, 'create', create_then_contact_changes)
+    task_id = materialize_deferred_task(db, entry, queue)
+
+    contact = db.documents['Contacts/c1']
+    assert contact['status'] == 'replied'
+    assert contact['activeFlows'][0]['cloud_task_id'] == task_id
+    assert list(queue.tasks) == [task_id]
+
+
+def test_superseded_during_write_deletes_the_new_task(db, queue, monkeypatch):
+    deferred_contact(db, 'c1')
+    defer_task(db, 'Engage', payload('c1'), NOW + datetime.timedelta(hours=3))
+    entry = db.documents[f"{DEFERRED_COLLECTION}/f1_c1"]
+
+    create = queue.create
+
+    def create_then_rescheduled(*args):
+        task_id = create(*args)
+        deferred_contact(db, 'c1', generation=2)
+        return task_id
+
+    monkeypatch.setattr(queue, 'create', create_then_rescheduled)
+
+    assert materialize_deferred_task(db, entry, queue) is None
+    assert queue.tasks == {}
@@ -0,0 +1,36 @@
+import datetime
+
+import pytest
+import pytz
+
+pytest.importorskip('firebase_admin')
+
+from slot_allocator import CallingHours, SlotTable
+
+EASTERN = pytz.timezone('US/Eastern')
+# 10:00 EST on a Tuesday
+WINDOW_START = datetime.datetime(2026, 3, 3, 15, 0, tzinfo=pytz.UTC)
+
+
+def test_slots_before_not_before_are_dropped():
+    table = SlotTable(max_concurrent_calls=10)
+    not_before = WINDOW_START + datetime.timedelta(minutes=55)
+    allowed = CallingHours().allowed_slots(WINDOW_START, table, EASTERN, not_before)
+    assert allowed
+    assert all(table.slot_time(WINDOW_START, index) >= not_before for index in allowed)
+    assert table.slot_time(WINDOW_START, allowed[0]) - not_before < datetime.timedelta(seconds=table.interval_seconds)
+
+
+def test_whole_window_when_not_before_is_earlier():
+    table = SlotTable(max_concurrent_calls=10)
+    allowed = CallingHours().allowed_slots(WINDOW_START, table, EASTERN, WINDOW_START - datetime.timedelta(hours=1))
+    assert allowed == list(range(len(table.offsets)))
+
+
+def test_calling_hours_clamp_the_window():
+    table = SlotTable(max_concurrent_calls=10)
+    hours = CallingHours({'window_start': '10:30', 'window_end': '21:00'})
+    allowed = hours.allowed_slots(WINDOW_START, table, EASTERN)
+    assert table.slot_time(WINDOW_START, allowed[0]) == WINDOW_START + datetime.timedelta(minutes=30)
+    weekend = datetime.datetime(2026, 3, 7, 15, 0, tzinfo=pytz.UTC)
+    assert CallingHours({'weekdays': [0, 1, 2, 3, 4]}).allowed_slots(weekend, table, EASTERN) == []
@@ -0,0 +1,93 @@
+# log_utils.py
+
+import hashlib
+import json
+import os
+import random
+
+# Emitted as one JSON line per event so Cloud Logging parses severity and fields
+LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40}
+LOG_LEVEL = LEVELS.get(os.getenv('LOG_LEVEL', 'INFO').upper(), 20)
+
+# Share of debug events that are actually written
+DEBUG_SAMPLE_RATE = float(os.getenv('LOG_DEBUG_SAMPLE_RATE', 0.01))
+# Longest string value written for any single field
+MAX_FIELD_CHARS = int(os.getenv('LOG_MAX_FIELD_CHARS', 200))
+MAX_LIST_ITEMS = 10
+MAX_DEPTH = 4
+
+# Secrets: never written
+REDACTED_FIELDS = {'authorization', 'encrypted_key', 'org_key', 'api_key', 'bland_api_key', 'password', 'token', 'credentials'}
+# Contact PII: only the last few characters are written
+MASKED_FIELDS = {'phonenumber', 'phone_number', 'phone', 'contact_phone', 'from', 'to', 'email', 'contact_email'}
+# Large bodies (prompts, knowledge bases, transcripts): replaced by a digest
+HASHED_FIELDS = {'task', 'prompt', 'knowledge_base', 'knowledge_base_info', 'pronunciation_guide', 'voicemail_message',
+                 'email_body', 'concatenated_transcript', 'transcript', 'prompt_string'}
+
+
+def digest(value):
+    """Short content hash and size of a value, logged in place of the value itself."""
+    if not isinstance(value, (str, bytes)):
+        value = json.dumps(value, sort_keys=True, default=str)
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    return f"sha256:{hashlib.sha256(value).hexdigest()[:16]} ({len(value)} bytes)"
+
+
+def _mask(value):
+    text = str(value)
+    return f"***{text[-4:]}" if len(text) > 4 else "***"
+
+
+def _truncate(text):
+    if len(text) <= MAX_FIELD_CHARS:
+        return text
+    return f"{text[:MAX_FIELD_CHARS]}...(+{len(text) - MAX_FIELD_CHARS} chars)"
+
+
+def sanitize(value, depth=0):
+    """Returns a copy of value that is safe and small enough to log."""
+    if isinstance(value, dict):
+        if depth >= MAX_DEPTH:
+            return f"<dict {len(value)} keys>"
+        sanitized = {}
+        for key, item in value.items():
+            lowered = str(key).lower()
+            if lowered in REDACTED_FIELDS:
+                sanitized[key] = "[REDACTED]" if item else item
+            elif item in (None, ''):
+                sanitized[key] = item
+            elif lowered in MASKED_FIELDS:
+                sanitized[key] = _mask(item)
+            elif lowered in HASHED_FIELDS:
+                sanitized[key] = digest(item)
+            else:
+                sanitized[key] = sanitize(item, depth + 1)
+        return sanitized
+    if isinstance(value, (list, tuple)):
+        if depth >= MAX_DEPTH:
+            return f"<list {len(value)} items>"
+        items = [sanitize(item, depth + 1) for item in value[:MAX_LIST_ITEMS]]
+        if len(value) > MAX_LIST_ITEMS:
+            items.append(f"...(+{len(value) - MAX_LIST_ITEMS} items)")
+        return items
+    if isinstance(value, (int, float, bool)) or value is None:
+        return value
+    return _truncate(str(value))
+
+
+def log_event(message, severity='INFO', **fields):
+    """Writes one structured, redacted and size-bounded log line."""
+    level = LEVELS.get(severity, 20)
+    if level < LOG_LEVEL:
+        return
+    if level == LEVELS['DEBUG'] and random.random() >= DEBUG_SAMPLE_RATE:
+        return
+    entry = {"severity": severity, "message": message}
+    entry.update(sanitize(fields))
+    print(json.dumps(entry, default=str))
+
+
+def log_debug(message, **fields):
+    """Sampled debug event; only LOG_DEBUG_SAMPLE_RATE of calls are written."""
+    log_event(message, severity='DEBUG', **fields)
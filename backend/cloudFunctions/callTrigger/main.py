@@ -15,6 +15,8 @@ import pytz
     
 import firebase_admin
 from firebase_admin import firestore
+from log_utils import log_event, log_debug, digest
+from flow_history import update_contact_with_history
 
 # Initialize Firebase Admin SDK once globally
 if not firebase_admin._apps:
@@ -76,7 +78,7 @@ def update_contact_flow(contact_id, flow_id, max_attempts):
                         active_flows.remove(flow)
                     break
             
-            contact_ref.update({
+            update_contact_with_history(db, contact_ref, {
                 'activeFlows': active_flows,
                 'finishedFlows': finished_flows,
                 'lastCallAttempt': datetime.datetime.utcnow().isoformat()
@@ -106,7 +108,7 @@ def process_html(html_content):
     Converts HTML content to plain text. 
     Assumes html_content is a string containing HTML.
     """
-    print(f"Processing HTML content: {html_content}")
+    log_debug("Processing HTML content", html_content=html_content)
     soup = BeautifulSoup(html_content, 'html.parser')
     plain_text = soup.get_text(separator='\n')
     print("HTML content processed successfully.")
@@ -121,7 +123,7 @@ def craft_prompt(knowledge_base, rules_and_guidelines, prompt_ref, organization_
     # Extracting contact info
     print("Extracting and formatting contact information...")
     contact_address = contact_info.get('address',{})
-    print(f"Extracted contact address: {contact_address}")
+    log_debug("Extracted contact address", contact_address=contact_address)
 
     contact_formatted = {
         'contact_first_name': contact_info.get('firstName', ''),
@@ -172,7 +174,7 @@ def craft_prompt(knowledge_base, rules_and_guidelines, prompt_ref, organization_
 
     # Assembling all components
     rules_text = rules_and_guidelines.get('rules_and_guidelines', '') 
-    print(f"Rules and guidelines text: {rules_text}")
+    log_debug("Rules and guidelines text", rules_text=digest(rules_text))
 
     all_prompt_components = [
         rules_text, prompt_logic, default_prompt_start, prompt_body, default_prompt_end, org_info_text, 
@@ -182,7 +184,7 @@ def craft_prompt(knowledge_base, rules_and_guidelines, prompt_ref, organization_
 
     # Joining components
     prompt_string = '\n'.join(filter(None, all_prompt_components))
-    print(f"Final prompt string:\n{prompt_string}")
+    log_event("Final prompt string assembled", prompt_string=prompt_string)
     
     # Placeholder for default voice settings, potentially to be filled with actual values.
     default_voice_settings = {}
@@ -198,7 +200,7 @@ def craft_prompt(knowledge_base, rules_and_guidelines, prompt_ref, organization_
         voice_settings.setdefault(key, default_value)
     
     # Print the current voice settings for debugging or information purposes.
-    print(f'Voice settings: {voice_settings}')
+    log_event("Voice settings", voice_settings=voice_settings)
 
     # Attempts to retrieve the 'outbound' phone number from organization_info. In case of any exception, defaults to None.
     try:
@@ -372,7 +374,7 @@ def trigger_phone_call(request):
             call_settings = organization_info.get('call_settings', {})
             call_settings['transfer_phone_number'] = transfer_number_from_flow_settings
             call_settings['encrypted_key'] = organization_info.get('twilio', {}).get('encrypted_key', {}) ####THIS IS NEW
-            print(f'Call settings: {call_settings}')
+            log_event("Call settings", call_settings=call_settings)
         except AttributeError:
             print("Call settings not found or not a dictionary. Using an empty dictionary instead.")
             call_settings = {}
@@ -385,7 +387,6 @@ def trigger_phone_call(request):
             contact_info=contact_info,
             call_settings=call_settings
         )
-        #print(f'Crafted payload: {crafted_payload}')
 
         url = "https://isa.bland.ai/v1/calls"
         headers = {
@@ -393,9 +394,11 @@ def trigger_phone_call(request):
             "Content-Type": "application/json",
             "encrypted_key": call_settings.get('encrypted_key', None)
         }
-        #print(f'Making POST request to {url} with headers {headers} and payload {crafted_payload}')
+        log_event("Sending request to Bland AI", url=url, phone_number=crafted_payload.get('phone_number'),
+                  payload=digest(crafted_payload), headers=headers)
+        log_debug("Bland AI request payload", payload=crafted_payload)
         response = requests.post(url, json=crafted_payload, headers=headers)
-        #print(f'Received response: {response.status_code} {response.text}')
+        log_event("Received response from Bland AI", status_code=response.status_code)
 
         if response.status_code == 200:
             response_data = response.json()
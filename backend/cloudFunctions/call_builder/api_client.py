@@ -1,12 +1,15 @@
 import requests
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from config import config
 from secret_manager import access_secret_version
+from log_utils import log_event, log_debug, digest
 
 def send_bland_ai_request(payload):
     url = config.get('bland_ai_url', "https://isa.bland.ai/v1/calls")
     project_id = config.get('project_id')#NOT WORKING
-    print (payload) #Debugging Payload
     api_key = access_secret_version('heyisaai', 'bland-api-key') #hard coded the project ID
     
     if not api_key:
@@ -19,15 +22,69 @@ def send_bland_ai_request(payload):
         "encrypted_key": payload.get('encrypted_key')
     }
 
-    print(f"Sending request to Bland AI. URL: {url}")
-    print(f"Request headers: {headers}")
-    print(f"Request payload: {payload}")
+    # Bodies are logged as a digest; the full (redacted) payload only on sampled debug lines
+    log_event("Sending request to Bland AI", url=url, phone_number=payload.get('phone_number'),
+              payload=digest(payload), headers=headers)
+    log_debug("Bland AI request payload", payload=payload)
 
     try:
         response = requests.post(url, json=payload, headers=headers)
-        logging.info(f"Received response from Bland AI. Status code: {response.status_code}")
-        logging.debug(f"Response content: {response.text}")
+        log_event("Received response from Bland AI", status_code=response.status_code,
+                  phone_number=payload.get('phone_number'))
+        log_debug("Bland AI response content", response=response.text)
         return response
     except requests.RequestException as e:
         logging.error(f"Error sending request to Bland AI: {str(e)}")
-        return None
\ No newline at end of file
+        return None
+
+class RateLimiter:
+    """Spaces request starts at least 1 / calls_per_second apart across threads."""
+
+    def __init__(self, calls_per_second=None):
+        self.interval = 1.0 / calls_per_second if calls_per_second else 0.0
+        self.next_slot = time.monotonic()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class RequestFailure:
+    """Result for a payload whose send raised, in place of its response."""
+
+    def __init__(self, error):
+        self.error = error
+
+    def __repr__(self):
+        return f"RequestFailure({self.error!r})"
+
+
+def send_bland_ai_requests(payloads, max_concurrency=10, calls_per_second=None):
+    """
+    Sends many payloads to Bland AI concurrently, with at most max_concurrency requests in flight and
+    starts paced to calls_per_second. Returns one result per payload, in payload order: the response,
+    None, or a RequestFailure when sending raised. Other calls may already be placed by then, so one
+    bad payload must not turn the whole batch into an exception.
+    """
+    if not payloads:
+        return []
+
+    rate_limiter = RateLimiter(calls_per_second)
+
+    def send(payload):
+        rate_limiter.wait()
+        try:
+            return send_bland_ai_request(payload)
+        except Exception as e:
+            logging.error(f"Error sending request to Bland AI for {payload.get('phone_number')}: {str(e)}")
+            return RequestFailure(str(e))
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(payloads)))) as executor:
+        return list(executor.map(send, payloads))
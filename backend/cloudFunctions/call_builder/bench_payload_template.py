@@ -0,0 +1,93 @@
+"""
+Benchmark for payload building in a bulk dial: PayloadFactory.create_payload (template cache lookup
+plus PayloadTemplate.render) against building every payload with the uncached create_standard_payload,
+for a flow with a large knowledge base.
+
+    python bench_payload_template.py [--contacts 10000] [--kb-chars 200000]
+"""
+import argparse
+import datetime
+import sys
+import threading
+import time
+from types import MappingProxyType, SimpleNamespace
+
+# config and database_ops create Cloud clients at import; the benchmark needs neither
+sys.modules.setdefault('config', SimpleNamespace(config={}))
+sys.modules.setdefault('database_ops', SimpleNamespace(get_organization_config=lambda org_id: {}))
+
+from payload_factory import ConfigSnapshot, PayloadFactory
+from payload_template import PayloadTemplateCache
+from time_utils import ClockSnapshot
+
+
+def make_factory():
+    """A PayloadFactory with a fixed config snapshot instead of one loaded from GCS."""
+    factory = object.__new__(PayloadFactory)
+    factory.bucket_name = None
+    factory._refresh_lock = threading.Lock()
+    factory._last_checked = time.monotonic()
+    factory.snapshot = ConfigSnapshot(
+        tuple({'word': f"word{index}", 'pronunciation': f"wurd {index}"} for index in range(50)),
+        MappingProxyType({'default_model': 'enhanced', 'default_voice': 'maya'}),
+        {'pronunciation_guide.json': 7, 'payload_defaults.json': 3}
+    )
+    factory.template_cache = PayloadTemplateCache()
+    return factory
+
+
+def flow_inputs(kb_chars):
+    now = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+    inputs = {
+        'knowledge_base': {'id': 'kb1', 'knowledge_base_text': 'Q: pricing? A: it depends. ' * (kb_chars // 27)},
+        'rules_and_guidelines': {'id': 'r1', 'rules': ['Be polite.'] * 200},
+        'prompt_ref': {'id': 's1', 'prompt': '<p>Hello there</p>' * 500},
+        'organization_info': {'id': 'o1', 'org_name': 'Acme Realty', 'timezone': 'US/Eastern', 'call_settings': {'voice': 'maya'}},
+        'call_settings': {'voice': 'maya', 'max_duration': 300},
+        'flow_doc': {'id': 'f1', 'value_link': 'https://example.com'},
+        'is_test': False,
+        'org_config': {},
+    }
+    versions = {path: now for path in ('Flows/f1', 'Organizations/o1', 'KnowledgeBases/kb1', 'Rules/r1', 'Scripts/s1')}
+    return inputs, versions
+
+
+def make_contacts(count):
+    return [
+        {'id': f"c{index}", 'firstName': f"Name{index}", 'phoneNumber': f"1555{index:07d}",
+         'address': {'street': f"{index} Main St", 'city': 'Austin'}}
+        for index in range(count)
+    ]
+
+
+def bench(build, contacts):
+    """Payloads per second for building one payload per contact."""
+    started = time.perf_counter()
+    for contact_info in contacts:
+        build(contact_info)
+    return len(contacts) / (time.perf_counter() - started)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--contacts', type=int, default=10000)
+    parser.add_argument('--kb-chars', type=int, default=200000)
+    args = parser.parse_args()
+    factory = make_factory()
+    inputs, versions = flow_inputs(args.kb_chars)
+    contacts = make_contacts(args.contacts)
+    # One clock per bulk dial, as load_batch_call_contexts does
+    clock = ClockSnapshot()
+    snapshot = factory.current_snapshot()
+
+    uncached = bench(lambda contact_info: factory.create_standard_payload(
+        contact_info=contact_info, clock=clock, config_snapshot=snapshot, **inputs), contacts)
+    versioned = bench(lambda contact_info: factory.create_payload(
+        'standard', contact_info=contact_info, clock=clock, document_versions=versions, **inputs), contacts)
+    factory.template_cache.clear()
+    hashed = bench(lambda contact_info: factory.create_payload(
+        'standard', contact_info=contact_info, clock=clock, **inputs), contacts)
+
+    print(f"uncached create_standard_payload:   {uncached:10.0f} payloads/s for {args.contacts} contacts")
+    print(f"template, document version key:     {versioned:10.0f} payloads/s ({versioned / uncached:.1f}x)")
+    print(f"template, content hash key:         {hashed:10.0f} payloads/s ({hashed / uncached:.1f}x)")
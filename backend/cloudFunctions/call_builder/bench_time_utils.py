@@ -0,0 +1,43 @@
+"""
+Benchmark for day-part lookups in a bulk dial: the original per-call pytz lookup and clock read
+against one shared ClockSnapshot.
+
+    python bench_time_utils.py [--contacts 10000]
+"""
+import argparse
+import datetime
+import random
+import time
+import pytz
+from time_utils import ClockSnapshot
+
+ZONES = ['US/Eastern', 'US/Central', 'US/Mountain', 'US/Pacific', 'America/Phoenix', 'US/Alaska', 'Pacific/Honolulu']
+
+
+def original_day_time(timezone_str):
+    now = datetime.datetime.now(pytz.timezone(timezone_str))
+    return now.strftime('%A'), "morning" if now.hour < 12 else "afternoon"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--contacts', type=int, default=10000)
+    args = parser.parse_args()
+    zones = random.Random(0).choices(ZONES, k=args.contacts)
+
+    started = time.perf_counter()
+    for zone in zones:
+        # Greeting and voicemail each looked the time up separately
+        original_day_time(zone)
+        original_day_time(zone)
+    original_ms = (time.perf_counter() - started) * 1000.0
+
+    started = time.perf_counter()
+    clock = ClockSnapshot()
+    for zone in zones:
+        clock.day_time(zone)
+        clock.day_time(zone)
+    snapshot_ms = (time.perf_counter() - started) * 1000.0
+
+    print(f"per-call lookups: {original_ms:8.2f} ms for {args.contacts} contacts")
+    print(f"shared snapshot:  {snapshot_ms:8.2f} ms for {args.contacts} contacts")
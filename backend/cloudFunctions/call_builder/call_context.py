@@ -0,0 +1,123 @@
+# call_context.py
+
+from database_ops import db
+from time_utils import ClockSnapshot
+
+
+class CallContext:
+    """
+    Documents fetched once for a call_builder request and handed to every stage that needs them,
+    so the Flow, Organization and Contact documents are each read exactly once.
+    """
+
+    def __init__(self, flow_doc, organization_info, contact_info, contact_update_time=None, clock=None, document_versions=None):
+        self.flow_doc = flow_doc
+        self.organization_info = organization_info
+        self.contact_info = contact_info
+        # Lets update_contact_flow write against the snapshot it was read from
+        self.contact_update_time = contact_update_time
+        # Greetings and voicemails of the request all read the same clock
+        self.clock = clock or ClockSnapshot()
+        # {document path: update_time} of the flow-level documents the payload template is built from
+        self.document_versions = document_versions if document_versions is not None else {}
+
+    @property
+    def org_config(self):
+        return self.organization_info.get('config', {})
+
+    @property
+    def active_flows(self):
+        active_flows = self.contact_info.get('activeFlows', [])
+        return active_flows if isinstance(active_flows, list) else []
+
+    @property
+    def finished_flows(self):
+        return self.contact_info.get('finishedFlows', [])
+
+    def get_call_count(self, flow_id):
+        """Same as database_ops.get_call_count, answered from the already-fetched contact."""
+        if not isinstance(self.contact_info.get('activeFlows', []), list):
+            print(f"Warning: activeFlows for contact {self.contact_info.get('id')} is not a list. Returning 0.")
+            return 0
+        for flow in self.active_flows:
+            if isinstance(flow, dict) and flow.get('flow_id') == flow_id:
+                return flow.get('callCounter', 0)
+        return 0
+
+
+def _snapshot_to_dict(snapshot):
+    if snapshot is None or not snapshot.exists:
+        return None
+    data = snapshot.to_dict()
+    data['id'] = snapshot.id  # Add the document ID to the data
+    return data
+
+
+def load_call_context(request_json):
+    """
+    Reads the Flow, Organization and Contact documents for a request in a single batched get.
+
+    Raises:
+        ValueError: If any of the documents does not exist.
+    """
+    refs = [
+        db.collection('Flows').document(request_json['flow_id']),
+        db.collection('Organizations').document(request_json['organization_id']),
+        db.collection('Contacts').document(request_json['contact_id'])
+    ]
+    snapshots = {snapshot.reference.path: snapshot for snapshot in db.get_all(refs)}
+    flow_snapshot, organization_snapshot, contact_snapshot = (snapshots.get(ref.path) for ref in refs)
+
+    flow_doc = _snapshot_to_dict(flow_snapshot)
+    organization_info = _snapshot_to_dict(organization_snapshot)
+    contact_info = _snapshot_to_dict(contact_snapshot)
+
+    if not all([flow_doc, organization_info, contact_info]):
+        raise ValueError("One or more required documents not found")
+
+    document_versions = {
+        flow_snapshot.reference.path: flow_snapshot.update_time,
+        organization_snapshot.reference.path: organization_snapshot.update_time
+    }
+    return CallContext(flow_doc, organization_info, contact_info, contact_snapshot.update_time, document_versions=document_versions)
+
+
+def load_batch_call_contexts(flow_id, organization_id, contact_ids, document_versions=None):
+    """
+    Reads the Flow, the Organization and every Contact of a bulk dial in a single batched get.
+    The Flow and Organization update times are recorded in document_versions, which every context shares.
+
+    Returns:
+        (flow_doc, organization_info, contexts, missing_contact_ids), where contexts maps contact_id
+        to its CallContext.
+
+    Raises:
+        ValueError: If the flow or organization does not exist.
+    """
+    flow_ref = db.collection('Flows').document(flow_id)
+    organization_ref = db.collection('Organizations').document(organization_id)
+    contact_refs = [db.collection('Contacts').document(contact_id) for contact_id in contact_ids]
+    snapshots = {snapshot.reference.path: snapshot for snapshot in db.get_all([flow_ref, organization_ref] + contact_refs)}
+
+    flow_doc = _snapshot_to_dict(snapshots.get(flow_ref.path))
+    organization_info = _snapshot_to_dict(snapshots.get(organization_ref.path))
+    if not flow_doc or not organization_info:
+        raise ValueError("Flow or organization document not found")
+    if document_versions is None:
+        document_versions = {}
+    for ref in (flow_ref, organization_ref):
+        document_versions[ref.path] = snapshots[ref.path].update_time
+
+    # One clock for the whole bulk dial, so day parts are computed once per timezone
+    clock = ClockSnapshot()
+    contexts = {}
+    missing_contact_ids = []
+    for contact_id, contact_ref in zip(contact_ids, contact_refs):
+        contact_snapshot = snapshots.get(contact_ref.path)
+        contact_info = _snapshot_to_dict(contact_snapshot)
+        if contact_info is None:
+            missing_contact_ids.append(contact_id)
+            continue
+        contexts[contact_id] = CallContext(flow_doc, organization_info, contact_info, contact_snapshot.update_time, clock, document_versions)
+
+    return flow_doc, organization_info, contexts, missing_contact_ids
@@ -1,15 +1,26 @@
 from google.cloud import firestore
+from google.api_core import exceptions
+import copy
 import datetime
+from call_storage import externalize_call_fields
+from flow_history import compact_update, update_contact_with_history
 
 db = firestore.Client()
 
-def query_document_by_id(collection, doc_id):
+# google.rpc.Code.FAILED_PRECONDITION, reported by BulkWriter when a last_update_time precondition fails
+FAILED_PRECONDITION_CODE = 9
+BULK_WRITE_MAX_ATTEMPTS = 5
+
+def query_document_by_id(collection, doc_id, versions=None):
+    """Document data with its 'id', or None. With a versions dict, also records {path: update_time} in it."""
     try:
         doc_ref = db.collection(collection).document(doc_id)
         doc = doc_ref.get()
         if doc.exists:
             data = doc.to_dict()
             data['id'] = doc.id  # Add the document ID to the data
+            if versions is not None:
+                versions[doc_ref.path] = doc.update_time
             return data
         return None
     except Exception as e:
@@ -42,50 +53,130 @@ def get_call_count(contact_id, flow_id):
                 return flow.get('callCounter', 0)
     return 0
 
-def update_contact_flow(contact_id, flow_id, max_attempts):
+def build_call_attempt_update(active_flows, finished_flows, flow_id, max_attempts):
+    """Counts a call attempt on the contact's flow lists (in place) and returns the contact update."""
+    flow_updated = False
+    for flow in active_flows:
+        if isinstance(flow, dict) and flow.get('flow_id') == flow_id:
+            flow['callCounter'] = flow.get('callCounter', 0) + 1
+            if flow['callCounter'] >= max_attempts:
+                flow['status'] = 'unresponsive'
+                finished_flows.append(flow)
+                active_flows.remove(flow)
+            flow_updated = True
+            break
+    
+    if not flow_updated:
+        # If the flow wasn't found in activeFlows, add it
+        new_flow = {
+            'flow_id': flow_id,
+            'callCounter': 1,
+            'status': 'active'
+        }
+        active_flows.append(new_flow)
+    
+    return {
+        'activeFlows': active_flows,
+        'finishedFlows': finished_flows,
+        'lastCallAttempt': datetime.datetime.utcnow().isoformat()
+    }
+
+def update_contact_flow(contact_id, flow_id, max_attempts, call_context=None):
     try:
         contact_ref = db.collection('Contacts').document(contact_id)
-        contact_doc = contact_ref.get()
-        if contact_doc.exists:
+        if call_context is not None and call_context.contact_update_time is not None:
+            # Reuse the contact read at the start of the request; the write is conditioned on it being unchanged
+            active_flows = copy.deepcopy(call_context.active_flows)
+            finished_flows = copy.deepcopy(call_context.finished_flows)
+            write_option = db.write_option(last_update_time=call_context.contact_update_time)
+        else:
+            contact_doc = contact_ref.get()
+            if not contact_doc.exists:
+                print(f"Contact document {contact_id} does not exist.")
+                return
             contact_data = contact_doc.to_dict()
             active_flows = contact_data.get('activeFlows', [])
             finished_flows = contact_data.get('finishedFlows', [])
+            write_option = None
             
-            flow_updated = False
-            for flow in active_flows:
-                if isinstance(flow, dict) and flow.get('flow_id') == flow_id:
-                    flow['callCounter'] = flow.get('callCounter', 0) + 1
-                    if flow['callCounter'] >= max_attempts:
-                        flow['status'] = 'unresponsive'
-                        finished_flows.append(flow)
-                        active_flows.remove(flow)
-                    flow_updated = True
-                    break
-            
-            if not flow_updated:
-                # If the flow wasn't found in activeFlows, add it
-                new_flow = {
-                    'flow_id': flow_id,
-                    'callCounter': 1,
-                    'status': 'active'
-                }
-                active_flows.append(new_flow)
-            
-            contact_ref.update({
-                'activeFlows': active_flows,
-                'finishedFlows': finished_flows,
-                'lastCallAttempt': datetime.datetime.utcnow().isoformat()
-            })
-            print(f"Contact {contact_id} updated successfully.")
+        update_data = build_call_attempt_update(active_flows, finished_flows, flow_id, max_attempts)
+        if write_option is not None:
+            try:
+                update_contact_with_history(db, contact_ref, update_data, option=write_option)
+            except exceptions.FailedPrecondition:
+                print(f"Contact {contact_id} changed during the request. Retrying with a fresh read.")
+                return update_contact_flow(contact_id, flow_id, max_attempts)
         else:
-            print(f"Contact document {contact_id} does not exist.")
+            update_contact_with_history(db, contact_ref, update_data)
+        print(f"Contact {contact_id} updated successfully.")
     except Exception as e:
         print(f"Failed to update contact document: {str(e)}")
 
-def save_call_data(call_id, request_json, response_text):
-    db.collection('Calls').document(call_id).set({
+def build_call_record(call_id, request_json, response_text):
+    return externalize_call_fields(call_id, {
         "original_request": request_json,
         "response": response_text,
         "call_id": call_id,
         "callTimestamp": datetime.datetime.utcnow()
-    })
\ No newline at end of file
+    })
+
+def save_call_data(call_id, request_json, response_text):
+    db.collection('Calls').document(call_id).set(build_call_record(call_id, request_json, response_text))
+
+def save_batch_call_data(dialed_calls, flow_id, max_attempts, is_test=False):
+    """
+    Writes the Calls documents and contact-flow updates for a batch of dialed contacts.
+
+    dialed_calls is a list of (call_id, request_json, response_text, call_context). Calls documents and
+    contact updates that archive nothing go through one BulkWriter pass. A contact update that trims
+    finishedFlows is committed in one batch with its flow_history entries, like update_contact_flow,
+    so no entry is dropped without being archived. Contact updates are conditioned on the snapshot in
+    each CallContext; contacts that changed in the meantime fall back to update_contact_flow with a
+    fresh read.
+    """
+    bulk_writer = db.bulk_writer()
+    failed_paths = set()
+
+    def on_write_error(failure, _bulk_writer):
+        if failure.code == FAILED_PRECONDITION_CODE or failure.attempts >= BULK_WRITE_MAX_ATTEMPTS:
+            failed_paths.add(failure.operation.reference.path)
+            return False
+        return True
+
+    bulk_writer.on_write_error(on_write_error)
+
+    contact_refs = {}
+    archiving_updates = []
+    for call_id, request_json, response_text, call_context in dialed_calls:
+        bulk_writer.set(db.collection('Calls').document(call_id), build_call_record(call_id, request_json, response_text))
+        if is_test:
+            continue
+        contact_id = call_context.contact_info['id']
+        contact_ref = db.collection('Contacts').document(contact_id)
+        update_data = build_call_attempt_update(
+            copy.deepcopy(call_context.active_flows), copy.deepcopy(call_context.finished_flows), flow_id, max_attempts
+        )
+        write_option = db.write_option(last_update_time=call_context.contact_update_time)
+        if compact_update(update_data)[1]:
+            archiving_updates.append((contact_id, contact_ref, update_data, write_option))
+            continue
+        bulk_writer.update(contact_ref, update_data, option=write_option)
+        contact_refs[contact_ref.path] = contact_id
+
+    bulk_writer.close()
+
+    for contact_id, contact_ref, update_data, write_option in archiving_updates:
+        try:
+            update_contact_with_history(db, contact_ref, update_data, option=write_option)
+        except exceptions.FailedPrecondition:
+            print(f"Contact {contact_id} changed during the batch. Retrying with a fresh read.")
+            update_contact_flow(contact_id, flow_id, max_attempts)
+        except Exception as e:
+            print(f"Failed to update contact {contact_id} in batch: {str(e)}")
+
+    for path in failed_paths:
+        if path in contact_refs:
+            print(f"Contact {contact_refs[path]} changed during the batch. Retrying with a fresh read.")
+            update_contact_flow(contact_refs[path], flow_id, max_attempts)
+        else:
+            print(f"Failed to write {path} in batch.")
@@ -3,10 +3,12 @@
 import functions_framework
 from flask import abort, jsonify
 from prompt_crafting import craft_prompt
-from database_ops import query_document_by_id, update_contact_flow, save_call_data
+from database_ops import query_document_by_id, update_contact_flow, save_call_data, save_batch_call_data
 from google.cloud import error_reporting
 from config import config
-from api_client import send_bland_ai_request
+from api_client import RequestFailure, send_bland_ai_request, send_bland_ai_requests
+from call_context import load_call_context, load_batch_call_contexts
+from log_utils import log_event, log_debug
 
 import logging
 
@@ -20,21 +22,23 @@ logging.basicConfig(level=logging.INFO)
 def call_builder(request):
     try:
         request_json = request.get_json(silent=True)
-        print(f"Received request: {request_json}")
+        log_event("Received request", request=request_json)
 
-        flow_doc, organization_info, contact_info = get_required_documents(request_json)
-        logging.info(f"Retrieved organization_info: {organization_info}")
+        call_context = load_call_context(request_json)
+        flow_doc, organization_info, contact_info = call_context.flow_doc, call_context.organization_info, call_context.contact_info
+        log_debug("Retrieved organization_info", organization_info=organization_info)
 
 
         crafted_payload = craft_prompt(
-            knowledge_base=get_knowledge_base(flow_doc),
-            rules_and_guidelines=get_rules_and_guidelines(flow_doc),
-            prompt_ref=get_prompt_ref(flow_doc),
+            knowledge_base=get_knowledge_base(flow_doc, call_context.document_versions),
+            rules_and_guidelines=get_rules_and_guidelines(flow_doc, call_context.document_versions),
+            prompt_ref=get_prompt_ref(flow_doc, call_context.document_versions),
             organization_info=organization_info,
             contact_info=contact_info,
             call_settings=get_call_settings(organization_info, flow_doc),
             flow_doc=flow_doc,
-            is_test=request_json.get('test', False)
+            is_test=request_json.get('test', False),
+            call_context=call_context
         )
 
         response = send_bland_ai_request(crafted_payload)
@@ -44,7 +48,7 @@ def call_builder(request):
             return jsonify({"error": "Failed to get response from Bland AI"}), 500
 
         if response.status_code == 200:
-            return handle_successful_response(response, request_json, flow_doc)
+            return handle_successful_response(response, request_json, flow_doc, call_context)
         else:
             return handle_error_response(response)
 
@@ -67,43 +71,33 @@ def get_call_settings(organization_info, flow_doc):
     
     return call_settings
 
-def get_required_documents(request_json):
-    flow_doc = query_document_by_id('Flows', request_json['flow_id'])
-    organization_info = query_document_by_id('Organizations', request_json['organization_id'])
-    contact_info = query_document_by_id('Contacts', request_json['contact_id'])
-    
-    if not all([flow_doc, organization_info, contact_info]):
-        raise ValueError("One or more required documents not found")
-    
-    return flow_doc, organization_info, contact_info
-
-def get_knowledge_base(flow_doc):
+def get_knowledge_base(flow_doc, versions=None):
     prompt_parameters = flow_doc.get('prompt_parameters', {})
     general_knowledge_id = prompt_parameters.get('general_knowledgebase_id')
     specific_knowledge_id = prompt_parameters.get('specific_knowledgebase_id')
     
     knowledge_base = {}
     if general_knowledge_id:
-        general_knowledge = query_document_by_id('KnowledgeBases', general_knowledge_id)
+        general_knowledge = query_document_by_id('KnowledgeBases', general_knowledge_id, versions)
         if general_knowledge:
             knowledge_base.update(general_knowledge)
     
     if specific_knowledge_id:
-        specific_knowledge = query_document_by_id('KnowledgeBases', specific_knowledge_id)
+        specific_knowledge = query_document_by_id('KnowledgeBases', specific_knowledge_id, versions)
         if specific_knowledge:
             knowledge_base.update(specific_knowledge)
     
     return knowledge_base
 
-def get_rules_and_guidelines(flow_doc):
+def get_rules_and_guidelines(flow_doc, versions=None):
     prompt_parameters = flow_doc.get('prompt_parameters', {})
     rules_id = prompt_parameters.get('rules_id')
-    return query_document_by_id('Rules', rules_id) if rules_id else {}
+    return query_document_by_id('Rules', rules_id, versions) if rules_id else {}
 
-def get_prompt_ref(flow_doc):
+def get_prompt_ref(flow_doc, versions=None):
     prompt_parameters = flow_doc.get('prompt_parameters', {})
     script_id = prompt_parameters.get('script_id')
-    return query_document_by_id('Scripts', script_id) if script_id else {}
+    return query_document_by_id('Scripts', script_id, versions) if script_id else {}
 
 def get_call_settings(organization_info, flow_doc):
     call_settings = organization_info.get('call_settings', {}).copy()
@@ -113,18 +107,125 @@ def get_call_settings(organization_info, flow_doc):
     return call_settings
 
 
-def handle_successful_response(response, request_json, flow_doc):
+def handle_successful_response(response, request_json, flow_doc, call_context=None):
     response_data = response.json()
     call_id = response_data.get("call_id", "")
     save_call_data(call_id, request_json, response.text)
     
     if not request_json.get('test', False):
         max_attempts = flow_doc.get('maxAttempts', 0)
-        update_contact_flow(request_json['contact_id'], request_json['flow_id'], max_attempts)
+        update_contact_flow(request_json['contact_id'], request_json['flow_id'], max_attempts, call_context)
     
     return jsonify({"success": True, "data": response.text})
 
 def handle_error_response(response):
     error_message = f"Call API error: {response.text}"
     logging.error(error_message)
-    return jsonify({"error": error_message}), response.status_code
\ No newline at end of file
+    return jsonify({"error": error_message}), response.status_code
+
+@functions_framework.http
+def call_builder_batch(request):
+    """
+    Dials many contacts of one flow in a single invocation.
+
+    Expects {"flow_id", "organization_id", "contact_ids": [...], "test"}. Documents are read with one
+    batched get, payloads are rendered from the shared flow template, Bland requests are dispatched
+    concurrently under the organization's limits, and all Calls documents and contact-flow updates
+    are written in one BulkWriter pass.
+    """
+    try:
+        request_json = request.get_json(silent=True) or {}
+        flow_id = request_json.get('flow_id')
+        organization_id = request_json.get('organization_id')
+        contact_ids = list(dict.fromkeys(request_json.get('contact_ids') or []))
+        is_test = request_json.get('test', False)
+
+        if not flow_id or not organization_id or not contact_ids:
+            return jsonify({"error": "flow_id, organization_id and contact_ids are required"}), 400
+
+        max_batch_size = config.get('max_batch_contacts', 100)
+        if len(contact_ids) > max_batch_size:
+            return jsonify({"error": f"Too many contacts: {len(contact_ids)} (max {max_batch_size})"}), 400
+
+        document_versions = {}
+        flow_doc, organization_info, contexts, missing_contact_ids = load_batch_call_contexts(flow_id, organization_id, contact_ids, document_versions)
+        results = {contact_id: {"error": "Contact not found"} for contact_id in missing_contact_ids}
+
+        # Flow-level inputs are fetched once for the whole batch
+        knowledge_base = get_knowledge_base(flow_doc, document_versions)
+        rules_and_guidelines = get_rules_and_guidelines(flow_doc, document_versions)
+        prompt_ref = get_prompt_ref(flow_doc, document_versions)
+        call_settings = get_call_settings(organization_info, flow_doc)
+
+        dial_contact_ids = []
+        payloads = []
+        for contact_id, call_context in contexts.items():
+            try:
+                payloads.append(craft_prompt(
+                    knowledge_base=knowledge_base,
+                    rules_and_guidelines=rules_and_guidelines,
+                    prompt_ref=prompt_ref,
+                    organization_info=organization_info,
+                    contact_info=call_context.contact_info,
+                    call_settings=call_settings,
+                    flow_doc=flow_doc,
+                    is_test=is_test,
+                    call_context=call_context
+                ))
+                dial_contact_ids.append(contact_id)
+            except Exception as e:
+                logging.exception(f"Failed to craft payload for contact {contact_id}")
+                results[contact_id] = {"error": f"Failed to craft payload: {str(e)}"}
+
+        rate_limits = organization_info.get('call_settings', {})
+        responses = send_bland_ai_requests(
+            payloads,
+            max_concurrency=rate_limits.get('max_concurrent_calls', config.get('default_max_concurrent_calls', 10)),
+            calls_per_second=rate_limits.get('calls_per_second', config.get('default_calls_per_second'))
+        )
+
+        dialed_calls = []
+        for contact_id, response in zip(dial_contact_ids, responses):
+            if response is None:
+                results[contact_id] = {"error": "Failed to get response from Bland AI"}
+            elif isinstance(response, RequestFailure):
+                results[contact_id] = {"error": f"Failed to send request to Bland AI: {response.error}"}
+            elif response.status_code != 200:
+                results[contact_id] = {"error": f"Call API error: {response.text}", "status_code": response.status_code}
+            else:
+                try:
+                    call_id = response.json().get("call_id", "")
+                except (ValueError, AttributeError) as e:
+                    # Placed, but without a readable call_id there is nothing to save for it
+                    results[contact_id] = {"error": f"Unreadable Bland AI response: {str(e)}", "status_code": response.status_code}
+                    continue
+                contact_request = {
+                    'flow_id': flow_id,
+                    'contact_id': contact_id,
+                    'organization_id': organization_id,
+                    'test': is_test
+                }
+                dialed_calls.append((call_id, contact_request, response.text, contexts[contact_id]))
+                results[contact_id] = {"success": True, "call_id": call_id}
+
+        # The calls are already placed: a failed save must not turn into a 500 that gets the batch re-dialed
+        save_error = None
+        try:
+            save_batch_call_data(dialed_calls, flow_id, flow_doc.get('maxAttempts', 0), is_test)
+        except Exception as e:
+            logging.exception(f"Failed to save call data for {len(dialed_calls)} dialed calls")
+            save_error = str(e)
+
+        response_body = {
+            "success": True,
+            "dialed": len(dialed_calls),
+            "failed": len(contact_ids) - len(dialed_calls),
+            "results": results
+        }
+        if save_error is not None:
+            response_body["save_error"] = f"Calls were dialed but not all call data was saved: {save_error}"
+        return jsonify(response_body)
+
+    except Exception as e:
+        logging.exception("An error occurred while processing the batch request")
+        return jsonify({"error": str(e)}), 500
@@ -1,39 +1,142 @@
 from google.cloud import storage
 import json
 from config import config
-from time_utils import get_day_time
+from time_utils import ClockSnapshot, WEEKEND_DAYS
 from html_processing import process_html
 from database_ops import get_organization_config
+from payload_template import PayloadTemplate, PayloadTemplateCache, template_fingerprint
+from log_utils import log_debug
+from collections import namedtuple
+from types import MappingProxyType
 import logging
+import os
 import random
-import datetime
 import re
+import threading
+import time
+
+PRONUNCIATION_BLOB = 'pronunciation_guide.json'
+DEFAULTS_BLOB = 'payload_defaults.json'
+
+# How often a warm instance checks GCS for new generations of the config blobs
+CONFIG_REFRESH_SECONDS = int(os.getenv('PAYLOAD_CONFIG_REFRESH_SECONDS', 300))
+
+# Immutable view of the GCS payload config; a payload is built entirely from one snapshot
+ConfigSnapshot = namedtuple('ConfigSnapshot', ['pronunciation_guide', 'payload_defaults', 'generations'])
+
+
+def _freeze_pronunciation_guide(pronunciation_data):
+    if isinstance(pronunciation_data, list):
+        return tuple(pronunciation_data)
+    return tuple(pronunciation_data.get('custom_pronunciations', []))
+
 
 class PayloadFactory:
-    def __init__(self):
+    """
+    Process-wide payload factory. Like Config, constructing it returns the shared instance.
+
+    The GCS config is loaded once into an immutable ConfigSnapshot. Afterwards the blob generations
+    are checked in the background every CONFIG_REFRESH_SECONDS, and a blob is only downloaded again
+    when its generation changed.
+    """
+    _instance = None
+    _instance_lock = threading.Lock()
+
+    def __new__(cls):
+        with cls._instance_lock:
+            if cls._instance is None:
+                cls._instance = super(PayloadFactory, cls).__new__(cls)
+                cls._instance.initialize()
+        return cls._instance
+
+    def initialize(self):
         self.storage_client = storage.Client()
         self.bucket_name = config.get('config_bucket')
+        self._refresh_lock = threading.Lock()
+        self._last_checked = 0.0
+        self.snapshot = ConfigSnapshot((), MappingProxyType({}), {})
+        self.template_cache = PayloadTemplateCache()
         self.load_configs()
 
+    @property
+    def pronunciation_guide(self):
+        return self.current_snapshot().pronunciation_guide
+
+    @property
+    def payload_defaults(self):
+        return self.current_snapshot().payload_defaults
+
+    def current_snapshot(self):
+        """Returns the current config snapshot, kicking off a background refresh check when one is due."""
+        if time.monotonic() - self._last_checked > CONFIG_REFRESH_SECONDS and not self._refresh_lock.locked():
+            threading.Thread(target=self.load_configs, daemon=True).start()
+        return self.snapshot
+
     def load_configs(self):
+        """Reloads whichever config blobs have a new generation and swaps in a new snapshot."""
+        if not self._refresh_lock.acquire(blocking=False):
+            return
         try:
+            self._last_checked = time.monotonic()
+            current = self.snapshot
             bucket = self.storage_client.bucket(self.bucket_name)
-            
-            pronunciation_blob = bucket.blob('pronunciation_guide.json')
-            pronunciation_data = json.loads(pronunciation_blob.download_as_string())
-            if isinstance(pronunciation_data, list):
-                self.pronunciation_guide = pronunciation_data
-            else:
-                self.pronunciation_guide = pronunciation_data.get('custom_pronunciations', [])
-            
-            defaults_blob = bucket.blob('payload_defaults.json')
-            self.payload_defaults = json.loads(defaults_blob.download_as_string())
+            generations = dict(current.generations)
+
+            pronunciation_guide = current.pronunciation_guide
+            pronunciation_data = self._download_if_changed(bucket, PRONUNCIATION_BLOB, generations)
+            if pronunciation_data is not None:
+                pronunciation_guide = _freeze_pronunciation_guide(pronunciation_data)
+
+            payload_defaults = current.payload_defaults
+            defaults_data = self._download_if_changed(bucket, DEFAULTS_BLOB, generations)
+            if defaults_data is not None:
+                payload_defaults = MappingProxyType(defaults_data)
+
+            if generations != current.generations:
+                # Single reference swap; calls in flight keep the snapshot they already hold
+                self.snapshot = ConfigSnapshot(pronunciation_guide, payload_defaults, generations)
+                logging.info(f"Loaded payload config generations: {generations}")
         except Exception as e:
             logging.error(f"Error loading configs: {str(e)}")
-            self.pronunciation_guide = []
-            self.payload_defaults = {}
+        finally:
+            self._refresh_lock.release()
+
+    def _download_if_changed(self, bucket, blob_name, generations):
+        """Downloads a blob only if its generation differs from the one in `generations`, which is updated."""
+        blob = bucket.get_blob(blob_name)
+        if blob is None:
+            logging.error(f"Config blob {blob_name} not found in bucket {self.bucket_name}")
+            return None
+        if blob.generation == generations.get(blob_name):
+            return None
+        # Pin the download to the generation we just saw so the snapshot matches its recorded version
+        data = json.loads(blob.download_as_bytes(if_generation_match=blob.generation))
+        generations[blob_name] = blob.generation
+        return data
 
     def create_payload(self, payload_type, **kwargs):
+        # Pin one config snapshot for the whole payload, even if a refresh lands mid-build
+        kwargs.setdefault('config_snapshot', self.current_snapshot())
+        # ...and one clock reading, shared by the greeting and voicemail builders
+        if kwargs.get('clock') is None:
+            kwargs['clock'] = ClockSnapshot()
+        return self.get_payload_template(payload_type, **kwargs).render(self, **kwargs)
+
+    def get_payload_template(self, payload_type, **kwargs):
+        """
+        Returns the compiled template for this flow's invariant inputs, building it on first use.
+        Templates are keyed by the update times of the documents they were built from (or a content
+        hash without them), so edits to the script, knowledge bases, rules, flow, organization or GCS
+        config produce a new template.
+        """
+        kwargs.setdefault('config_snapshot', self.current_snapshot())
+        fingerprint = template_fingerprint(payload_type, **kwargs)
+        return self.template_cache.get_or_build(
+            fingerprint,
+            lambda: PayloadTemplate(payload_type, self.build_payload(payload_type, **kwargs))
+        )
+
+    def build_payload(self, payload_type, **kwargs):
         if payload_type == 'standard':
             return self.create_standard_payload(**kwargs)
         elif payload_type == 'pathway':
@@ -53,22 +156,26 @@ class PayloadFactory:
         is_test = kwargs.get('is_test', False)  # Get the is_test parameter
 
         
-        org_config = get_organization_config(organization_info.get('id'))
+        org_config = kwargs.get('org_config')
+        if org_config is None:
+            org_config = get_organization_config(organization_info.get('id'))
+        snapshot = kwargs.get('config_snapshot') or self.current_snapshot()
+        payload_defaults = snapshot.payload_defaults
         
         payload = {
             'phone_number': contact_info.get('phoneNumber'),
             'task': prompt_string,
-            'model': call_settings.get('model', self.payload_defaults.get('default_model', 'enhanced')),
+            'model': call_settings.get('model', payload_defaults.get('default_model', 'enhanced')),
             'transfer_phone_number': self.validate_phone_number(call_settings.get('transfer_phone_number')),
             'answered_by_enabled': call_settings.get('answered_by_enabled', True),
             'encrypted_key': call_settings.get('encrypted_key',None),
             'from': organization_info.get('phoneNumbers', {}).get('outbound') or None,
-            'pronunciation_guide': self.pronunciation_guide,
-            'temperature': call_settings.get('temperature', self.payload_defaults.get('default_temperature', 0.5)),
-            'voice': call_settings.get('voice', self.payload_defaults.get('default_voice', 'e1289219-0ea2-4f22-a994-c542c2a48a0f')),
+            'pronunciation_guide': list(snapshot.pronunciation_guide),
+            'temperature': call_settings.get('temperature', payload_defaults.get('default_temperature', 0.5)),
+            'voice': call_settings.get('voice', payload_defaults.get('default_voice', 'e1289219-0ea2-4f22-a994-c542c2a48a0f')),
             'webhook': config.get('TEST_WEBHOOK_URL', "https://us-central1-heyisaai.cloudfunctions.net/callProcessor-test") if is_test else config.get('WEBHOOK_URL', "https://us-central1-heyisaai.cloudfunctions.net/callProcessor"),
             'wait_for_greeting': call_settings.get('wait_for_greeting', True),
-            'first_sentence': self.create_first_sentence(contact_info, organization_info),
+            'first_sentence': self.create_first_sentence(contact_info, organization_info, kwargs.get('clock')),
             'record': call_settings.get('record', True),
             'language': call_settings.get('language'),
             'max_duration': call_settings.get('max_duration', config.get('default_max_duration', 300)),
@@ -80,7 +187,7 @@ class PayloadFactory:
             },
         }
 
-        logging.info(f"Created standard payload: {payload}")
+        log_debug("Created standard payload", payload=payload)
         return payload
 
     def validate_phone_number(self, phone_number):
@@ -103,7 +210,7 @@ class PayloadFactory:
         if 'task' in payload:
             del payload['task']  # Remove 'task' as it's not used in pathway payloads
 
-        print(f"Created pathway payload: {payload}")
+        log_debug("Created pathway payload", payload=payload)
         return payload
 
     def create_voicemail_payload(self, **kwargs):
@@ -116,7 +223,7 @@ class PayloadFactory:
         if 'task' in base_payload:
             del base_payload['task']  # Remove 'task' as it's not used in voicemail payloads
 
-        logging.info(f"Created voicemail payload: {base_payload}")
+        log_debug("Created voicemail payload", payload=base_payload)
         return base_payload
     
     def create_convert_payload(self, **kwargs):
@@ -132,7 +239,7 @@ class PayloadFactory:
         if 'task' in base_payload:
             del base_payload['task']  # Remove 'task' as it's not used in voicemail payloads
 
-        logging.info(f"Created convert first call voicemail payload: {base_payload}")
+        log_debug("Created convert first call voicemail payload", payload=base_payload)
         return base_payload
 
     def create_prompt_string(self, **kwargs):
@@ -165,15 +272,7 @@ class PayloadFactory:
         knowledge_base = kwargs.get('knowledge_base', {})
         prompt_ref = kwargs.get('prompt_ref', {})
         
-        contact_address = contact_info.get('address', {})
-        contact_formatted = {
-            'contact_first_name': contact_info.get('firstName', ''),
-            'contact_last_name': contact_info.get('lastName', ''),
-            'contact_phone': contact_info.get('phoneNumber', ''),
-            'contact_email': contact_info.get('email', ''),
-            'contact_street': contact_address.get('street', ''),
-            'contact_city': contact_address.get('city', '')
-        }
+        contact_formatted = self.format_contact_info(contact_info)
         
         assistant_formatted = {
             'assistant_name': organization_info.get('assistant_name', ''),
@@ -188,7 +287,7 @@ class PayloadFactory:
         knowledge_base_text = knowledge_base.get('knowledge_base_text', '')
         
         request_data = {
-            'start_sentence': self.create_first_sentence(contact_info, organization_info),
+            'start_sentence': self.create_first_sentence(contact_info, organization_info, kwargs.get('clock')),
             'assistant_info': assistant_formatted,
             'contact_info': contact_formatted,
             'organization_info': org_formatted,
@@ -198,12 +297,23 @@ class PayloadFactory:
             'value_link': flow_doc.get('value_link', "default_value_link")
         }
 
-        logging.info(f"Created request_data: {request_data}")
+        log_debug("Created request_data", request_data=request_data)
         return request_data
 
-    def create_first_sentence(self, contact_info, organization_info):
+    def format_contact_info(self, contact_info):
+        contact_address = contact_info.get('address', {})
+        return {
+            'contact_first_name': contact_info.get('firstName', ''),
+            'contact_last_name': contact_info.get('lastName', ''),
+            'contact_phone': contact_info.get('phoneNumber', ''),
+            'contact_email': contact_info.get('email', ''),
+            'contact_street': contact_address.get('street', ''),
+            'contact_city': contact_address.get('city', '')
+        }
+
+    def create_first_sentence(self, contact_info, organization_info, clock=None):
         timezone_str = organization_info.get('timezone', 'UTC')
-        day_of_week, part_of_day = get_day_time(timezone_str)
+        day_of_week, part_of_day = (clock or ClockSnapshot()).day_time(timezone_str)
         
         if contact_info.get('firstName'):
             return f"Hey there, happy {day_of_week} {part_of_day}, is this {contact_info['firstName']}?"
@@ -217,7 +327,7 @@ class PayloadFactory:
         
         # Get day and time information
         timezone_str = organization_info.get('timezone', 'UTC')
-        day_of_week, part_of_day = get_day_time(timezone_str)
+        day_of_week, part_of_day = (kwargs.get('clock') or ClockSnapshot()).day_time(timezone_str)
         
         # Construct the first sentence
         first_name = contact_info.get('firstName', '')
@@ -250,9 +360,8 @@ class PayloadFactory:
         return full_message
 
     def create_voicemail_ending(self, first_name, day_of_week):
-        current_day = datetime.datetime.now().strftime('%A')
-        
-        if current_day in ['Friday', 'Saturday', 'Sunday']:
+        # day_of_week is already in the organization's timezone; the server clock is not
+        if day_of_week in WEEKEND_DAYS:
             time_phrase = "weekend"
         else:
             time_phrase = "week"
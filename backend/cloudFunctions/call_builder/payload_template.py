@@ -0,0 +1,101 @@
+# payload_template.py
+
+import hashlib
+import json
+import threading
+
+# Payload inputs that are the same for every contact of a flow; hashed when no document versions are given
+TEMPLATE_INPUT_KEYS = ('rules_and_guidelines', 'knowledge_base', 'prompt_ref', 'organization_info', 'call_settings', 'flow_doc', 'is_test')
+
+MAX_CACHED_TEMPLATES = 256
+
+
+def template_fingerprint(payload_type, **kwargs):
+    """
+    Version of everything in a payload that does not depend on the contact.
+
+    With document_versions ({path: update_time} of the Flow, Organization, knowledge base, rules and
+    script documents the inputs were read from), the key is built from those and the GCS config
+    generations without touching the inputs. Otherwise the inputs themselves are hashed.
+    """
+    snapshot = kwargs.get('config_snapshot')
+    generations = snapshot.generations if snapshot is not None else {}
+    document_versions = kwargs.get('document_versions')
+    if document_versions:
+        return (
+            payload_type,
+            bool(kwargs.get('is_test')),
+            frozenset(document_versions.items()),
+            frozenset(generations.items())
+        )
+
+    inputs = {key: kwargs.get(key) for key in TEMPLATE_INPUT_KEYS}
+    inputs['config_generations'] = generations
+    inputs['payload_type'] = payload_type
+    encoded = json.dumps(inputs, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha1(encoded).hexdigest()
+
+
+class PayloadTemplate:
+    """
+    A payload compiled once per flow. Rules, knowledge, processed script text, voice settings,
+    pronunciation guide, webhook and defaults are shared; render() only fills the contact and
+    time-of-day slots.
+    """
+
+    __slots__ = ('payload_type', 'payload')
+
+    def __init__(self, payload_type, payload):
+        self.payload_type = payload_type
+        self.payload = payload
+
+    def render(self, factory, **kwargs):
+        contact_info = kwargs.get('contact_info', {})
+        organization_info = kwargs.get('organization_info', {})
+
+        # Shallow copies: the large invariant values (task, guide, settings) are shared, not duplicated
+        payload = dict(self.payload)
+        first_sentence = factory.create_first_sentence(contact_info, organization_info, kwargs.get('clock'))
+        payload['phone_number'] = contact_info.get('phoneNumber')
+        payload['first_sentence'] = first_sentence
+
+        request_data = dict(payload['request_data'])
+        request_data['start_sentence'] = first_sentence
+        request_data['contact_info'] = factory.format_contact_info(contact_info)
+        payload['request_data'] = request_data
+
+        if 'voicemail_message' in payload:
+            payload['voicemail_message'] = factory.create_voicemail_message(**kwargs)
+        if 'retry' in payload:
+            retry = dict(payload['retry'])
+            retry['voicemail_message'] = factory.create_voicemail_message(**kwargs)
+            payload['retry'] = retry
+
+        return payload
+
+
+class PayloadTemplateCache:
+    """Bounded, thread-safe map of template fingerprint -> PayloadTemplate."""
+
+    def __init__(self, max_size=MAX_CACHED_TEMPLATES):
+        self.max_size = max_size
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    def get_or_build(self, fingerprint, build):
+        with self._lock:
+            template = self._templates.get(fingerprint)
+        if template is not None:
+            return template
+
+        template = build()
+        with self._lock:
+            if len(self._templates) >= self.max_size:
+                # Evict the oldest template
+                self._templates.pop(next(iter(self._templates)))
+            self._templates[fingerprint] = template
+        return template
+
+    def clear(self):
+        with self._lock:
+            self._templates.clear()
@@ -6,11 +6,11 @@ from payload_factory import PayloadFactory
 from database_ops import get_organization_config, get_call_count
 from secret_manager import access_secret_version
 from html_processing import process_html
-from time_utils import get_day_time
 from config import config
+from log_utils import log_debug
 
 class PayloadCrafter:
-    def __init__(self, knowledge_base, rules_and_guidelines, prompt_ref, organization_info, contact_info, call_settings, flow_doc, is_test=False):
+    def __init__(self, knowledge_base, rules_and_guidelines, prompt_ref, organization_info, contact_info, call_settings, flow_doc, is_test=False, call_context=None):
         self.knowledge_base = knowledge_base
         self.rules_and_guidelines = rules_and_guidelines
         self.prompt_ref = prompt_ref
@@ -19,14 +19,19 @@ class PayloadCrafter:
         self.call_settings = call_settings
         self.flow_doc = flow_doc
         self.is_test = is_test
+        self.call_context = call_context
         
         self.flow_type = flow_doc.get('flow_type', '')
         self.contact_id = contact_info.get('id')
         self.flow_id = flow_doc.get('id')
         
-        org_id = organization_info.id if hasattr(organization_info, 'id') else organization_info.get('id')
-        self.org_config = get_organization_config(org_id)
+        if call_context is not None:
+            self.org_config = call_context.org_config
+        else:
+            org_id = organization_info.id if hasattr(organization_info, 'id') else organization_info.get('id')
+            self.org_config = get_organization_config(org_id)
         self.bland_api_key = access_secret_version(config.get('project_id'), 'bland-api-key')
+        # Shared per instance; config is loaded once and refreshed in the background
         self.payload_factory = PayloadFactory()
 
     def craft_payload(self):
@@ -42,7 +47,10 @@ class PayloadCrafter:
         return handlers.get(self.flow_type, self.handle_default_flow)
 
     def handle_convert_flow(self):
-        call_count = get_call_count(self.contact_id, self.flow_id)
+        if self.call_context is not None:
+            call_count = self.call_context.get_call_count(self.flow_id)
+        else:
+            call_count = get_call_count(self.contact_id, self.flow_id)
         if call_count == 0 and not self.is_test:
             return self.payload_factory.create_payload('convert_voicemail', org_config=self.org_config, **self.get_payload_kwargs())
         return self.craft_standard_payload()
@@ -59,7 +67,7 @@ class PayloadCrafter:
     
 
     def craft_standard_payload(self):
-        print(f"Script:{self.prompt_ref}")#debug
+        log_debug("Crafting standard payload", prompt_ref=self.prompt_ref)
         if self.prompt_ref.get('pathway_id'):
             return self.payload_factory.create_payload('pathway', org_config=self.org_config, **self.get_payload_kwargs())
         return self.payload_factory.create_payload('standard', org_config=self.org_config, **self.get_payload_kwargs())
@@ -73,13 +81,16 @@ class PayloadCrafter:
             'organization_info': self.organization_info,
             'contact_info': self.contact_info,
             'call_settings': self.call_settings,
+            'flow_doc': self.flow_doc,
             'is_test': self.is_test,
             'bland_api_key': self.bland_api_key,
+            'clock': self.call_context.clock if self.call_context is not None else None,
+            'document_versions': self.call_context.document_versions if self.call_context is not None else None,
         }
 
-def craft_prompt(knowledge_base, rules_and_guidelines, prompt_ref, organization_info, contact_info, call_settings, flow_doc, is_test=False):
+def craft_prompt(knowledge_base, rules_and_guidelines, prompt_ref, organization_info, contact_info, call_settings, flow_doc, is_test=False, call_context=None):
     crafter = PayloadCrafter(
         knowledge_base, rules_and_guidelines, prompt_ref, organization_info, 
-        contact_info, call_settings, flow_doc, is_test
+        contact_info, call_settings, flow_doc, is_test, call_context
     )
     return crafter.craft_payload()
\ No newline at end of file
@@ -1,17 +1,133 @@
 from google.cloud import secretmanager
+from google.api_core import exceptions
 import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Tuple
 
-def access_secret_version(project_id, secret_id, version_id="latest"):
-    if not project_id:
-        logging.error("Project ID is not set")
-        return None
-    
-    client = secretmanager.SecretManagerServiceClient()
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Initialize the Secret Manager client
+client = secretmanager.SecretManagerServiceClient()
+
+# How long a fetched secret is served from memory, so rotated secrets are picked up
+SECRET_CACHE_TTL_SECONDS = int(os.environ.get('SECRET_CACHE_TTL_SECONDS', 600))
+# Failed lookups are cached briefly so an outage does not hammer Secret Manager, but do not stick
+NEGATIVE_CACHE_TTL_SECONDS = int(os.environ.get('SECRET_NEGATIVE_CACHE_TTL_SECONDS', 30))
+# Cached secrets this close to expiry are refreshed in the background while the old value is served
+REFRESH_AHEAD_SECONDS = int(os.environ.get('SECRET_REFRESH_AHEAD_SECONDS', 60))
+
+# (project_id, secret_id, version_id) -> (value, expires_at)
+_cache: Dict[Tuple[str, str, str], Tuple[Optional[str], float]] = {}
+_cache_lock = threading.Lock()
+_refreshing = set()
+
+
+def _fetch_secret(project_id: str, secret_id: str, version_id: str) -> Optional[str]:
     name = f"projects/{project_id}/secrets/{secret_id}/versions/{version_id}"
-    
+
     try:
         response = client.access_secret_version(request={"name": name})
         return response.payload.data.decode("UTF-8")
+    except exceptions.NotFound:
+        logging.error(f"Secret {secret_id} not found")
+    except exceptions.PermissionDenied:
+        logging.error(f"Permission denied for secret {secret_id}")
     except Exception as e:
         logging.error(f"Error accessing secret {secret_id}: {str(e)}")
-        return None
\ No newline at end of file
+
+    return None
+
+
+def _store(key: Tuple[str, str, str], value: Optional[str]) -> None:
+    ttl = SECRET_CACHE_TTL_SECONDS if value is not None else NEGATIVE_CACHE_TTL_SECONDS
+    with _cache_lock:
+        _cache[key] = (value, time.monotonic() + ttl)
+
+
+def _refresh_in_background(key: Tuple[str, str, str]) -> None:
+    def refresh():
+        try:
+            value = _fetch_secret(*key)
+            # Keep serving the current value if the refresh failed; it is retried on expiry
+            if value is not None:
+                _store(key, value)
+        finally:
+            with _cache_lock:
+                _refreshing.discard(key)
+
+    with _cache_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+    threading.Thread(target=refresh, daemon=True).start()
+
+
+def access_secret_version(project_id: str, secret_id: str, version_id: str = "latest") -> Optional[str]:
+    """
+    Access the secret version from Google Cloud Secret Manager.
+
+    Values are cached for SECRET_CACHE_TTL_SECONDS and refreshed in the background shortly
+    before they expire; failures are cached for NEGATIVE_CACHE_TTL_SECONDS only.
+
+    Args:
+        project_id (str): The Google Cloud project ID.
+        secret_id (str): The ID of the secret to access.
+        version_id (str): The version of the secret to access. Defaults to "latest".
+
+    Returns:
+        Optional[str]: The secret payload as a string, or None if an error occurred.
+    """
+    if not project_id:
+        logging.error("Project ID is not set")
+        return None
+
+    key = (project_id, secret_id, version_id)
+    now = time.monotonic()
+    with _cache_lock:
+        entry = _cache.get(key)
+
+    if entry is not None:
+        value, expires_at = entry
+        if now < expires_at:
+            if value is not None and expires_at - now < REFRESH_AHEAD_SECONDS:
+                _refresh_in_background(key)
+            return value
+
+    value = _fetch_secret(project_id, secret_id, version_id)
+    _store(key, value)
+    return value
+
+
+def invalidate_secret(project_id: str, secret_id: str, version_id: str = "latest") -> None:
+    """Drops a cached secret so the next access fetches it again."""
+    with _cache_lock:
+        _cache.pop((project_id, secret_id, version_id), None)
+
+
+def get_all_secrets(project_id: str, secret_ids: list) -> Dict[str, str]:
+    """
+    Retrieve multiple secrets at once, fetching uncached ones in parallel.
+
+    Args:
+        project_id (str): The Google Cloud project ID.
+        secret_ids (list): A list of secret IDs to retrieve.
+
+    Returns:
+        Dict[str, str]: A dictionary of secret_id: secret_value pairs.
+    """
+    secrets = {}
+    if not secret_ids:
+        return secrets
+
+    with ThreadPoolExecutor(max_workers=min(len(secret_ids), 8)) as executor:
+        values = executor.map(lambda secret_id: access_secret_version(project_id, secret_id), secret_ids)
+        for secret_id, secret_value in zip(secret_ids, values):
+            if secret_value is not None:
+                secrets[secret_id] = secret_value
+            else:
+                logging.warning(f"Failed to retrieve secret: {secret_id}")
+    return secrets
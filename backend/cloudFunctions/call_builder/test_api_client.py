@@ -0,0 +1,51 @@
+import importlib
+import sys
+import types
+
+import pytest
+
+pytest.importorskip('requests')
+
+
+@pytest.fixture
+def api_client(monkeypatch):
+    # config and secret_manager create Cloud clients at import
+    monkeypatch.setitem(sys.modules, 'config', types.SimpleNamespace(config={}))
+    monkeypatch.setitem(sys.modules, 'secret_manager', types.SimpleNamespace(access_secret_version=lambda *args: 'key'))
+    monkeypatch.delitem(sys.modules, 'api_client', raising=False)
+    return importlib.import_module('api_client')
+
+
+def test_one_raising_payload_does_not_fail_the_batch(api_client, monkeypatch):
+    sent = []
+
+    def send_bland_ai_request(payload):
+        if payload['phone_number'] == 'bad':
+            raise KeyError('call_id')
+        sent.append(payload['phone_number'])
+        return types.SimpleNamespace(status_code=200, phone_number=payload['phone_number'])
+
+    monkeypatch.setattr(api_client, 'send_bland_ai_request', send_bland_ai_request)
+    payloads = [{'phone_number': number} for number in ('1', 'bad', '2', '3')]
+
+    responses = api_client.send_bland_ai_requests(payloads, max_concurrency=2)
+
+    assert sorted(sent) == ['1', '2', '3']
+    assert [getattr(response, 'phone_number', None) for response in responses] == ['1', None, '2', '3']
+    assert isinstance(responses[1], api_client.RequestFailure)
+    assert "call_id" in responses[1].error
+
+
+def test_empty_batch(api_client):
+    assert api_client.send_bland_ai_requests([]) == []
+
+
+def test_rate_limiter_spaces_starts(api_client, monkeypatch):
+    clock = [100.0]
+    sleeps = []
+    monkeypatch.setattr(api_client.time, 'monotonic', lambda: clock[0])
+    monkeypatch.setattr(api_client.time, 'sleep', sleeps.append)
+    limiter = api_client.RateLimiter(calls_per_second=4)
+    for _ in range(3):
+        limiter.wait()
+    assert sleeps == [0.25, 0.5]
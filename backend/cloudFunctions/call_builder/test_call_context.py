@@ -0,0 +1,223 @@
+import importlib
+import sys
+import types
+
+import pytest
+
+
+class FakeSnapshot:
+    def __init__(self, path, data):
+        self.reference = types.SimpleNamespace(path=path)
+        self.id = path.rsplit('/', 1)[-1]
+        self.exists = data is not None
+        self._data = data
+        self.update_time = 't0'
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class FakeDocumentRef:
+    def __init__(self, db, path):
+        self._db = db
+        self.path = path
+
+    @property
+    def id(self):
+        return self.path.rsplit('/', 1)[-1]
+
+    def get(self):
+        self._db.reads += 1
+        self._db.round_trips += 1
+        return FakeSnapshot(self.path, self._db.documents.get(self.path))
+
+    def update(self, data, option=None):
+        from google.api_core import exceptions
+        if option is not None and option.last_update_time != 't0':
+            raise exceptions.FailedPrecondition(f"{self.path} was updated")
+        self._db.writes.append((self.path, data))
+
+
+class FakeCollection:
+    def __init__(self, db, name):
+        self._db = db
+        self._name = name
+
+    def document(self, document_id):
+        return FakeDocumentRef(self._db, f"{self._name}/{document_id}")
+
+
+class CountingDB:
+    """Counts document reads and round trips made by the code under test."""
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.reads = 0
+        self.round_trips = 0
+        self.writes = []
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def write_option(self, last_update_time):
+        return types.SimpleNamespace(last_update_time=last_update_time)
+
+    def get_all(self, refs):
+        self.round_trips += 1
+        for ref in refs:
+            self.reads += 1
+            yield FakeSnapshot(ref.path, self.documents.get(ref.path))
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    db = CountingDB({
+        'Flows/f1': {'name': 'Flow'},
+        'Organizations/o1': {'config': {'greeting': 'hi'}, 'timezone': 'US/Eastern'},
+        'Contacts/c1': {'activeFlows': [{'flow_id': 'f1', 'callCounter': 2}], 'finishedFlows': []},
+        'Contacts/c2': {'activeFlows': []},
+    })
+    monkeypatch.setitem(sys.modules, 'database_ops', types.SimpleNamespace(db=db))
+    monkeypatch.delitem(sys.modules, 'call_context', raising=False)
+    return db
+
+
+def test_single_request_reads_each_document_once(fake_db):
+    call_context = importlib.import_module('call_context')
+    context = call_context.load_call_context({'flow_id': 'f1', 'organization_id': 'o1', 'contact_id': 'c1'})
+
+    assert fake_db.round_trips == 1
+    assert fake_db.reads == 3
+
+    # Everything downstream is answered from the fetched documents
+    assert context.org_config == {'greeting': 'hi'}
+    assert context.get_call_count('f1') == 2
+    assert context.active_flows == [{'flow_id': 'f1', 'callCounter': 2}]
+    assert context.finished_flows == []
+    assert context.contact_update_time == 't0'
+    assert context.document_versions == {'Flows/f1': 't0', 'Organizations/o1': 't0'}
+    assert fake_db.reads == 3
+
+
+def test_missing_document_raises(fake_db):
+    call_context = importlib.import_module('call_context')
+    with pytest.raises(ValueError):
+        call_context.load_call_context({'flow_id': 'f1', 'organization_id': 'o1', 'contact_id': 'missing'})
+    assert fake_db.round_trips == 1
+
+
+def test_bulk_dial_reads_everything_in_one_round_trip(fake_db):
+    call_context = importlib.import_module('call_context')
+    versions = {}
+    flow_doc, organization_info, contexts, missing = call_context.load_batch_call_contexts('f1', 'o1', ['c1', 'c2', 'c3'], versions)
+
+    assert fake_db.round_trips == 1
+    assert fake_db.reads == 5
+    assert sorted(contexts) == ['c1', 'c2']
+    assert missing == ['c3']
+    assert contexts['c1'].clock is contexts['c2'].clock
+    assert contexts['c1'].document_versions is versions
+    assert versions == {'Flows/f1': 't0', 'Organizations/o1': 't0'}
+    assert contexts['c2'].get_call_count('f1') == 0
+    assert fake_db.reads == 5
+
+
+class FakeBucket:
+    def get_blob(self, name):
+        return None
+
+
+class FakeStorageClient:
+    def bucket(self, name):
+        return FakeBucket()
+
+
+PROMPT_PARAMETERS = {'general_knowledgebase_id': 'kb1', 'rules_id': 'r1', 'script_id': 's1'}
+
+
+@pytest.fixture
+def request_db(monkeypatch):
+    """The real database_ops, PayloadCrafter and PayloadFactory, backed by a CountingDB."""
+    for module in ('google.cloud.firestore', 'google.cloud.storage', 'google.api_core', 'bs4'):
+        pytest.importorskip(module)
+    from google.cloud import firestore, storage
+
+    db = CountingDB({
+        'Flows/convert': {'flow_type': 'Convert', 'maxAttempts': 3, 'prompt_parameters': PROMPT_PARAMETERS},
+        'Flows/engage': {'flow_type': 'Engage', 'maxAttempts': 3, 'prompt_parameters': PROMPT_PARAMETERS},
+        'Flows/revive': {'flow_type': 'Revive', 'maxAttempts': 3, 'prompt_parameters': PROMPT_PARAMETERS},
+        'Flows/other': {'flow_type': '', 'maxAttempts': 3, 'prompt_parameters': PROMPT_PARAMETERS},
+        'Flows/pathway': {'flow_type': 'Revive', 'maxAttempts': 3, 'prompt_parameters': {**PROMPT_PARAMETERS, 'script_id': 's2'}},
+        'Organizations/o1': {'config': {'greeting': 'hi'}, 'timezone': 'US/Eastern', 'org_name': 'Acme'},
+        'Contacts/c1': {'firstName': 'Ana', 'phoneNumber': '5125550100', 'activeFlows': [{'flow_id': 'revive', 'callCounter': 1}], 'finishedFlows': []},
+        'KnowledgeBases/kb1': {'knowledge_base_text': 'facts'},
+        'Rules/r1': {'rules': ['Be brief.'], 'guidelines': []},
+        'Scripts/s1': {'prompt': '<p>Hello</p>', 'voicemail': 'Call us back.'},
+        'Scripts/s2': {'pathway_id': 'p1'},
+    })
+    monkeypatch.setattr(firestore, 'Client', lambda *args, **kwargs: db)
+    monkeypatch.setattr(storage, 'Client', FakeStorageClient)
+    # config and secret_manager create Cloud clients at import
+    monkeypatch.setitem(sys.modules, 'config', types.SimpleNamespace(config={}))
+    monkeypatch.setitem(sys.modules, 'secret_manager', types.SimpleNamespace(access_secret_version=lambda *args: 'key'))
+    for name in ('database_ops', 'call_context', 'payload_factory', 'prompt_crafting'):
+        monkeypatch.delitem(sys.modules, name, raising=False)
+    return db
+
+
+def build_call(flow_id):
+    """The reads and writes of one call_builder request, in the order main.call_builder makes them."""
+    call_context = importlib.import_module('call_context')
+    database_ops = importlib.import_module('database_ops')
+    prompt_crafting = importlib.import_module('prompt_crafting')
+
+    context = call_context.load_call_context({'flow_id': flow_id, 'organization_id': 'o1', 'contact_id': 'c1'})
+    flow_doc, versions = context.flow_doc, context.document_versions
+    parameters = flow_doc['prompt_parameters']
+    crafter = prompt_crafting.PayloadCrafter(
+        knowledge_base=database_ops.query_document_by_id('KnowledgeBases', parameters['general_knowledgebase_id'], versions),
+        rules_and_guidelines=database_ops.query_document_by_id('Rules', parameters['rules_id'], versions),
+        prompt_ref=database_ops.query_document_by_id('Scripts', parameters['script_id'], versions),
+        organization_info=context.organization_info,
+        contact_info=context.contact_info,
+        call_settings={},
+        flow_doc=flow_doc,
+        call_context=context
+    )
+    payload = crafter.craft_payload()
+    database_ops.update_contact_flow('c1', flow_id, flow_doc['maxAttempts'], context)
+    return payload
+
+
+@pytest.mark.parametrize('flow_id, payload_key, expected_reads', [
+    ('convert', 'retry', 6),
+    ('engage', 'voicemail_message', 6),
+    ('revive', 'task', 6),
+    ('other', 'task', 6),
+    ('pathway', 'pathway_id', 6),
+])
+def test_reads_per_flow_type(request_db, flow_id, payload_key, expected_reads):
+    payload = build_call(flow_id)
+
+    # Flow, Organization and Contact in one batched get, then the knowledge base, rules and script.
+    # Crafting the payload and counting the attempt read nothing more.
+    assert request_db.reads == expected_reads
+    assert request_db.round_trips == 4
+    assert payload_key in payload
+    assert [path for path, _ in request_db.writes] == ['Contacts/c1']
+
+    # A second contact of the same flow renders the cached template; the reads are the same
+    build_call(flow_id)
+    assert request_db.reads == 2 * expected_reads
+
+
+def test_changed_contact_costs_one_extra_read(request_db):
+    call_context = importlib.import_module('call_context')
+    database_ops = importlib.import_module('database_ops')
+    context = call_context.load_call_context({'flow_id': 'revive', 'organization_id': 'o1', 'contact_id': 'c1'})
+    context.contact_update_time = 't-stale'
+
+    database_ops.update_contact_flow('c1', 'revive', 3, context)
+
+    assert request_db.reads == 3 + 1
+    assert len(request_db.writes) == 1
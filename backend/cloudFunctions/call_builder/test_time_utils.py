@@ -0,0 +1,57 @@
+import datetime
+
+import pytest
+import pytz
+
+from time_utils import ClockSnapshot, get_day_time, get_day_times, get_timezone
+
+
+def reference_day_time(timezone_str, utc_now):
+    """The original per-call implementation, evaluated at a fixed instant."""
+    now = utc_now.astimezone(pytz.timezone(timezone_str))
+    return now.strftime('%A'), "morning" if now.hour < 12 else "afternoon"
+
+
+ZONES = ['US/Eastern', 'US/Central', 'US/Pacific', 'America/Phoenix', 'Pacific/Honolulu', 'Europe/London', 'Asia/Kolkata', 'UTC']
+
+INSTANTS = [
+    datetime.datetime(2026, 3, 8, 6, 59, tzinfo=pytz.utc),    # just before US spring-forward
+    datetime.datetime(2026, 3, 8, 7, 0, tzinfo=pytz.utc),     # US/Eastern jumps 02:00 -> 03:00
+    datetime.datetime(2026, 11, 1, 5, 30, tzinfo=pytz.utc),   # inside the repeated US/Eastern hour
+    datetime.datetime(2026, 11, 1, 6, 30, tzinfo=pytz.utc),
+    datetime.datetime(2026, 3, 29, 0, 59, tzinfo=pytz.utc),   # Europe/London spring-forward
+    datetime.datetime(2026, 6, 19, 15, 59, tzinfo=pytz.utc),  # Friday, noon boundary in US/Eastern
+    datetime.datetime(2026, 6, 19, 16, 0, tzinfo=pytz.utc),
+    datetime.datetime(2026, 12, 31, 23, 59, tzinfo=pytz.utc), # year boundary
+]
+
+
+@pytest.mark.parametrize('utc_now', INSTANTS)
+@pytest.mark.parametrize('zone', ZONES)
+def test_matches_original_implementation(zone, utc_now):
+    assert ClockSnapshot(utc_now).day_time(zone) == reference_day_time(zone, utc_now)
+
+
+def test_snapshot_is_memoized_per_zone():
+    clock = ClockSnapshot(INSTANTS[0])
+    first = clock.day_time('US/Eastern')
+    assert clock.day_time('US/Eastern') is first
+    assert get_day_time('US/Eastern', clock) is first
+
+
+def test_day_times_share_one_reading():
+    clock = ClockSnapshot(INSTANTS[5])
+    day_times = get_day_times(['US/Eastern', 'US/Pacific', 'US/Eastern'], clock)
+    assert list(day_times) == ['US/Eastern', 'US/Pacific']
+    assert day_times['US/Eastern'] == ('Friday', 'morning')
+    assert day_times['US/Pacific'] == ('Friday', 'morning')
+
+
+def test_weekend():
+    assert ClockSnapshot(INSTANTS[5]).is_weekend('US/Eastern')
+    assert not ClockSnapshot(datetime.datetime(2026, 6, 17, 15, tzinfo=pytz.utc)).is_weekend('US/Eastern')
+
+
+def test_unknown_zone_raises():
+    with pytest.raises(pytz.UnknownTimeZoneError):
+        get_timezone('Not/AZone')
@@ -1,11 +1,57 @@
 # time_utils.py
 
 import datetime
+import functools
 import pytz
 
-def get_day_time(timezone_str):
-    timezone = pytz.timezone(timezone_str)
-    now = datetime.datetime.now(timezone)
-    part_of_day = "morning" if now.hour < 12 else "afternoon"
-    day_of_week = now.strftime('%A')
-    return day_of_week, part_of_day
\ No newline at end of file
+WEEKEND_DAYS = ('Friday', 'Saturday', 'Sunday')
+
+
+@functools.lru_cache(maxsize=512)
+def get_timezone(timezone_str):
+    """pytz zone lookup, cached; unknown names raise pytz.UnknownTimeZoneError as before."""
+    return pytz.timezone(timezone_str)
+
+
+def _day_time(timezone_str, utc_now):
+    local_now = utc_now.astimezone(get_timezone(timezone_str))
+    part_of_day = "morning" if local_now.hour < 12 else "afternoon"
+    day_of_week = local_now.strftime('%A')
+    return day_of_week, part_of_day
+
+
+class ClockSnapshot:
+    """
+    One reading of the clock for a request. Greeting and voicemail builders share it, so every
+    sentence of a payload (and every payload of a bulk dial) agrees on the day and day part.
+    """
+
+    def __init__(self, utc_now=None):
+        self.utc_now = utc_now or datetime.datetime.now(pytz.utc)
+        self._day_times = {}
+
+    def day_time(self, timezone_str):
+        """(day_of_week, part_of_day) in timezone_str, computed once per zone."""
+        day_time = self._day_times.get(timezone_str)
+        if day_time is None:
+            day_time = _day_time(timezone_str, self.utc_now)
+            self._day_times[timezone_str] = day_time
+        return day_time
+
+    def is_weekend(self, timezone_str):
+        return self.day_time(timezone_str)[0] in WEEKEND_DAYS
+
+
+def get_day_time(timezone_str, clock=None):
+    return (clock or ClockSnapshot()).day_time(timezone_str)
+
+
+def get_day_times(timezone_strs, clock=None):
+    """
+    Day parts for many timezones against one clock reading.
+
+    Returns:
+        dict: timezone_str -> (day_of_week, part_of_day), one entry per distinct zone.
+    """
+    clock = clock or ClockSnapshot()
+    return {timezone_str: clock.day_time(timezone_str) for timezone_str in dict.fromkeys(timezone_strs)}
@@ -4,16 +4,6 @@ from database_ops import query_document_by_id
 def validate_request(request_json):
     return request_json and all(key in request_json for key in ['flow_id', 'contact_id', 'organization_id'])
 
-def get_required_documents(request_json):
-    flow_doc = query_document_by_id('Flows', request_json['flow_id'])
-    organization_info = query_document_by_id('Organizations', request_json['organization_id'])
-    contact_info = query_document_by_id('Contacts', request_json['contact_id'])
-    
-    if not all([flow_doc, organization_info, contact_info]):
-        raise ValueError("One or more required documents not found")
-    
-    return flow_doc, organization_info, contact_info
-
 def get_knowledge_base(flow_doc):
     prompt_parameters = flow_doc.get('prompt_parameters', {})
     general_knowledge_id = prompt_parameters.get('general_knowledgebase_id')
@@ -0,0 +1,41 @@
+"""
+Benchmark for extract_json_object on typical model output and on adversarial webhook input.
+
+    python bench_json_extract.py [--repeat 200]
+"""
+import argparse
+import json
+import time
+from json_extract import extract_json_object
+
+INSIGHTS = {
+    "outcome": "Appointment Booked",
+    "answers": {f"question_{i}": f"answer {i} with {{braces}} and \"quotes\"" for i in range(20)},
+    "summary": "The lead asked about pricing. " * 40
+}
+
+CASES = {
+    'fenced_insights': "Sure, here is the analysis:\n```json\n" + json.dumps(INSIGHTS, indent=2) + "\n```\nThanks",
+    'prose_then_invalid_then_valid': "Notes {not json} and more " * 50 + json.dumps(INSIGHTS),
+    'open_braces_20k': '{' * 20000,
+    'truncated_object_27kb': '{"summary": "' + 'x' * 27000,
+    'nested_unterminated_5k': '{"a": ' * 5000,
+}
+
+
+def bench(text, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        try:
+            extract_json_object(text)
+        except ValueError:
+            pass
+    return (time.perf_counter() - started) * 1000.0 / repeat
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+    for name, text in CASES.items():
+        print(f"{name:32s} {len(text):>8d} chars  {bench(text, args.repeat):8.3f} ms/call")
@@ -0,0 +1,159 @@
+import datetime
+import os
+import random
+import re
+from google.cloud import firestore
+
+# One document per organization, flow, UTC day and shard. Dashboards sum the shards of the days they
+# show instead of scanning Calls.
+ROLLUP_COLLECTION = 'CallRollupShards'
+# Spreads increments for busy flows over several documents (Firestore sustains ~1 write/s per document)
+NUM_SHARDS = int(os.environ.get('CALL_ROLLUP_SHARDS', 10))
+# Stands in for the flow of inbound calls, which have none
+INBOUND_FLOW = 'inbound'
+
+STATUSES = ('answered', 'voicemail', 'no_answer', 'inbound')
+
+
+def day_key(moment=None):
+    return (moment or datetime.datetime.now(datetime.timezone.utc)).astimezone(datetime.timezone.utc).strftime('%Y-%m-%d')
+
+
+def outcome_key(outcome):
+    """Outcome names come from Insights documents; keep them usable as a single field name."""
+    return re.sub(r'[^a-z0-9_]+', '_', str(outcome or 'unknown').lower()).strip('_') or 'unknown'
+
+
+def rollup_status(answered_by, inbound=False):
+    """Maps a Calls answered_by value to a rollup status."""
+    if inbound:
+        return 'inbound'
+    return {'human': 'answered', 'voicemail': 'voicemail', 'no answer': 'no_answer'}.get(answered_by, 'no_answer')
+
+
+def rollup_scope(original_request):
+    """
+    (organization_id, flow_id) a call is counted under, read from the original_request stored on its
+    Calls document. The webhook and rebuild_call_rollups both use it so a rebuild reproduces the live totals.
+    """
+    original_request = original_request or {}
+    return original_request.get('organization_id') or '', original_request.get('flow_id') or INBOUND_FLOW
+
+
+def _number(value):
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def shard_id(organization_id, flow_id, day, shard):
+    return f"{organization_id}_{flow_id or INBOUND_FLOW}_{day}_{shard}"
+
+
+def rollup_values(status, outcome, call_length, call_cost, calls=1):
+    """Counter values contributed by `calls` calls, as a nested dict of field -> number."""
+    values = {
+        'calls': calls,
+        'call_length_sum': _number(call_length),
+        'call_cost_sum': _number(call_cost),
+        'status': {status: calls}
+    }
+    if outcome:
+        values['outcome'] = {outcome_key(outcome): calls}
+    return values
+
+
+def _as_increments(values):
+    return {
+        key: _as_increments(value) if isinstance(value, dict) else firestore.Increment(value)
+        for key, value in values.items()
+    }
+
+
+def record_call_rollup(db, organization_id, flow_id, status, outcome, call_length, call_cost, moment=None):
+    """Adds one processed call to a random shard of its organization/flow/day rollup."""
+    day = day_key(moment)
+    flow_id = flow_id or INBOUND_FLOW
+    shard = random.randrange(NUM_SHARDS)
+    db.collection(ROLLUP_COLLECTION).document(shard_id(organization_id, flow_id, day, shard)).set({
+        'organization_id': organization_id,
+        'flow_id': flow_id,
+        'date': day,
+        'shard': shard,
+        **_as_increments(rollup_values(status, outcome, call_length, call_cost))
+    }, merge=True)
+
+
+def _merge_values(total, values):
+    for key, value in values.items():
+        if isinstance(value, dict):
+            _merge_values(total.setdefault(key, {}), value)
+        elif isinstance(value, (int, float)):
+            total[key] = total.get(key, 0) + value
+
+
+def read_call_rollups(db, organization_id, start_day, end_day, flow_id=None):
+    """
+    Summed rollups for an organization between two 'YYYY-MM-DD' days (inclusive).
+
+    Returns:
+        dict of (flow_id, day) -> {'calls', 'call_length_sum', 'call_cost_sum', 'status': {...}, 'outcome': {...}}.
+        Requires a composite index on (organization_id, date).
+    """
+    query = db.collection(ROLLUP_COLLECTION).where('organization_id', '==', organization_id)
+    query = query.where('date', '>=', start_day).where('date', '<=', end_day)
+    totals = {}
+    for snapshot in query.stream():
+        data = snapshot.to_dict()
+        if flow_id and data.get('flow_id') != flow_id:
+            continue
+        values = {key: value for key, value in data.items() if key not in ('organization_id', 'flow_id', 'date', 'shard')}
+        _merge_values(totals.setdefault((data.get('flow_id'), data.get('date')), {}), values)
+    return totals
+
+
+def rebuild_call_rollups(db, day):
+    """
+    Recomputes every rollup of one UTC day from the Calls processed that day and overwrites its shards.
+
+    Shard 0 of each organization/flow receives the recomputed totals; the other shards, and rollups
+    with no remaining calls, are deleted. Meant for days that are no longer receiving webhooks.
+
+    Returns:
+        (calls_counted, rollups_written)
+    """
+    start = datetime.datetime.strptime(day, '%Y-%m-%d').replace(tzinfo=datetime.timezone.utc)
+    end = start + datetime.timedelta(days=1)
+
+    totals = {}
+    calls_counted = 0
+    calls = db.collection('Calls').where('processed_at', '>=', start).where('processed_at', '<', end).stream()
+    for snapshot in calls:
+        call = snapshot.to_dict()
+        if call.get('is_test') or not call.get('answered_by'):
+            continue
+        key = rollup_scope(call.get('original_request'))
+        if not key[0]:
+            continue
+        status = rollup_status(call.get('answered_by'), call.get('inbound', False))
+        outcome = (call.get('call_analysis') or {}).get('outcome') if status in ('answered', 'inbound') else None
+        _merge_values(totals.setdefault(key, {}), rollup_values(status, outcome, call.get('call_length'), call.get('call_cost')))
+        calls_counted += 1
+
+    bulk_writer = db.bulk_writer()
+    existing = db.collection(ROLLUP_COLLECTION).where('date', '==', day).stream()
+    for snapshot in existing:
+        data = snapshot.to_dict()
+        if data.get('shard') != 0 or (data.get('organization_id'), data.get('flow_id')) not in totals:
+            bulk_writer.delete(snapshot.reference)
+    for (organization_id, flow_id), values in totals.items():
+        bulk_writer.set(db.collection(ROLLUP_COLLECTION).document(shard_id(organization_id, flow_id, day, 0)), {
+            'organization_id': organization_id,
+            'flow_id': flow_id,
+            'date': day,
+            'shard': 0,
+            **values
+        })
+    bulk_writer.close()
+    return calls_counted, len(totals)
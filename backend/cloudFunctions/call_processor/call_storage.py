@@ -0,0 +1,138 @@
+import gzip
+import hashlib
+import os
+from google.cloud import firestore, storage
+
+# 'inline' keeps everything on the Calls document; 'gcs' or 'local' moves large text fields to gzip blobs
+CALL_STORAGE_MODE = os.environ.get('CALL_STORAGE_MODE', 'inline')
+CALL_STORAGE_BUCKET = os.environ.get('CALL_STORAGE_BUCKET', os.environ.get('CONFIG_BUCKET', 'heyisaai'))
+LOCAL_CALL_STORAGE_DIR = os.environ.get('LOCAL_CALL_STORAGE_DIR', '/tmp/call_storage')
+
+# Calls fields that can grow without bound
+EXTERNALIZED_FIELDS = ('concatenated_transcript', 'response')
+# Smaller values stay inline; a reference would not save anything
+INLINE_MAX_BYTES = int(os.environ.get('CALL_STORAGE_INLINE_MAX_BYTES', 1024))
+# Leading characters kept on the document as {field}_summary
+SUMMARY_CHARS = int(os.environ.get('CALL_STORAGE_SUMMARY_CHARS', 280))
+
+
+class GCSBlobStore:
+    """Call blobs in a GCS bucket, addressed as gs://bucket/path."""
+
+    def __init__(self, bucket_name=CALL_STORAGE_BUCKET):
+        self.bucket_name = bucket_name
+        self._bucket = None
+
+    @property
+    def bucket(self):
+        if self._bucket is None:
+            self._bucket = storage.Client().bucket(self.bucket_name)
+        return self._bucket
+
+    def put(self, path, data):
+        self.bucket.blob(path).upload_from_string(data, content_type='application/gzip')
+        return f"gs://{self.bucket_name}/{path}"
+
+    def get(self, uri):
+        path = uri[len(f"gs://{self.bucket_name}/"):]
+        return self.bucket.blob(path).download_as_bytes()
+
+
+class LocalBlobStore:
+    """Call blobs on the local filesystem, addressed as file:///path (CALL_STORAGE_MODE=local, for tests)."""
+
+    def __init__(self, root=LOCAL_CALL_STORAGE_DIR):
+        self.root = os.path.abspath(root)
+
+    def put(self, path, data):
+        full_path = os.path.join(self.root, path)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        with open(full_path, 'wb') as blob_file:
+            blob_file.write(data)
+        return f"file://{full_path}"
+
+    def get(self, uri):
+        with open(uri[len("file://"):], 'rb') as blob_file:
+            return blob_file.read()
+
+
+def get_blob_store():
+    """Store for new writes, or None when CALL_STORAGE_MODE is 'inline'."""
+    if CALL_STORAGE_MODE == 'gcs':
+        return GCSBlobStore()
+    if CALL_STORAGE_MODE == 'local':
+        return LocalBlobStore()
+    return None
+
+
+def store_for_uri(uri):
+    """Store that can read uri, whatever mode new writes use."""
+    if uri.startswith('gs://'):
+        return GCSBlobStore(uri[len('gs://'):].split('/', 1)[0])
+    if uri.startswith('file://'):
+        return LocalBlobStore('/')
+    raise ValueError(f"Unsupported call blob URI: {uri}")
+
+
+def externalize_call_fields(call_id, call_data, store=None, update=False):
+    """
+    Moves large transcript and provider response fields out of a Calls write.
+
+    Each moved field is written gzip-compressed to calls/{call_id}/{field}.txt.gz and replaced by
+    {field}_ref (uri, sizes, sha256) and {field}_summary. Returns the dict to write; call_data is not
+    modified. Without a store (inline mode) nothing is moved.
+
+    With update=True the result is meant for DocumentReference.update(), which leaves other fields in
+    place: writing a field one way then deletes the other form (the inline field for a _ref, the _ref
+    and _summary for an inline value), so a document never holds a stale copy next to the current one.
+    """
+    store = store or get_blob_store()
+    externalized = dict(call_data)
+    for field in EXTERNALIZED_FIELDS:
+        value = externalized.get(field)
+        if not isinstance(value, str):
+            continue
+        raw = value.encode('utf-8')
+        if store is None or len(raw) < INLINE_MAX_BYTES:
+            if update:
+                externalized[f"{field}_ref"] = firestore.DELETE_FIELD
+                externalized[f"{field}_summary"] = firestore.DELETE_FIELD
+            continue
+
+        compressed = gzip.compress(raw)
+        uri = store.put(f"calls/{call_id}/{field}.txt.gz", compressed)
+        if update:
+            externalized[field] = firestore.DELETE_FIELD
+        else:
+            del externalized[field]
+        externalized[f"{field}_ref"] = {
+            "uri": uri,
+            "encoding": "gzip",
+            "bytes": len(raw),
+            "stored_bytes": len(compressed),
+            "sha256": hashlib.sha256(raw).hexdigest()
+        }
+        externalized[f"{field}_summary"] = value[:SUMMARY_CHARS]
+    return externalized
+
+
+def load_call_field(call_data, field, store=None):
+    """Full value of a Calls field, read from the document or fetched from its blob on demand."""
+    if field in call_data:
+        return call_data[field]
+    ref = call_data.get(f"{field}_ref")
+    if not ref:
+        return None
+    store = store or store_for_uri(ref["uri"])
+    return gzip.decompress(store.get(ref["uri"])).decode('utf-8')
+
+
+def hydrate_call_data(call_data):
+    """Copy of a Calls document with every externalized field fetched back under its original name."""
+    hydrated = dict(call_data)
+    for field in EXTERNALIZED_FIELDS:
+        if field not in hydrated and hydrated.get(f"{field}_ref"):
+            hydrated[field] = load_call_field(hydrated, field)
+            hydrated.pop(f"{field}_ref", None)
+            hydrated.pop(f"{field}_summary", None)
+    return hydrated
@@ -0,0 +1,93 @@
+import os
+import datetime
+from google.api_core import exceptions
+
+# Collection holding one ledger entry per (call_id, status) webhook delivery
+LEDGER_COLLECTION = 'ProcessedWebhooks'
+
+# How long a 'processing' claim is honoured before another delivery may take it over
+LEASE_SECONDS = int(os.environ.get('WEBHOOK_LEASE_SECONDS', 300))
+
+
+def ledger_key(call_id, status):
+    """Builds the ledger document ID for a webhook delivery."""
+    safe_status = (status or 'unknown').replace('/', '_')
+    return f"{call_id}_{safe_status}"
+
+
+def claim_webhook(db, call_id, status):
+    """
+    Claims a webhook delivery before processing it.
+
+    The claim is a create-if-absent write, so only one delivery of the same
+    (call_id, status) pair can hold it. A claim whose lease has expired is taken
+    over with an update guarded by the snapshot's update_time.
+
+    Returns:
+        (ledger_ref, previous_result): previous_result is None when the caller
+        owns the claim and should process the delivery. Otherwise it is the stored
+        result of the earlier delivery (or an in-progress marker) and the caller
+        should return it as is.
+    """
+    ledger_ref = db.collection(LEDGER_COLLECTION).document(ledger_key(call_id, status))
+    now = datetime.datetime.now(datetime.timezone.utc)
+    claim = {
+        'call_id': call_id,
+        'status': status,
+        'state': 'processing',
+        'claimed_at': now,
+        'lease_expires_at': now + datetime.timedelta(seconds=LEASE_SECONDS)
+    }
+
+    try:
+        ledger_ref.create(claim)
+        return ledger_ref, None
+    except exceptions.AlreadyExists:
+        pass
+
+    snapshot = ledger_ref.get()
+    if not snapshot.exists:
+        # Claim was released between our create and read; try once more
+        try:
+            ledger_ref.create(claim)
+            return ledger_ref, None
+        except exceptions.AlreadyExists:
+            snapshot = ledger_ref.get()
+
+    entry = snapshot.to_dict() or {}
+    if entry.get('state') == 'completed':
+        print(f"Duplicate webhook delivery for call {call_id} ({status}). Returning previous result.")
+        return ledger_ref, entry.get('result', {"success": True, "message": "Already processed."})
+
+    lease_expires_at = entry.get('lease_expires_at')
+    if lease_expires_at and lease_expires_at > now:
+        print(f"Webhook delivery for call {call_id} ({status}) is already being processed.")
+        return ledger_ref, {"success": True, "message": "Call is already being processed.", "in_progress": True}
+
+    try:
+        ledger_ref.update(claim, option=db.write_option(last_update_time=snapshot.update_time))
+        print(f"Stale claim for call {call_id} ({status}) taken over.")
+        return ledger_ref, None
+    except (exceptions.FailedPrecondition, exceptions.NotFound):
+        print(f"Lost the race to take over the stale claim for call {call_id} ({status}).")
+        return ledger_ref, {"success": True, "message": "Call is already being processed.", "in_progress": True}
+
+
+def complete_webhook(ledger_ref, result):
+    """Marks a claimed delivery as completed and stores its result for duplicates."""
+    try:
+        ledger_ref.update({
+            'state': 'completed',
+            'result': result,
+            'completed_at': datetime.datetime.now(datetime.timezone.utc)
+        })
+    except Exception as e:
+        print(f"Error completing webhook ledger entry {ledger_ref.id}: {e}")
+
+
+def release_webhook(ledger_ref):
+    """Drops a claim so that a later retry of the same delivery is processed again."""
+    try:
+        ledger_ref.delete()
+    except Exception as e:
+        print(f"Error releasing webhook ledger entry {ledger_ref.id}: {e}")
@@ -0,0 +1,141 @@
+import json
+from json_extract import extract_json_object
+
+REPAIR_MODEL = "gpt-4o-mini"
+
+
+class CallInsights:
+    """Validated call analysis as stored in Calls/{call_id}.call_analysis."""
+
+    __slots__ = ('outcome', 'answers', 'summary')
+
+    def __init__(self, outcome, answers, summary):
+        self.outcome = outcome
+        self.answers = answers
+        self.summary = summary
+
+    def to_dict(self):
+        return {
+            "outcome": self.outcome,
+            "answers": self.answers,
+            "summary": self.summary
+        }
+
+
+def build_insights_schema(insights_instructions):
+    """
+    Builds the JSON schema for structured outputs from an Insights document.
+
+    Outcomes become an enum and each question title becomes a nullable string under 'answers'.
+    Strict mode requires every property, so unanswerable questions come back as null and are dropped
+    during validation.
+    """
+    outcomes = list((insights_instructions.get("outcomes") or {}).keys())
+    question_titles = list((insights_instructions.get("questions_to_answer") or {}).keys())
+
+    outcome_schema = {"type": "string"}
+    if outcomes:
+        outcome_schema["enum"] = outcomes
+
+    return {
+        "type": "object",
+        "properties": {
+            "outcome": outcome_schema,
+            "answers": {
+                "type": "object",
+                "properties": {title: {"type": ["string", "null"]} for title in question_titles},
+                "required": question_titles,
+                "additionalProperties": False
+            },
+            "summary": {"type": "string"}
+        },
+        "required": ["outcome", "answers", "summary"],
+        "additionalProperties": False
+    }
+
+
+def insights_response_format(insights_instructions):
+    """Returns the response_format argument for a structured-output chat completion."""
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "call_insights",
+            "strict": True,
+            "schema": build_insights_schema(insights_instructions)
+        }
+    }
+
+
+def validate_insights(data, insights_instructions):
+    """
+    Validates parsed model output against the Insights document.
+
+    Returns:
+        CallInsights
+
+    Raises:
+        ValueError: If the output does not match the expected structure.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Analysis is not a JSON object")
+
+    outcome = data.get("outcome")
+    if not isinstance(outcome, str) or not outcome:
+        raise ValueError("Analysis is missing an outcome")
+    outcomes = insights_instructions.get("outcomes") or {}
+    if outcomes and outcome not in outcomes:
+        raise ValueError(f"Unknown outcome: {outcome}")
+
+    answers = data.get("answers", {})
+    if not isinstance(answers, dict):
+        raise ValueError("Analysis answers are not an object")
+    answers = {
+        str(title): answer if isinstance(answer, str) else json.dumps(answer)
+        for title, answer in answers.items()
+        if answer not in (None, "")
+    }
+
+    summary = data.get("summary", "")
+    if not isinstance(summary, str):
+        raise ValueError("Analysis summary is not a string")
+
+    return CallInsights(outcome, answers, summary)
+
+
+def parse_insights(analysis_text, insights_instructions):
+    """Extracts and validates a CallInsights from raw model text, raising ValueError on failure."""
+    return validate_insights(extract_json_object(analysis_text), insights_instructions)
+
+
+def repair_insights(client, analysis_text, insights_instructions):
+    """
+    Makes one pass with a cheaper model to coerce malformed analysis text into the schema.
+
+    Returns:
+        CallInsights
+
+    Raises:
+        ValueError: If the repaired output still does not validate.
+    """
+    outcomes = ", ".join((insights_instructions.get("outcomes") or {}).keys())
+    system_prompt = (
+        "Rewrite the following call analysis as JSON matching the provided schema. "
+        "Keep the original meaning; do not invent answers. Use null for questions without an answer."
+    )
+    if outcomes:
+        system_prompt += f" The outcome must be one of: {outcomes}."
+
+    try:
+        response = client.chat.completions.create(
+            model=REPAIR_MODEL,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": analysis_text or ""}
+            ],
+            temperature=0.0,
+            response_format=insights_response_format(insights_instructions)
+        )
+    except Exception as e:
+        raise ValueError(f"Repair request failed: {e}")
+
+    return parse_insights(response.choices[0].message.content, insights_instructions)
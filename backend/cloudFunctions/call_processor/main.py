@@ -2,7 +2,7 @@ import os
 import re
 import json
 import requests
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 from openai import OpenAI
 import firebase_admin
 from firebase_admin import credentials, firestore
@@ -15,6 +15,12 @@ from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import base64
 from secret_manager import access_secret_version
+from idempotency import claim_webhook, complete_webhook, release_webhook
+from insights_schema import insights_response_format, parse_insights, repair_insights
+from call_storage import externalize_call_fields, hydrate_call_data
+from flow_history import update_contact_with_history
+from call_rollups import record_call_rollup, rebuild_call_rollups, rollup_scope, day_key
+from webhook_inbox import WEBHOOK_MODE, accept_webhook
 import copy
 
 
@@ -275,10 +281,11 @@ def normalize_call_status(status):
     normalized_status = normalized_status.replace(" ", "")
     return normalized_status
 
-def grab_call_info(call_id):
+def grab_call_info(call_id, field_paths=None):
     try:
         doc_ref = db.collection('Calls').document(call_id)
-        doc = doc_ref.get()
+        # Projected reads skip the transcript and provider response when only the request is needed
+        doc = doc_ref.get(field_paths=field_paths)
 
         if doc.exists:
             print("Successfully fetched call information.")
@@ -328,6 +335,67 @@ def call_processor(request):
         return abort(400, "Bad Request: No JSON payload provided.")
 
     call_id = request_data.get("call_id", "")
+    if not call_id:
+        return process_call_event(request_data)
+
+    if WEBHOOK_MODE == 'async':
+        if not isinstance(call_id, str):
+            return abort(400, "Bad Request: call_id must be a string.")
+        # Acknowledge once the event is in the inbox; process_webhook_event does the work
+        try:
+            accepted = accept_webhook(request_data)
+            return jsonify({"success": True, "message": "Accepted." if accepted else "Already accepted."}), 202
+        except Exception as e:
+            print(f"Failed to enqueue webhook for call {call_id}, processing inline: {e}")
+
+    return process_webhook(request_data)
+
+@functions_framework.http
+def process_webhook_event(request):
+    """
+    Worker for WEBHOOK_MODE=async, called by the webhook inbox queue with the original event. Non-2xx
+    responses make the queue retry, so failures and deliveries still held by another claim return 503.
+    """
+    request_data = request.get_json(silent=True)
+    if not request_data or not request_data.get("call_id"):
+        return jsonify({"success": False, "message": "Invalid webhook event."}), 400
+
+    response = process_webhook(request_data)
+    result = response.get_json(silent=True) or {}
+    if not result.get("success") or result.get("in_progress"):
+        return jsonify(result), 503
+    return jsonify(result)
+
+def process_webhook(request_data):
+    call_id = request_data.get("call_id", "")
+
+    # The create-only claim only marks the delivery as in progress. It is marked completed after
+    # processing succeeds and released when it fails, so a retry is short-circuited as a duplicate
+    # only once an earlier delivery has actually finished.
+    ledger_ref, previous_result = claim_webhook(db, call_id, request_data.get("status", ""))
+    if previous_result is not None:
+        response = jsonify(previous_result)
+        if previous_result.get("in_progress"):
+            # Not done yet (or its instance died): ask the provider to retry, which takes over an expired claim
+            response.status_code = 409
+        return response
+
+    try:
+        response = process_call_event(request_data)
+    except Exception:
+        release_webhook(ledger_ref)
+        raise
+
+    result = response.get_json(silent=True) or {}
+    if result.get("success"):
+        complete_webhook(ledger_ref, result)
+    else:
+        # Let Bland's retry run the pipeline again
+        release_webhook(ledger_ref)
+    return response
+
+def process_call_event(request_data):
+    call_id = request_data.get("call_id", "")
     
     # Extract all necessary data from request_data
     call_length = request_data.get("call_length", 0)
@@ -360,11 +428,12 @@ def call_processor(request):
         return process_inbound_call(from_number, organization_id, call_id, call_length, to_number, language, completed, created_at, inbound, queue_status, endpoint_url, max_duration, error_message, recording_url, concatenated_transcript, status, corrected_duration, end_at, call_cost, summary, is_test)
 
     # For outbound calls, proceed with existing logic
-    call_data = grab_call_info(call_id)
+    call_data = grab_call_info(call_id, ['original_request'])
     if call_data is None:
         return jsonify({"success": False, "message": "Failed to fetch call information."})
     
     is_test = call_data.get('original_request', {}).get('test', False)
+    rollup_organization_id, flow_id = rollup_scope(call_data.get('original_request'))
     
     call_status_result_unclean = call_status(openai_client, concatenated_transcript, is_test)
     call_status_result = normalize_call_status(call_status_result_unclean)
@@ -372,9 +441,9 @@ def call_processor(request):
     if "answered" in call_status_result:
         return process_answered_call(call_id, call_length, to_number, from_number, language, completed, created_at, inbound, queue_status, endpoint_url, max_duration, error_message, recording_url, concatenated_transcript, status, corrected_duration, end_at, call_cost, organization_id, is_test)
     elif "voicemail" in call_status_result:
-        return process_voicemail_call(call_id, call_length, to_number, from_number, language, completed, created_at, inbound, queue_status, endpoint_url, max_duration, error_message, recording_url, concatenated_transcript, status, corrected_duration, end_at, call_cost, is_test)
+        return process_voicemail_call(call_id, call_length, to_number, from_number, language, completed, created_at, inbound, queue_status, endpoint_url, max_duration, error_message, recording_url, concatenated_transcript, status, corrected_duration, end_at, call_cost, is_test, rollup_organization_id, flow_id)
     else: 
-        return process_no_answer_call(call_id, call_length, to_number, from_number, language, completed, created_at, inbound, queue_status, endpoint_url, max_duration, error_message, recording_url, concatenated_transcript, status, corrected_duration, end_at, call_cost, is_test)
+        return process_no_answer_call(call_id, call_length, to_number, from_number, language, completed, created_at, inbound, queue_status, endpoint_url, max_duration, error_message, recording_url, concatenated_transcript, status, corrected_duration, end_at, call_cost, is_test, rollup_organization_id, flow_id)
 
 def process_inbound_call(from_number, organization_id, call_id, call_length, to_number, language, completed, created_at, inbound, queue_status, endpoint_url, max_duration, error_message, recording_url, concatenated_transcript, status, corrected_duration, end_at, call_cost, summary, is_test):
     contact_ref = find_contact_by_phone_and_org(from_number, organization_id)
@@ -394,9 +463,13 @@ def process_inbound_call(from_number, organization_id, call_id, call_length, to_
     else:
         contact_id = contact_ref.id
 
+    original_request = {
+        "contact_id": contact_id,
+        "organization_id": organization_id
+    }
     doc_ref = db.collection('Calls').document(call_id)
     try:
-        doc_ref.set({
+        doc_ref.set(externalize_call_fields(call_id, {
             "call_id": call_id,
             "callTimestamp": datetime.utcnow(),
             "call_length": call_length,
@@ -421,14 +494,13 @@ def process_inbound_call(from_number, organization_id, call_id, call_length, to_
                 "outcome": "inbound",
                 "summary": summary
             },
-            "original_request": {
-                "contact_id": contact_id,
-                "organization_id": organization_id
-            },
+            "original_request": original_request,
             "processed_at": firestore.SERVER_TIMESTAMP,
             "is_test": is_test
-        })
+        }))
         
+        record_rollup(*rollup_scope(original_request), 'inbound', 'inbound', call_length, call_cost, is_test)
+
         # Remove the reference to request_data and use the function parameters
         update_contact_in_contacts(from_number, organization_id, None, "inbound", call_id, created_at, is_test)
 
@@ -437,7 +509,7 @@ def process_inbound_call(from_number, organization_id, call_id, call_length, to_
         return jsonify({"success": False, "message": "Failed to store inbound call data."})
 
 def process_answered_call(call_id, call_length, to_number, from_number, language, completed, created_at, inbound, queue_status, endpoint_url, max_duration, error_message, recording_url, concatenated_transcript, status, corrected_duration, end_at, call_cost, organization_id, is_test):
-    call_made_info = grab_call_info(call_id)
+    call_made_info = grab_call_info(call_id, ['original_request'])
     if call_made_info is None:
         return jsonify({"success": False, "message": "Failed to fetch call information."})
     
@@ -447,16 +519,23 @@ def process_answered_call(call_id, call_length, to_number, from_number, language
         return jsonify({"success": False, "message": "Failed to fetch system prompt."})
 
     insights_response = call_insights(openai_client, insights_instructions, concatenated_transcript, is_test)
+    if "error" in insights_response:
+        return jsonify({"success": False, "message": "Failed to generate analysis response."})
 
+    analysis_text = insights_response.get("insights", "")
     try:
-        insights_data = json.loads(insights_response.get("insights", "{}"))
-
-    except json.JSONDecodeError as e:
-        return jsonify({"success": False, "message": "Failed to parse analysis response."})
+        insights = parse_insights(analysis_text, insights_instructions)
+    except ValueError as e:
+        print(f"Analysis response failed validation ({e}). Attempting repair.")
+        try:
+            insights = repair_insights(openai_client, analysis_text, insights_instructions)
+        except ValueError as repair_error:
+            print(f"Error repairing analysis response: {repair_error}")
+            return jsonify({"success": False, "message": "Failed to parse analysis response."})
 
     try:
         doc_ref = db.collection('Calls').document(call_id)
-        doc_ref.update({
+        doc_ref.update(externalize_call_fields(call_id, {
             "call_length": call_length,
             "to_number": to_number,
             "from_number": from_number,
@@ -475,21 +554,23 @@ def process_answered_call(call_id, call_length, to_number, from_number, language
             "corrected_duration": corrected_duration,
             "end_at": end_at,
             "call_cost": call_cost,
-            "call_analysis": insights_data,
+            "call_analysis": insights.to_dict(),
             "processed_at": firestore.SERVER_TIMESTAMP,
             "is_test": is_test
-        })
+        }, update=True))
         
+        record_rollup(*rollup_scope(original_request), 'answered', insights.outcome, call_length, call_cost, is_test)
+
         contact_id = original_request.get('contact_id')
-        update_contact_in_contacts(to_number, organization_id, original_request.get('flow_id', ''), insights_data.get('outcome'), call_id, created_at, is_test)
+        update_contact_in_contacts(to_number, organization_id, original_request.get('flow_id', ''), insights.outcome, call_id, created_at, is_test)
 
         return jsonify({"success": True, "message": "Call data processed and stored successfully."})
     except Exception as e:
         return jsonify({"success": False, "message": "Failed to store call analysis."})
 
-def process_voicemail_call(call_id, call_length, to_number, from_number, language, completed, created_at, inbound, queue_status, endpoint_url, max_duration, error_message, recording_url, concatenated_transcript, status, corrected_duration, end_at, call_cost, is_test):
+def process_voicemail_call(call_id, call_length, to_number, from_number, language, completed, created_at, inbound, queue_status, endpoint_url, max_duration, error_message, recording_url, concatenated_transcript, status, corrected_duration, end_at, call_cost, is_test, organization_id='', flow_id=None):
     doc_ref = db.collection('Calls').document(call_id)
-    doc_ref.update({
+    doc_ref.update(externalize_call_fields(call_id, {
         "call_length": call_length,
         "to_number": to_number,
         "from_number": from_number,
@@ -510,12 +591,13 @@ def process_voicemail_call(call_id, call_length, to_number, from_number, languag
         "call_cost": call_cost,
         "processed_at": firestore.SERVER_TIMESTAMP,
         "is_test": is_test
-    })
+    }, update=True))
+    record_rollup(organization_id, flow_id, 'voicemail', None, call_length, call_cost, is_test)
     return jsonify({"success": True, "message": "Voicemail. Call data stored successfully."})
 
-def process_no_answer_call(call_id, call_length, to_number, from_number, language, completed, created_at, inbound, queue_status, endpoint_url, max_duration, error_message, recording_url, concatenated_transcript, status, corrected_duration, end_at, call_cost, is_test):
+def process_no_answer_call(call_id, call_length, to_number, from_number, language, completed, created_at, inbound, queue_status, endpoint_url, max_duration, error_message, recording_url, concatenated_transcript, status, corrected_duration, end_at, call_cost, is_test, organization_id='', flow_id=None):
     doc_ref = db.collection('Calls').document(call_id)
-    doc_ref.update({
+    doc_ref.update(externalize_call_fields(call_id, {
         "call_length": call_length,
         "to_number": to_number,
         "from_number": from_number,
@@ -536,9 +618,19 @@ def process_no_answer_call(call_id, call_length, to_number, from_number, languag
         "call_cost": call_cost,
         "processed_at": firestore.SERVER_TIMESTAMP,
         "is_test": is_test
-    })
+    }, update=True))
+    record_rollup(organization_id, flow_id, 'no_answer', None, call_length, call_cost, is_test)
     return jsonify({"success": True, "message": "No answer. Call data stored successfully."})
 
+def record_rollup(organization_id, flow_id, status, outcome, call_length, call_cost, is_test):
+    """Counts a processed call in the organization/flow/day rollups. Never fails the webhook."""
+    if is_test or not organization_id:
+        return
+    try:
+        record_call_rollup(db, organization_id, flow_id, status, outcome, call_length, call_cost)
+    except Exception as e:
+        print(f"Error recording call rollup for {organization_id}/{flow_id}: {e}")
+
 def update_contact_in_contacts(phone_number, organization_id, flow_id, outcome, call_id, created_at, is_test):
     print(f"Entering update_contact_in_contacts. Phone: {phone_number}, Org ID: {organization_id}, Flow ID: {flow_id}, Outcome: {outcome}")
     try:
@@ -619,7 +711,7 @@ def update_contact_in_contacts(phone_number, organization_id, flow_id, outcome,
                 'lastCallAnswered': created_at,
                 'recentOutcome': outcome
             }
-            contact_ref.update(update_data)
+            update_contact_with_history(db, contact_ref, update_data)
             print(f"Contact {contact_ref.id} updated successfully with data: {json.dumps(update_data, indent=2)}")
 
             # Verify the update
@@ -668,6 +760,8 @@ def send_data_to_sync(contact_doc_ref, call_doc_ref, sync_link, notification_ema
 
         if contact_data and call_data:
             call_data.pop('call_cost', None)
+            # Sync consumers and the notification email get the full transcript, fetched only here
+            call_data = hydrate_call_data(call_data)
 
             payload = {
                 'contact': contact_data,
@@ -750,7 +844,7 @@ def call_insights(client, system_prompt, transcript, is_test):
     
     crafted_system_prompt += "\nPlease structure the response as a JSON object including the best fit outcome, "
     crafted_system_prompt += "answers to the questions, and a summary of the conversation. "
-    crafted_system_prompt += "Omit any questions that cannot be answered based on the transcript. "
+    crafted_system_prompt += "Use null for any questions that cannot be answered based on the transcript. "
     crafted_system_prompt += "The response should strictly follow the example's structure and include nothing beyond it."
     
     try:
@@ -761,6 +855,7 @@ def call_insights(client, system_prompt, transcript, is_test):
                 {"role": "user", "content": transcript}
             ],
             temperature=0.3,
+            response_format=insights_response_format(system_prompt)
         )
         
         analysis_response = response.choices[0].message.content.strip()
@@ -769,3 +864,18 @@ def call_insights(client, system_prompt, transcript, is_test):
     except Exception as e:
         print(f"Error during call analysis: {e}")
         return {"error": str(e)}
+
+@functions_framework.http
+def reconcile_call_rollups(request):
+    """
+    Rebuilds CallRollupShards for one UTC day from Calls. Accepts {"date": "YYYY-MM-DD"}; defaults to
+    yesterday, so a daily Cloud Scheduler job corrects any drift from retried or partial webhooks.
+    """
+    request_data = request.get_json(silent=True) or {}
+    day = request_data.get("date") or day_key(datetime.now(timezone.utc) - timedelta(days=1))
+    try:
+        calls_counted, rollups_written = rebuild_call_rollups(db, day)
+    except ValueError:
+        return jsonify({"success": False, "message": f"Invalid date: {day}"}), 400
+    print(f"Rebuilt {rollups_written} rollups for {day} from {calls_counted} calls")
+    return jsonify({"success": True, "date": day, "calls": calls_counted, "rollups": rollups_written})
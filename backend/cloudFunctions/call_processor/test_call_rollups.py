@@ -0,0 +1,258 @@
+import copy
+import datetime
+
+import pytest
+
+pytest.importorskip('google.cloud.firestore')
+
+from google.cloud import firestore
+
+import call_rollups
+from call_rollups import (
+    INBOUND_FLOW, ROLLUP_COLLECTION, _merge_values, outcome_key, read_call_rollups, rebuild_call_rollups,
+    record_call_rollup, rollup_scope, rollup_status, rollup_values
+)
+
+DAY = '2026-03-03'
+MOMENT = datetime.datetime(2026, 3, 3, 15, 30, tzinfo=datetime.timezone.utc)
+
+OPERATORS = {
+    '==': lambda a, b: a == b,
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>=': lambda a, b: a >= b,
+}
+
+
+def _apply(stored, values):
+    """What set(merge=True) does with nested maps and Increment transforms."""
+    for key, value in values.items():
+        if isinstance(value, dict):
+            _apply(stored.setdefault(key, {}), value)
+        elif isinstance(value, firestore.Increment):
+            stored[key] = stored.get(key, 0) + value.value
+        else:
+            stored[key] = value
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+
+class FakeDocument:
+    def __init__(self, collection, doc_id):
+        self.collection = collection
+        self.id = doc_id
+
+    def set(self, data, merge=False):
+        documents = self.collection.documents
+        if merge:
+            _apply(documents.setdefault(self.id, {}), data)
+        else:
+            documents[self.id] = {}
+            _apply(documents[self.id], data)
+
+    def delete(self):
+        self.collection.documents.pop(self.id, None)
+
+
+class FakeQuery:
+    def __init__(self, collection, filters=()):
+        self.collection = collection
+        self.filters = filters
+
+    def where(self, field, op, value):
+        return FakeQuery(self.collection, self.filters + ((field, op, value),))
+
+    def stream(self):
+        for doc_id, data in sorted(self.collection.documents.items()):
+            if all(field in data and OPERATORS[op](data[field], value) for field, op, value in self.filters):
+                yield FakeSnapshot(self.collection.document(doc_id), data)
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self):
+        super().__init__(self)
+        self.documents = {}
+
+    def document(self, doc_id):
+        return FakeDocument(self, doc_id)
+
+
+class FakeBulkWriter:
+    def set(self, reference, data):
+        reference.set(data)
+
+    def delete(self, reference):
+        reference.delete()
+
+    def close(self):
+        pass
+
+
+class FakeDB:
+    def __init__(self):
+        self.collections = {}
+
+    def collection(self, name):
+        return self.collections.setdefault(name, FakeCollection())
+
+    def bulk_writer(self):
+        return FakeBulkWriter()
+
+
+def call(call_id, answered_by, organization_id='org1', flow_id='flow1', outcome=None, inbound=False, **fields):
+    original_request = {'organization_id': organization_id, 'contact_id': f"contact_{call_id}"}
+    if flow_id:
+        original_request['flow_id'] = flow_id
+    document = {
+        'call_id': call_id,
+        'answered_by': answered_by,
+        'inbound': inbound,
+        'original_request': original_request,
+        'call_length': fields.get('call_length', 1.5),
+        'call_cost': fields.get('call_cost', 0.25),
+        'processed_at': fields.get('processed_at', MOMENT),
+        'is_test': fields.get('is_test', False),
+    }
+    if outcome:
+        document['call_analysis'] = {'outcome': outcome}
+    return document
+
+
+CALLS = [
+    call('c1', 'human', outcome='Appointment Set'),
+    call('c2', 'human', outcome='appointment set'),
+    call('c3', 'voicemail'),
+    call('c4', 'no answer', call_length=None, call_cost='n/a'),
+    call('c5', 'human', flow_id='flow2', outcome='Not Interested', call_length='2'),
+    call('c6', 'human', flow_id=None, outcome='inbound', inbound=True),
+    call('c7', 'human', organization_id='org2', outcome='Callback'),
+]
+
+
+def record_live(db, calls):
+    """Records each call as the webhook does after writing its Calls document."""
+    for document in calls:
+        status = rollup_status(document['answered_by'], document['inbound'])
+        outcome = document.get('call_analysis', {}).get('outcome') if status in ('answered', 'inbound') else None
+        organization_id, flow_id = rollup_scope(document['original_request'])
+        record_call_rollup(db, organization_id, flow_id, status, outcome, document['call_length'],
+                           document['call_cost'], moment=MOMENT)
+
+
+def test_outcome_key():
+    assert outcome_key('Appointment Set') == 'appointment_set'
+    assert outcome_key('  Call-back / later! ') == 'call_back_later'
+    assert outcome_key('Not.Interested') == 'not_interested'
+    assert outcome_key(None) == 'unknown'
+    assert outcome_key('') == 'unknown'
+    assert outcome_key('!!!') == 'unknown'
+
+
+def test_rollup_status():
+    assert rollup_status('human') == 'answered'
+    assert rollup_status('voicemail') == 'voicemail'
+    assert rollup_status('no answer') == 'no_answer'
+    assert rollup_status('') == 'no_answer'
+    assert rollup_status('something new') == 'no_answer'
+    assert rollup_status('voicemail', inbound=True) == 'inbound'
+
+
+def test_rollup_scope():
+    assert rollup_scope({'organization_id': 'org1', 'flow_id': 'flow1'}) == ('org1', 'flow1')
+    assert rollup_scope({'organization_id': 'org1'}) == ('org1', INBOUND_FLOW)
+    assert rollup_scope(None) == ('', INBOUND_FLOW)
+
+
+def test_rollup_values():
+    assert rollup_values('answered', 'Appointment Set', '90.5', 0.3) == {
+        'calls': 1,
+        'call_length_sum': 90.5,
+        'call_cost_sum': 0.3,
+        'status': {'answered': 1},
+        'outcome': {'appointment_set': 1},
+    }
+    # Missing or malformed numbers count as zero, and calls without an outcome have no outcome map
+    assert rollup_values('voicemail', None, None, 'n/a', calls=3) == {
+        'calls': 3,
+        'call_length_sum': 0.0,
+        'call_cost_sum': 0.0,
+        'status': {'voicemail': 3},
+    }
+
+
+def test_merge_values():
+    total = {}
+    _merge_values(total, rollup_values('answered', 'Appointment Set', 10, 1))
+    _merge_values(total, rollup_values('answered', 'appointment set', 20, 2))
+    _merge_values(total, rollup_values('voicemail', None, 5, 0.5))
+    _merge_values(total, {'calls': 1, 'label': 'ignored', 'status': {'no_answer': 1}})
+    assert total == {
+        'calls': 4,
+        'call_length_sum': 35.0,
+        'call_cost_sum': 3.5,
+        'status': {'answered': 2, 'voicemail': 1, 'no_answer': 1},
+        'outcome': {'appointment_set': 2},
+    }
+
+
+def test_shards_sum_to_the_recorded_calls(monkeypatch):
+    db = FakeDB()
+    shards = iter(range(100))
+    monkeypatch.setattr(call_rollups.random, 'randrange', lambda n: next(shards) % n)
+    record_live(db, CALLS[:4])
+
+    assert len(db.collection(ROLLUP_COLLECTION).documents) == 4
+    totals = read_call_rollups(db, 'org1', DAY, DAY)
+    assert totals == {('flow1', DAY): {
+        'calls': 4,
+        'call_length_sum': 4.5,
+        'call_cost_sum': 0.75,
+        'status': {'answered': 2, 'voicemail': 1, 'no_answer': 1},
+        'outcome': {'appointment_set': 2},
+    }}
+    assert read_call_rollups(db, 'org1', DAY, DAY, flow_id='flow2') == {}
+    assert read_call_rollups(db, 'org1', '2026-03-04', '2026-03-05') == {}
+
+
+def test_rebuild_matches_the_live_path():
+    live = FakeDB()
+    record_live(live, CALLS)
+
+    rebuilt = FakeDB()
+    for document in CALLS:
+        rebuilt.collection('Calls').document(document['call_id']).set(document)
+    # Not counted: test calls, calls without an answered_by, and calls processed on other days
+    rebuilt.collection('Calls').document('test').set(call('test', 'human', outcome='Callback', is_test=True))
+    rebuilt.collection('Calls').document('pending').set(call('pending', ''))
+    rebuilt.collection('Calls').document('late').set(
+        call('late', 'human', outcome='Callback', processed_at=MOMENT + datetime.timedelta(days=1)))
+    # Stale shards of the day are replaced
+    rebuilt.collection(ROLLUP_COLLECTION).document('stale').set({
+        'organization_id': 'org1', 'flow_id': 'gone', 'date': DAY, 'shard': 3, 'calls': 9
+    })
+
+    assert rebuild_call_rollups(rebuilt, DAY) == (len(CALLS), 4)
+    for organization_id in ('org1', 'org2'):
+        assert read_call_rollups(rebuilt, organization_id, DAY, DAY) == read_call_rollups(live, organization_id, DAY, DAY)
+    assert ('org1', 'gone') not in {
+        (data['organization_id'], data['flow_id']) for data in rebuilt.collection(ROLLUP_COLLECTION).documents.values()
+    }
+    assert read_call_rollups(rebuilt, 'org1', DAY, DAY)[(INBOUND_FLOW, DAY)]['status'] == {'inbound': 1}
+
+
+def test_rebuild_is_idempotent():
+    db = FakeDB()
+    for document in CALLS:
+        db.collection('Calls').document(document['call_id']).set(document)
+    rebuild_call_rollups(db, DAY)
+    first = copy.deepcopy(db.collection(ROLLUP_COLLECTION).documents)
+    rebuild_call_rollups(db, DAY)
+    assert db.collection(ROLLUP_COLLECTION).documents == first
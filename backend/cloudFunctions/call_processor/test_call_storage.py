@@ -0,0 +1,107 @@
+import gzip
+import hashlib
+
+import pytest
+
+pytest.importorskip('google.cloud.storage')
+pytest.importorskip('google.cloud.firestore')
+
+from google.cloud import firestore
+
+import call_storage
+from call_storage import (
+    INLINE_MAX_BYTES, LocalBlobStore, externalize_call_fields, hydrate_call_data, load_call_field, store_for_uri
+)
+
+SMALL = 'short transcript'
+LARGE = 'agent: hello\nuser: hi there\n' * (INLINE_MAX_BYTES // 10)
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LocalBlobStore(str(tmp_path))
+
+
+def apply_update(document, update):
+    """What DocumentReference.update() does to the stored fields."""
+    document = dict(document)
+    for field, value in update.items():
+        if value is firestore.DELETE_FIELD:
+            document.pop(field, None)
+        else:
+            document[field] = value
+    return document
+
+
+def test_small_fields_stay_inline(store):
+    call_data = {'call_id': 'c1', 'concatenated_transcript': SMALL, 'response': '{"ok": true}'}
+    assert externalize_call_fields('c1', call_data, store) == call_data
+
+
+def test_large_field_round_trip(store):
+    call_data = {'call_id': 'c1', 'concatenated_transcript': LARGE, 'response': SMALL}
+    written = externalize_call_fields('c1', call_data, store)
+
+    assert call_data['concatenated_transcript'] == LARGE  # the input is not modified
+    assert 'concatenated_transcript' not in written
+    assert written['response'] == SMALL
+    ref = written['concatenated_transcript_ref']
+    assert ref['uri'].startswith('file://') and ref['uri'].endswith('calls/c1/concatenated_transcript.txt.gz')
+    assert ref['bytes'] == len(LARGE.encode('utf-8'))
+    assert ref['stored_bytes'] < ref['bytes']
+    assert ref['sha256'] == hashlib.sha256(LARGE.encode('utf-8')).hexdigest()
+    assert written['concatenated_transcript_summary'] == LARGE[:call_storage.SUMMARY_CHARS]
+    assert gzip.decompress(store.get(ref['uri'])).decode('utf-8') == LARGE
+
+    assert load_call_field(written, 'concatenated_transcript', store) == LARGE
+    # Readers resolve the store from the URI alone
+    assert load_call_field(written, 'concatenated_transcript') == LARGE
+    assert load_call_field(written, 'response') == SMALL
+    assert load_call_field(written, 'missing') is None
+
+
+def test_threshold_is_in_bytes(store):
+    value = 'é' * (INLINE_MAX_BYTES // 2)  # two bytes each in UTF-8, so half as many characters reach the limit
+    written = externalize_call_fields('c1', {'response': value}, store)
+    assert 'response_ref' in written
+
+
+def test_hydrate_restores_original_fields(store):
+    call_data = {'call_id': 'c1', 'concatenated_transcript': LARGE, 'response': LARGE + 'x'}
+    written = externalize_call_fields('c1', call_data, store)
+    assert hydrate_call_data(written) == call_data
+    # Documents written inline are returned as they are
+    assert hydrate_call_data({'call_id': 'c2', 'response': SMALL}) == {'call_id': 'c2', 'response': SMALL}
+
+
+def test_update_to_ref_deletes_stale_inline_value(store):
+    document = externalize_call_fields('c1', {'call_id': 'c1', 'concatenated_transcript': SMALL}, store)
+    update = externalize_call_fields('c1', {'concatenated_transcript': LARGE}, store, update=True)
+    assert update['concatenated_transcript'] is firestore.DELETE_FIELD
+
+    document = apply_update(document, update)
+    assert 'concatenated_transcript' not in document
+    assert load_call_field(document, 'concatenated_transcript') == LARGE
+
+
+def test_update_to_inline_deletes_stale_ref(store):
+    document = externalize_call_fields('c1', {'call_id': 'c1', 'response': LARGE}, store)
+    update = externalize_call_fields('c1', {'response': SMALL}, store, update=True)
+
+    document = apply_update(document, update)
+    assert document == {'call_id': 'c1', 'response': SMALL}
+    assert hydrate_call_data(document)['response'] == SMALL
+
+
+def test_inline_mode_update_clears_refs_left_by_an_earlier_mode(store, monkeypatch):
+    document = externalize_call_fields('c1', {'call_id': 'c1', 'response': LARGE}, store)
+    monkeypatch.setattr(call_storage, 'CALL_STORAGE_MODE', 'inline')
+    update = externalize_call_fields('c1', {'response': LARGE + 'new'}, update=True)
+    assert apply_update(document, update) == {'call_id': 'c1', 'response': LARGE + 'new'}
+
+
+def test_store_for_uri(tmp_path):
+    assert isinstance(store_for_uri(f"file://{tmp_path}/x.gz"), LocalBlobStore)
+    assert store_for_uri('gs://bucket/calls/c1/response.txt.gz').bucket_name == 'bucket'
+    with pytest.raises(ValueError):
+        store_for_uri('s3://bucket/x')
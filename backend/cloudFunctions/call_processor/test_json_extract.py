@@ -0,0 +1,94 @@
+import json
+import random
+import time
+
+import pytest
+
+from json_extract import extract_json_object
+
+
+def test_plain_object():
+    assert extract_json_object('{"outcome": "Booked"}') == {"outcome": "Booked"}
+
+
+def test_code_fence_and_prose():
+    text = 'Here you go:\n```json\n{"a": {"b": [1, 2]}, "c": "x"}\n```\nLet me know!'
+    assert extract_json_object(text) == {"a": {"b": [1, 2]}, "c": "x"}
+
+
+def test_braces_and_escapes_inside_strings():
+    obj = {"summary": "use {braces} and \"quotes\" and \\ backslashes }", "n": 1}
+    assert extract_json_object(f"prefix {json.dumps(obj)} suffix") == obj
+
+
+def test_quote_in_prose_before_object():
+    assert extract_json_object('He said "hi {"a": 1}') == {"a": 1}
+
+
+def test_skips_unparseable_candidate():
+    assert extract_json_object('{not json} then {"a": 1}') == {"a": 1}
+
+
+def test_timestamp_lines_inside_object():
+    text = '{\n"a": 1,\n2024-05-01 10:00:00 INFO something\n"b": 2\n}'
+    assert extract_json_object(text) == {"a": 1, "b": 2}
+
+
+def test_stray_closing_brace_before_object():
+    assert extract_json_object('} oops {"a": 1}') == {"a": 1}
+
+
+@pytest.mark.parametrize('text', ['', None, 'no json here', '{"a": 1', '{"a": "unterminated}'])
+def test_no_object(text):
+    with pytest.raises(ValueError):
+        extract_json_object(text)
+
+
+def _random_value(rng, depth=0):
+    kind = rng.randrange(6 if depth < 4 else 3)
+    if kind == 0:
+        return rng.randint(-1000, 1000)
+    if kind == 1:
+        return ''.join(rng.choice('ab{}[]"\\:, \n\té') for _ in range(rng.randrange(12)))
+    if kind == 2:
+        return rng.choice([True, False, None])
+    if kind == 3:
+        return [_random_value(rng, depth + 1) for _ in range(rng.randrange(4))]
+    return {f"k{i}": _random_value(rng, depth + 1) for i in range(rng.randrange(4))}
+
+
+def test_fuzz_embedded_objects_round_trip():
+    rng = random.Random(1234)
+    for _ in range(2000):
+        obj = {f"key{i}": _random_value(rng) for i in range(rng.randrange(1, 5))}
+        # Prose without braces around the object, with quotes and backslashes that must be ignored
+        prefix = ''.join(rng.choice('abc "\\\n:') for _ in range(rng.randrange(20)))
+        suffix = ''.join(rng.choice('abc "\\\n:}{') for _ in range(rng.randrange(20)))
+        assert extract_json_object(prefix + json.dumps(obj, indent=rng.choice([None, 2])) + suffix) == obj
+
+
+def test_fuzz_random_text_never_crashes():
+    rng = random.Random(99)
+    for _ in range(2000):
+        text = ''.join(rng.choice('{}[]":,\\ a1\n') for _ in range(rng.randrange(200)))
+        try:
+            result = extract_json_object(text)
+        except ValueError:
+            continue
+        assert isinstance(result, dict)
+
+
+@pytest.mark.parametrize('text', [
+    '{' * 20000,
+    '{"a": "' + 'x' * 27000,
+    '{"a": ' * 5000,
+    '{}' * 20000,
+    ' {x' * 20000,
+])
+def test_adversarial_input_is_linear(text):
+    started = time.perf_counter()
+    try:
+        extract_json_object(text)
+    except ValueError:
+        pass
+    assert time.perf_counter() - started < 1.0
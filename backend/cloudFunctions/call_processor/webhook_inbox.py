@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from google.api_core import exceptions
+from google.cloud import tasks_v2
+from idempotency import ledger_key
+
+# 'inline' processes webhooks in the request; 'async' acknowledges with 202 and hands them to the worker
+WEBHOOK_MODE = os.environ.get('WEBHOOK_MODE', 'inline')
+# 'cloud_tasks', or 'local' for an in-memory inbox (local runs and tests)
+WEBHOOK_QUEUE = os.environ.get('WEBHOOK_QUEUE', 'cloud_tasks')
+
+PROJECT_ID = os.environ.get('PROJECT_ID', 'heyisaai')
+LOCATION = os.environ.get('WEBHOOK_QUEUE_LOCATION', 'us-central1')
+QUEUE_NAME = os.environ.get('WEBHOOK_QUEUE_NAME', 'call-webhooks')
+WORKER_URL = os.environ.get('WEBHOOK_WORKER_URL', "https://us-central1-heyisaai.cloudfunctions.net/process_webhook_event")
+SERVICE_ACCOUNT_EMAIL = os.environ.get('WEBHOOK_TASK_SERVICE_ACCOUNT', "54875993561-compute@developer.gserviceaccount.com")
+
+
+def event_task_id(call_id, status):
+    """
+    Deterministic task ID for one (call_id, status) delivery. Cloud Tasks rejects a name it has seen in
+    roughly the last hour, so provider retries of an accepted event are acknowledged without a second task.
+    """
+    base = re.sub(r'[^A-Za-z0-9_-]', '_', ledger_key(call_id, status))
+    prefix = hashlib.sha1(base.encode('utf-8')).hexdigest()[:8]
+    return f"{prefix}-{base}"[:500]
+
+
+class CloudTasksInbox:
+    """Webhook events held as Cloud Tasks that POST them to the worker, which Cloud Tasks retries on failure."""
+
+    _client = None
+    _client_lock = threading.Lock()
+
+    @classmethod
+    def client(cls):
+        # Creating the client costs more than the enqueue itself; share one per instance
+        with cls._client_lock:
+            if cls._client is None:
+                cls._client = tasks_v2.CloudTasksClient()
+            return cls._client
+
+    def enqueue(self, task_id, event):
+        """Persists an event; returns False when it was already accepted under the same task ID."""
+        client = self.client()
+        task = {
+            "name": client.task_path(PROJECT_ID, LOCATION, QUEUE_NAME, task_id),
+            "http_request": {
+                "http_method": tasks_v2.HttpMethod.POST,
+                "url": WORKER_URL,
+                "oidc_token": {
+                    "service_account_email": SERVICE_ACCOUNT_EMAIL
+                },
+                "headers": {"Content-Type": "application/json"},
+                "body": json.dumps(event).encode()
+            }
+        }
+        try:
+            client.create_task(parent=client.queue_path(PROJECT_ID, LOCATION, QUEUE_NAME), task=task)
+        except exceptions.AlreadyExists:
+            return False
+        return True
+
+
+class LocalInbox:
+    """In-memory stand-in for CloudTasksInbox (WEBHOOK_QUEUE=local). Tests drain it with pop()."""
+
+    def __init__(self):
+        self.events = {}
+        self.seen = set()
+        self._lock = threading.Lock()
+
+    def enqueue(self, task_id, event):
+        with self._lock:
+            if task_id in self.seen:
+                return False
+            self.seen.add(task_id)
+            self.events[task_id] = json.loads(json.dumps(event))
+        return True
+
+    def pop(self):
+        """Removes and returns the oldest pending (task_id, event), or None."""
+        with self._lock:
+            if not self.events:
+                return None
+            task_id = next(iter(self.events))
+            return task_id, self.events.pop(task_id)
+
+
+_local_inbox = LocalInbox()
+
+
+def get_inbox():
+    if WEBHOOK_QUEUE == 'local':
+        return _local_inbox
+    return CloudTasksInbox()
+
+
+def accept_webhook(event):
+    """
+    Persists a validated webhook event for the worker. Returns True if it was newly accepted and False
+    for a duplicate of an event already in the inbox.
+    """
+    call_id = event.get("call_id", "")
+    return get_inbox().enqueue(event_task_id(call_id, event.get("status", "")), event)
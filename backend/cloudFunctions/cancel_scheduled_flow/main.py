@@ -5,6 +5,7 @@ from google.api_core import exceptions
 import datetime
 import pytz
 import json
+from slot_allocator import held_slot, release_slots
 
 # Initialize the Firebase Admin SDK if not already initialized
 if not firebase_admin._apps:
@@ -23,6 +24,8 @@ def batch_cancel_flow(flow_id, batch_size=500):
     
     contact_count = 0
     tasks_to_delete = []
+    # Dispatch slots reserved by batch_reschedule_flow, returned to the organization's capacity
+    slots_to_release = []
     
     for flow_contact in flow_contacts:
         contact_id = flow_contact.id
@@ -45,8 +48,12 @@ def batch_cancel_flow(flow_id, batch_size=500):
                 
                 # Get the Cloud Task ID if it exists
                 canceled_flow = next((flow for flow in active_flows if flow['flow_id'] == flow_id), None)
-                if canceled_flow and 'cloud_task_id' in canceled_flow:
+                # Deferred flows have no Cloud Task yet; the sweeper skips them once activeFlows is cleared
+                if canceled_flow and canceled_flow.get('cloud_task_id'):
                     tasks_to_delete.append(canceled_flow['cloud_task_id'])
+                slot = held_slot(canceled_flow, flow_id, contact_id)
+                if slot and slot not in slots_to_release:
+                    slots_to_release.append(slot)
             
             if flow_contact_snapshot.exists:
                 # Remove the isScheduled flag from the flow_contacts subcollection
@@ -62,16 +69,27 @@ def batch_cancel_flow(flow_id, batch_size=500):
         if contact_count % batch_size == 0:
             delete_cloud_tasks(tasks_to_delete)
             tasks_to_delete = []
+            release_dispatch_slots(db, slots_to_release)
+            slots_to_release = []
 
     # Process any remaining task deletions
     if tasks_to_delete:
         delete_cloud_tasks(tasks_to_delete)
+    if slots_to_release:
+        release_dispatch_slots(db, slots_to_release)
     
     # Update the flow status to 'canceled' in the Flows collection
     db.collection('Flows').document(flow_id).update({'status': 'draft'})
     
     return f"Canceled flow {flow_id} for {contact_count} contacts"
 
+def release_dispatch_slots(db, held_slots):
+    try:
+        released = release_slots(db, held_slots)
+        print(f"Released {released} dispatch slots")
+    except Exception as e:
+        print(f"Error releasing dispatch slots: {str(e)}")
+
 def delete_cloud_tasks(task_ids):
     tasks_client = tasks_v2.CloudTasksClient()
     for task_id in task_ids:
@@ -0,0 +1,269 @@
+import os
+import json
+import datetime
+from firebase_admin import firestore
+
+# Coaching transcripts waiting to be sent to the Batch API, keyed by call_id
+QUEUE_COLLECTION = 'CoachingAnalysisQueue'
+# One document per submitted batch, keyed by the provider's batch ID
+BATCH_COLLECTION = 'CoachingAnalysisBatches'
+
+BATCH_MODEL = "gpt-3.5-turbo-0125"
+BATCH_ENDPOINT = "/v1/chat/completions"
+MAX_BATCH_SIZE = int(os.getenv("COACHING_BATCH_MAX_SIZE", 5000))
+
+# Firestore caps a write batch at 500 operations
+FIRESTORE_BATCH_LIMIT = 500
+
+# Batch states that will never produce output
+FAILED_BATCH_STATES = ('failed', 'expired', 'cancelled')
+
+# Submissions per call before its analysis is marked failed instead of re-queued
+MAX_ANALYSIS_ATTEMPTS = int(os.getenv("COACHING_BATCH_MAX_ATTEMPTS", 3))
+
+
+class OpenAIBatchClient:
+    """Thin wrapper over the OpenAI Batch API so the queueing logic can run against a local stand-in."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def submit(self, batch_requests):
+        jsonl = "\n".join(json.dumps(batch_request) for batch_request in batch_requests)
+        input_file = self.client.files.create(file=("coaching_batch.jsonl", jsonl.encode("utf-8")), purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window="24h"
+        )
+        return batch.id
+
+    def status(self, batch_id):
+        """Returns (state, output_file_id, error_file_id); either file ID may be None."""
+        batch = self.client.batches.retrieve(batch_id)
+        return batch.status, batch.output_file_id, batch.error_file_id
+
+    def results(self, file_id):
+        """Lines of an output or error file, each carrying the custom_id of its request."""
+        content = self.client.files.content(file_id).text
+        return [json.loads(line) for line in content.splitlines() if line.strip()]
+
+
+class LocalBatchClient:
+    """
+    In-memory stand-in for OpenAIBatchClient. Batches complete as soon as they are polled,
+    with each request answered by the `complete` callable (which receives the request body).
+    Requests for which it raises are reported in the batch's error file.
+    """
+
+    def __init__(self, complete=None):
+        self.complete = complete or (lambda body: json.dumps({"answers": {}, "summary": ""}))
+        self.batches = {}
+
+    def submit(self, batch_requests):
+        batch_id = f"local_batch_{len(self.batches) + 1}"
+        self.batches[batch_id] = list(batch_requests)
+        return batch_id
+
+    def status(self, batch_id):
+        return "completed", f"{batch_id}:output", f"{batch_id}:errors"
+
+    def results(self, file_id):
+        batch_id, _, kind = file_id.rpartition(':')
+        output, errors = [], []
+        for batch_request in self.batches.get(batch_id, []):
+            try:
+                content = self.complete(batch_request["body"])
+            except Exception as e:
+                errors.append({
+                    "custom_id": batch_request["custom_id"],
+                    "response": None,
+                    "error": {"code": "local_error", "message": str(e)}
+                })
+                continue
+            output.append({
+                "custom_id": batch_request["custom_id"],
+                "response": {"status_code": 200, "body": {"choices": [{"message": {"content": content}}]}}
+            })
+        return output if kind == "output" else errors
+
+
+def build_batch_request(call_id, messages, model=BATCH_MODEL):
+    """Builds one line of the Batch API input file for a coaching call."""
+    return {
+        "custom_id": call_id,
+        "method": "POST",
+        "url": BATCH_ENDPOINT,
+        "body": {"model": model, "messages": messages}
+    }
+
+
+def queue_coaching_analysis(db, call_id, messages):
+    """Queues a coaching transcript for the next batch submission."""
+    db.collection(QUEUE_COLLECTION).document(call_id).set({
+        "call_id": call_id,
+        "request": build_batch_request(call_id, messages),
+        "state": "queued",
+        "queued_at": firestore.SERVER_TIMESTAMP
+    })
+    print(f"Queued coaching analysis for call {call_id}.")
+
+
+def _commit_in_chunks(db, refs, data=None, delete=False):
+    for start in range(0, len(refs), FIRESTORE_BATCH_LIMIT):
+        write_batch = db.batch()
+        for ref in refs[start:start + FIRESTORE_BATCH_LIMIT]:
+            if delete:
+                write_batch.delete(ref)
+            else:
+                write_batch.update(ref, data)
+        write_batch.commit()
+
+
+def submit_queued_analyses(db, batch_client):
+    """
+    Submits every queued coaching transcript (up to MAX_BATCH_SIZE) as one Batch API job.
+
+    Returns:
+        The batch ID, or None when nothing was queued.
+    """
+    queued_docs = list(db.collection(QUEUE_COLLECTION).where('state', '==', 'queued').limit(MAX_BATCH_SIZE).stream())
+    if not queued_docs:
+        print("No queued coaching analyses to submit.")
+        return None
+
+    batch_requests = [doc.to_dict()["request"] for doc in queued_docs]
+    batch_id = batch_client.submit(batch_requests)
+
+    call_ids = [doc.id for doc in queued_docs]
+    db.collection(BATCH_COLLECTION).document(batch_id).set({
+        "batch_id": batch_id,
+        "call_ids": call_ids,
+        "state": "submitted",
+        "submitted_at": firestore.SERVER_TIMESTAMP
+    })
+    _commit_in_chunks(db, [doc.reference for doc in queued_docs], {"state": "submitted", "batch_id": batch_id})
+
+    print(f"Submitted coaching batch {batch_id} with {len(call_ids)} calls.")
+    return batch_id
+
+
+def _parse_batch_result(result):
+    response = result.get("response") or {}
+    if response.get("status_code") != 200:
+        raise ValueError(f"Batch request failed: {result.get('error') or response}")
+    content = response["body"]["choices"][0]["message"]["content"].strip()
+    return json.loads(content)
+
+
+def _retry_or_fail(db, call_ids, summary):
+    """
+    Re-queues calls whose batch produced no usable result, or marks their analysis failed once they
+    have been submitted MAX_ANALYSIS_ATTEMPTS times. Returns the queue refs that are done and can be deleted.
+    """
+    queue_refs = [db.collection(QUEUE_COLLECTION).document(call_id) for call_id in call_ids]
+    done_refs = []
+    requeue_refs = []
+    write_batch = db.batch()
+    pending_writes = 0
+    for snapshot in db.get_all(queue_refs):
+        attempts = ((snapshot.to_dict() or {}).get("attempts") or 0) + 1 if snapshot.exists else MAX_ANALYSIS_ATTEMPTS
+        if attempts < MAX_ANALYSIS_ATTEMPTS:
+            requeue_refs.append(snapshot.reference)
+            continue
+        write_batch.update(db.collection('Calls').document(snapshot.id), {"analysis_status": "failed"})
+        done_refs.append(snapshot.reference)
+        summary["analyses_failed"] += 1
+        pending_writes += 1
+        if pending_writes == FIRESTORE_BATCH_LIMIT:
+            write_batch.commit()
+            write_batch = db.batch()
+            pending_writes = 0
+    if pending_writes:
+        write_batch.commit()
+
+    _commit_in_chunks(db, requeue_refs, {
+        "state": "queued",
+        "batch_id": firestore.DELETE_FIELD,
+        "attempts": firestore.Increment(1)
+    })
+    summary["analyses_requeued"] += len(requeue_refs)
+    return done_refs
+
+
+def poll_submitted_batches(db, batch_client):
+    """
+    Checks every submitted batch and writes finished results back into Calls/{call_id}.call_analysis.
+    Calls in failed, expired or cancelled batches, and in a completed batch the calls listed in the
+    error file, with an unparseable result or missing from the output altogether, are re-queued for
+    the next submission, or marked failed after MAX_ANALYSIS_ATTEMPTS submissions.
+
+    Returns:
+        A dict with counts of completed batches, stored, failed and re-queued analyses.
+    """
+    summary = {"batches_completed": 0, "analyses_stored": 0, "analyses_failed": 0, "analyses_requeued": 0}
+
+    for batch_doc in db.collection(BATCH_COLLECTION).where('state', '==', 'submitted').stream():
+        batch_id = batch_doc.id
+        batch_data = batch_doc.to_dict()
+        call_ids = batch_data.get("call_ids", [])
+        state, output_file_id, error_file_id = batch_client.status(batch_id)
+
+        if state in FAILED_BATCH_STATES:
+            print(f"Coaching batch {batch_id} ended with state {state}. Re-queuing {len(call_ids)} calls.")
+            # Counts as an attempt, so a request that always fails is not resubmitted and billed forever
+            _commit_in_chunks(db, _retry_or_fail(db, call_ids, summary), delete=True)
+            batch_doc.reference.update({"state": state})
+            continue
+
+        if state != "completed":
+            continue
+
+        expected = set(call_ids)
+        stored = set()
+        write_batch = db.batch()
+        pending_writes = 0
+        for result in batch_client.results(output_file_id) if output_file_id else []:
+            call_id = result.get("custom_id")
+            if call_id not in expected or call_id in stored:
+                continue
+            try:
+                analysis = _parse_batch_result(result)
+            except (ValueError, KeyError, IndexError, TypeError) as e:
+                print(f"Error parsing batch result for call {call_id}: {e}")
+                continue
+            write_batch.update(db.collection('Calls').document(call_id), {
+                "call_analysis": analysis,
+                "analysis_status": "completed",
+                "processed_at": firestore.SERVER_TIMESTAMP
+            })
+            stored.add(call_id)
+            summary["analyses_stored"] += 1
+            pending_writes += 1
+            if pending_writes == FIRESTORE_BATCH_LIMIT:
+                write_batch.commit()
+                write_batch = db.batch()
+                pending_writes = 0
+        if pending_writes:
+            write_batch.commit()
+
+        if error_file_id:
+            for result in batch_client.results(error_file_id):
+                print(f"Batch request failed for call {result.get('custom_id')}: {result.get('error') or result.get('response')}")
+
+        # Error-file entries, unparseable results and calls absent from both files all lack a stored result
+        unresolved = [call_id for call_id in call_ids if call_id not in stored]
+        done_refs = [db.collection(QUEUE_COLLECTION).document(call_id) for call_id in stored]
+        if unresolved:
+            print(f"Coaching batch {batch_id} has {len(unresolved)} calls without a result.")
+            done_refs += _retry_or_fail(db, unresolved, summary)
+
+        _commit_in_chunks(db, done_refs, delete=True)
+        batch_doc.reference.update({
+            "state": "completed",
+            "completed_at": datetime.datetime.now(datetime.timezone.utc)
+        })
+        summary["batches_completed"] += 1
+        print(f"Stored results for coaching batch {batch_id}.")
+
+    return summary
@@ -6,6 +6,9 @@ import os
 import functions_framework
 import re
 import json
+import time
+from call_storage import externalize_call_fields
+from coaching_batch import OpenAIBatchClient, LocalBatchClient, queue_coaching_analysis, submit_queued_analyses, poll_submitted_batches
 
 # Initialize Firebase Admin SDK outside of your function
 if not firebase_admin._apps:
@@ -18,42 +21,78 @@ db = firestore.client()
 # Initialize the OpenAI client with your API key
 openai_client = OpenAI(api_key=os.getenv("OPENAI_API"))
 
-def grab_coaching_insights(organization_id):
+# 'realtime' analyzes each coaching call inside the webhook; 'batch' queues it for the OpenAI Batch API
+ANALYSIS_MODE = os.getenv("COACHING_ANALYSIS_MODE", "realtime")
+
+# COACHING_BATCH_CLIENT=local swaps in an in-memory stand-in for the Batch API
+if os.getenv("COACHING_BATCH_CLIENT") == "local":
+    batch_client = LocalBatchClient()
+else:
+    batch_client = OpenAIBatchClient(openai_client)
+
+# Seconds a warm instance reuses a fetched coaching insight before re-reading Firestore
+INSIGHTS_CACHE_TTL_SECONDS = int(os.getenv("COACHING_INSIGHTS_CACHE_TTL_SECONDS", 300))
+
+# (organization_id, insight_id or None) -> (expires_at, insight_data)
+_coaching_insights_cache = {}
+
+def invalidate_coaching_insights(organization_id=None):
     """
-    Retrieves insights documents of type 'coaching' for the specified organization from the 'Insights' collection.
+    Drops cached coaching insights for an organization, or for every organization when none is given.
+    """
+    if organization_id is None:
+        _coaching_insights_cache.clear()
+        return
+    for key in [key for key in _coaching_insights_cache if key[0] == organization_id]:
+        del _coaching_insights_cache[key]
+
+def grab_coaching_insights(organization_id, insight_id=None):
+    """
+    Retrieves the coaching insights document for the specified organization from the 'Insights' collection.
 
     Parameters:
     - organization_id: The ID of the organization to retrieve insights for.
+    - insight_id: Optional ID of a specific coaching insights document to use.
 
     Returns:
-    A list of insights documents of type 'coaching' if found, an empty list otherwise.
+    The insights document of type 'coaching' if found, None otherwise.
     """
+    cache_key = (organization_id, insight_id or None)
+    cached = _coaching_insights_cache.get(cache_key)
+    if cached and cached[0] > time.monotonic():
+        print("Using cached coaching insight.")
+        return cached[1]
+
     try:
-        # Fetch all insights for the given organization
-        insights_query = db.collection('Insights').where('organization_id', '==', organization_id).stream()
-        
-        coaching_insights = []
-        for insight_doc in insights_query:
-            insight_data = insight_doc.to_dict()
-            # Check if the insight type is 'coaching'
-            if insight_data.get('type') == 'coaching':
-                coaching_insights.append(insight_data)
-                print("Found coaching insight:", insight_data)
-        
-        if coaching_insights:
-            print("Successfully fetched coaching insights.")
-            return coaching_insights
+        if insight_id:
+            insight_doc = db.collection('Insights').document(insight_id).get()
+            insight_data = insight_doc.to_dict() if insight_doc.exists else None
+            if insight_data and (insight_data.get('type') != 'coaching' or insight_data.get('organization_id') != organization_id):
+                print(f"Insight {insight_id} is not a coaching insight for organization {organization_id}.")
+                insight_data = None
         else:
-            print("No coaching insights found for the given organization.")
-            return []
+            # Filter on both fields server-side and read a single document
+            insights_query = (db.collection('Insights')
+                              .where('organization_id', '==', organization_id)
+                              .where('type', '==', 'coaching')
+                              .limit(1))
+            insight_data = next((doc.to_dict() for doc in insights_query.stream()), None)
     except Exception as e:
         print(f"Error fetching coaching insights: {e}")
-        return []
+        return None
 
+    if insight_data is None:
+        print("No coaching insights found for the given organization.")
+        return None
 
-def call_insights(client, system_prompt, transcript):
+    print("Successfully fetched coaching insight.")
+    _coaching_insights_cache[cache_key] = (time.monotonic() + INSIGHTS_CACHE_TTL_SECONDS, insight_data)
+    return insight_data
+
+
+def build_insights_messages(system_prompt, transcript):
     """
-    Performs detailed analysis of a call transcript using OpenAI, expecting a JSON-structured output with specific requirements.
+    Builds the chat messages for analyzing a coaching call transcript, shared by the realtime and batch paths.
     """
 
     # Prepare the JSON example with placeholders for outcomes and questions
@@ -85,15 +124,21 @@ def call_insights(client, system_prompt, transcript):
     crafted_system_prompt += "\nPlease structure the response as a JSON object with answers to the questions, and a summary of the call with all the details surrounding the metrics. "
     crafted_system_prompt += "Include all questions even if the answer is none or n/a."
     crafted_system_prompt += "The response should strictly follow the example's structure and include nothing beyond it."
-    
+
+    return [
+        {"role": "system", "content": crafted_system_prompt},
+        {"role": "user", "content": transcript}
+    ]
+
+def call_insights(client, system_prompt, transcript):
+    """
+    Performs detailed analysis of a call transcript using OpenAI, expecting a JSON-structured output with specific requirements.
+    """
     try:
         print("Sending request to OpenAI for call analysis...")
         response = client.chat.completions.create(
             model="gpt-3.5-turbo-0125",
-            messages=[
-                {"role": "system", "content": crafted_system_prompt},
-                {"role": "user", "content": transcript}
-            ]
+            messages=build_insights_messages(system_prompt, transcript)
         )
         print("Response received from OpenAI successfully.")
         
@@ -146,26 +191,33 @@ def process_call_data(request):
 
     ###GRAB INSIGHTS FOR TEAM COACHING
 
-    insights_instructions = grab_coaching_insights(organization_id)
+    insights_instructions = grab_coaching_insights(organization_id, request_data['variables'].get("insights_id"))
     print(f"Insight Doc: {insights_instructions}")
     if insights_instructions is None:
         return jsonify({"success": False, "message": "Failed to fetch system prompt."})
 
-    # Perform call analysis
-    insights_response = call_insights(openai_client, insights_instructions[0], concatenated_transcript)
-    print(f"Call notes: {insights_response}")
+    if ANALYSIS_MODE == "batch":
+        # Defer the analysis; poll_coaching_batches writes call_analysis once the batch completes
+        insights_data = {}
+        analysis_status = "queued"
+    else:
+        # Perform call analysis
+        insights_response = call_insights(openai_client, insights_instructions, concatenated_transcript)
+        print(f"Call notes: {insights_response}")
 
-    try:
-        insights_data = json.loads(insights_response.get("insights", "{}"))
-        print("Successfully parsed analysis response into a dictionary.")
-    except json.JSONDecodeError as e:
-        print(f"Error parsing analysis response into a dictionary: {e}")
-        return jsonify({"success": False, "message": "Failed to parse analysis response."})
+        try:
+            insights_data = json.loads(insights_response.get("insights", "{}"))
+            print("Successfully parsed analysis response into a dictionary.")
+        except json.JSONDecodeError as e:
+            print(f"Error parsing analysis response into a dictionary: {e}")
+            return jsonify({"success": False, "message": "Failed to parse analysis response."})
+        analysis_status = "completed"
 
     # Store the analysis result in the callsAnswered collection
     try:
         doc_ref = db.collection('Calls').document(call_id)
-        doc_ref.set({
+        # The transcript goes to blob storage like call_processor's, per CALL_STORAGE_MODE
+        doc_ref.set(externalize_call_fields(call_id, {
             "call_length": call_length,
             "callTimestamp": callTimestamp,
             "to_number": to_number,
@@ -191,11 +243,36 @@ def process_call_data(request):
             "end_at": end_at,
             "call_cost": call_cost,
             "call_analysis": insights_data,  # Assuming call_notes is a structured string or a dictionary
+            "analysis_status": analysis_status,
             "processed_at": firestore.SERVER_TIMESTAMP  # This adds a timestamp of when the document was created/updated
-        })
+        }))
         print("Successfully stored call analysis in Calls collection.")
 
+        if analysis_status == "queued":
+            queue_coaching_analysis(db, call_id, build_insights_messages(insights_instructions, concatenated_transcript))
+            return jsonify({"success": True, "message": "Call data stored. Analysis queued for batch processing."})
+
         return jsonify({"success": True, "message": "Call data processed and stored successfully."})
     except Exception as e:
         print(f"Error storing call analysis: {e}")
         return jsonify({"success": False, "message": "Failed to store call analysis."})
+
+@functions_framework.http
+def submit_coaching_batch(request):
+    """Submits queued coaching transcripts to the Batch API. Intended to be triggered by Cloud Scheduler."""
+    try:
+        batch_id = submit_queued_analyses(db, batch_client)
+        return jsonify({"success": True, "batch_id": batch_id})
+    except Exception as e:
+        print(f"Error submitting coaching batch: {e}")
+        return jsonify({"success": False, "message": "Failed to submit coaching batch."}), 500
+
+@functions_framework.http
+def poll_coaching_batches(request):
+    """Writes results of finished coaching batches back into the Calls collection. Intended to be triggered by Cloud Scheduler."""
+    try:
+        summary = poll_submitted_batches(db, batch_client)
+        return jsonify({"success": True, **summary})
+    except Exception as e:
+        print(f"Error polling coaching batches: {e}")
+        return jsonify({"success": False, "message": "Failed to poll coaching batches."}), 500
@@ -0,0 +1,75 @@
+# flow_history.py
+
+import hashlib
+import json
+import os
+from google.cloud import firestore
+
+# finishedFlows entries kept on the contact; older ones move to Contacts/{id}/flow_history
+FINISHED_FLOWS_KEEP = int(os.environ.get('FINISHED_FLOWS_KEEP', 20))
+HISTORY_SUBCOLLECTION = 'flow_history'
+# Leaves room in a 500-write batch for the contact update itself
+MAX_ARCHIVE_PER_WRITE = 400
+
+
+def history_entry_id(flow):
+    """Content-derived ID, so archiving the same entry twice (retries, re-runs) writes one document."""
+    encoded = json.dumps(flow, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha1(encoded).hexdigest()
+
+
+def split_finished_flows(finished_flows, keep=FINISHED_FLOWS_KEEP, max_archive=MAX_ARCHIVE_PER_WRITE):
+    """
+    Returns (kept, archived). The newest `keep` entries stay; at most max_archive of the oldest are
+    archived per write, anything beyond that stays until the next write or the compaction job.
+    """
+    overflow = len(finished_flows) - max(keep, 0)
+    if overflow <= 0:
+        return finished_flows, []
+    archive_count = min(overflow, max_archive)
+    return finished_flows[archive_count:], finished_flows[:archive_count]
+
+
+def compact_update(update_data, keep=FINISHED_FLOWS_KEEP):
+    """
+    Applies the retention policy to a contact update.
+
+    Returns:
+        (update_data, archived) where update_data carries the trimmed finishedFlows and an increment of
+        finishedFlowsArchived, and archived is the list of entries to write to flow_history.
+    """
+    finished_flows = update_data.get('finishedFlows')
+    if not isinstance(finished_flows, list):
+        return update_data, []
+    kept, archived = split_finished_flows(finished_flows, keep)
+    if not archived:
+        return update_data, []
+    return {**update_data, 'finishedFlows': kept, 'finishedFlowsArchived': firestore.Increment(len(archived))}, archived
+
+
+def history_writes(contact_ref, archived):
+    """(document reference, data) pairs that archive entries under the contact."""
+    history = contact_ref.collection(HISTORY_SUBCOLLECTION)
+    return [
+        (history.document(history_entry_id(flow)), {**flow, 'archived_at': firestore.SERVER_TIMESTAMP})
+        for flow in archived
+    ]
+
+
+def update_contact_with_history(db, contact_ref, update_data, option=None):
+    """
+    Writes a contact update with the finishedFlows retention policy applied. The trimmed update and
+    the archived entries are committed in one batch, so entries are never dropped without being
+    archived. Returns the number of entries archived.
+    """
+    update_data, archived = compact_update(update_data)
+    if not archived:
+        contact_ref.update(update_data, option=option)
+        return 0
+
+    batch = db.batch()
+    batch.update(contact_ref, update_data, option=option)
+    for history_ref, data in history_writes(contact_ref, archived):
+        batch.set(history_ref, data)
+    batch.commit()
+    return len(archived)
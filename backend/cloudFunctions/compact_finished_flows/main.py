@@ -0,0 +1,142 @@
+import firebase_admin
+from firebase_admin import credentials, firestore
+import json
+import os
+import time
+import functions_framework
+from flow_history import FINISHED_FLOWS_KEEP, compact_update, history_writes
+
+# Initialize the Firebase Admin SDK if not already initialized
+if not firebase_admin._apps:
+    try:
+        firebase_admin.get_app()
+    except ValueError:
+        cred = credentials.ApplicationDefault()
+        firebase_admin.initialize_app(cred)
+
+# Firestore client
+db = firestore.client()
+
+PAGE_SIZE = int(os.environ.get('COMPACTION_PAGE_SIZE', 300))
+# Stop before the function timeout and hand back a cursor to resume from
+TIME_BUDGET_SECONDS = int(os.environ.get('COMPACTION_TIME_BUDGET_SECONDS', 480))
+# Firestore's document limit is 1 MiB; contacts above this share of it are reported
+LARGE_DOCUMENT_BYTES = int(os.environ.get('COMPACTION_LARGE_DOCUMENT_BYTES', 256 * 1024))
+
+
+def estimate_document_bytes(data):
+    """Rough stored size of a document (JSON length), good enough to rank contacts and spot outliers."""
+    return len(json.dumps(data, default=str).encode('utf-8'))
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def compact_contacts(start_after=None, dry_run=False, keep=FINISHED_FLOWS_KEEP):
+    """
+    Walks Contacts in document-ID order, applying the finishedFlows retention policy to each contact
+    over the limit and collecting size statistics.
+
+    Each compacted contact is written in its own batch: the trimmed finishedFlows (conditioned on the
+    snapshot that was read) plus its archived entries. Contacts updated concurrently are skipped and
+    picked up by the inline policy on their next write or by the next run.
+
+    Returns:
+        dict with statistics and next_cursor (None once the whole collection has been scanned).
+    """
+    deadline = time.monotonic() + TIME_BUDGET_SECONDS
+    finished_counts = []
+    document_sizes = []
+    largest = []
+    compacted = archived_total = skipped = 0
+    cursor = start_after
+    contacts = db.collection('Contacts')
+
+    while time.monotonic() < deadline:
+        query = contacts.order_by('__name__').limit(PAGE_SIZE)
+        if cursor:
+            # A document reference, not a snapshot: the cursor contact may have been deleted since
+            query = query.start_after({'__name__': contacts.document(cursor)})
+        page = list(query.stream())
+        if not page:
+            cursor = None
+            break
+
+        for snapshot in page:
+            data = snapshot.to_dict() or {}
+            finished_flows = data.get('finishedFlows') or []
+            size = estimate_document_bytes(data)
+            finished_counts.append(len(finished_flows))
+            document_sizes.append(size)
+            if size >= LARGE_DOCUMENT_BYTES:
+                largest.append({'contact_id': snapshot.id, 'bytes': size, 'finished_flows': len(finished_flows)})
+
+            if len(finished_flows) <= keep or dry_run:
+                continue
+
+            update_data, archived = compact_update({'finishedFlows': finished_flows}, keep)
+            batch = db.batch()
+            batch.update(snapshot.reference, update_data, option=db.write_option(last_update_time=snapshot.update_time))
+            for history_ref, history_data in history_writes(snapshot.reference, archived):
+                batch.set(history_ref, history_data)
+            try:
+                batch.commit()
+            except Exception as e:
+                print(f"Skipping contact {snapshot.id}: {str(e)}")
+                skipped += 1
+                continue
+            compacted += 1
+            archived_total += len(archived)
+
+        cursor = page[-1].id
+        if len(page) < PAGE_SIZE:
+            cursor = None
+            break
+
+    finished_counts.sort()
+    document_sizes.sort()
+    over_limit = sum(1 for count in finished_counts if count > keep)
+    return {
+        'contacts_scanned': len(finished_counts),
+        'contacts_over_limit': over_limit,
+        'contacts_compacted': compacted,
+        'contacts_skipped': skipped,
+        'entries_archived': archived_total,
+        'finished_flows': {
+            'total': sum(finished_counts),
+            'p50': percentile(finished_counts, 0.5),
+            'p95': percentile(finished_counts, 0.95),
+            'max': finished_counts[-1] if finished_counts else 0
+        },
+        'document_bytes': {
+            'p50': percentile(document_sizes, 0.5),
+            'p95': percentile(document_sizes, 0.95),
+            'max': document_sizes[-1] if document_sizes else 0
+        },
+        'largest_contacts': sorted(largest, key=lambda item: item['bytes'], reverse=True)[:20],
+        'keep': keep,
+        'dry_run': dry_run,
+        'next_cursor': cursor
+    }
+
+
+@functions_framework.http
+def compact_finished_flows(request):
+    """
+    Cloud Function entry point (Cloud Scheduler or manual). Accepts optional {"start_after", "dry_run",
+    "keep"}; call again with the returned next_cursor until it is null.
+    """
+    try:
+        request_json = request.get_json(silent=True) or {}
+        result = compact_contacts(
+            start_after=request_json.get('start_after'),
+            dry_run=bool(request_json.get('dry_run', False)),
+            keep=int(request_json.get('keep', FINISHED_FLOWS_KEEP))
+        )
+        print(f"Compaction result: {json.dumps({k: v for k, v in result.items() if k != 'largest_contacts'})}")
+        return json.dumps(result), 200, {'Content-Type': 'application/json'}
+    except Exception as e:
+        return json.dumps({'error': str(e)}), 500, {'Content-Type': 'application/json'}
@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+pytest.importorskip('google.cloud.firestore')
+
+from google.cloud import firestore
+
+from flow_history import MAX_ARCHIVE_PER_WRITE, compact_update, history_entry_id, split_finished_flows
+
+FUNCTIONS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Functions that carry their own copy of flow_history.py
+COPIES = ('callTrigger', 'call_builder', 'call_processor', 'compact_finished_flows')
+
+
+def flows(count):
+    return [{'flow_id': f"f{index}", 'finished_at': index} for index in range(count)]
+
+
+def test_under_the_limit_is_untouched():
+    finished = flows(5)
+    assert split_finished_flows(finished, keep=5) == (finished, [])
+    assert split_finished_flows([], keep=5) == ([], [])
+
+
+def test_oldest_entries_are_archived():
+    finished = flows(8)
+    kept, archived = split_finished_flows(finished, keep=5)
+    assert kept == finished[3:]
+    assert archived == finished[:3]
+
+
+def test_archive_is_capped_per_write():
+    finished = flows(MAX_ARCHIVE_PER_WRITE + 50)
+    kept, archived = split_finished_flows(finished, keep=10)
+    assert archived == finished[:MAX_ARCHIVE_PER_WRITE]
+    # The rest waits for the next write or the compaction job
+    assert kept == finished[MAX_ARCHIVE_PER_WRITE:]
+    kept, archived = split_finished_flows(kept, keep=10)
+    assert len(kept) == 10 and len(archived) == 40
+
+
+def test_keep_zero_archives_everything():
+    finished = flows(3)
+    assert split_finished_flows(finished, keep=0) == ([], finished)
+    assert split_finished_flows(finished, keep=-1) == ([], finished)
+
+
+def test_compact_update_leaves_updates_under_the_limit_unchanged():
+    update_data = {'finishedFlows': flows(4), 'activeFlows': []}
+    compacted, archived = compact_update(update_data, keep=4)
+    assert compacted is update_data
+    assert archived == []
+    # Updates that do not set finishedFlows at all are passed through
+    update_data = {'activeFlows': []}
+    assert compact_update(update_data, keep=0) == (update_data, [])
+
+
+def test_compact_update_trims_and_counts_archived_entries():
+    update_data = {'finishedFlows': flows(7), 'activeFlows': [{'flow_id': 'a'}]}
+    compacted, archived = compact_update(update_data, keep=4)
+    assert archived == flows(7)[:3]
+    assert compacted['finishedFlows'] == flows(7)[3:]
+    assert compacted['activeFlows'] == [{'flow_id': 'a'}]
+    increment = compacted['finishedFlowsArchived']
+    assert isinstance(increment, firestore.Increment)
+    assert increment.value == 3
+    # The caller's update is not modified
+    assert len(update_data['finishedFlows']) == 7 and 'finishedFlowsArchived' not in update_data
+
+
+def test_history_entry_id_is_content_derived():
+    assert history_entry_id({'a': 1, 'b': 2}) == history_entry_id({'b': 2, 'a': 1})
+    assert history_entry_id({'a': 1}) != history_entry_id({'a': 2})
+
+
+def test_copies_are_identical():
+    contents = set()
+    for function in COPIES:
+        with open(os.path.join(FUNCTIONS_DIR, function, 'flow_history.py')) as source:
+            contents.add(source.read())
+    assert len(contents) == 1
@@ -1,13 +1,30 @@
 import hashlib
 import logging
+import os
+import time
 from flask import jsonify, request
 from google.cloud import firestore
+from google.api_core import exceptions
 import functions_framework
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Firestore client, reused across requests on a warm instance
+db = firestore.Client()
+
+# Length of the dedup window in seconds. 0 means identical requests are deduplicated forever;
+# otherwise the same request is accepted again once it falls into a new window.
+DEDUP_WINDOW_SECONDS = int(os.environ.get('DEDUP_WINDOW_SECONDS', 0))
+
+def transfer_document_id(request_hash, window_seconds=DEDUP_WINDOW_SECONDS, now=None):
+    """Returns the LiveTransfers document ID for a request hash, bucketed by time when a window is set."""
+    if not window_seconds:
+        return request_hash
+    now = time.time() if now is None else now
+    return f"{request_hash}_{int(now // window_seconds)}"
+
 @functions_framework.http
 def create_live_transfer(request):
     logger.info(f"Received request: Method={request.method}, Content-Type={request.content_type}")
@@ -42,15 +59,6 @@ def create_live_transfer(request):
         unique_string = f"{data['from']}_{data['to']}_{data['transfer_number']}_{data.get('reason_say', '')}"
         request_hash = hashlib.md5(unique_string.encode()).hexdigest()
 
-        # Initialize Firestore client
-        db = firestore.Client()
-
-        # Check if a document with this hash already exists
-        docs = db.collection('LiveTransfers').where('request_hash', '==', request_hash).get()
-        if docs:
-            logger.info(f"Duplicate request detected with hash: {request_hash}")
-            return jsonify({'message': 'Duplicate request detected. No new document created.'}), 200
-
         # Prepare the document data
         doc_data = {
             'from': data['from'],
@@ -65,19 +73,25 @@ def create_live_transfer(request):
             'request_hash': request_hash  # Store the unique hash
         }
 
-        # Add the document to the LiveTransfers collection
-        doc_ref = db.collection('LiveTransfers').add(doc_data)
-        logger.info(f"Document created successfully with ID: {doc_ref[1].id}")
+        # Key the document by the request hash so a duplicate is rejected by the create itself
+        doc_ref = db.collection('LiveTransfers').document(transfer_document_id(request_hash))
+        try:
+            doc_ref.create(doc_data)
+        except exceptions.AlreadyExists:
+            logger.info(f"Duplicate request detected with hash: {request_hash}")
+            return jsonify({'message': 'Duplicate request detected. No new document created.'}), 200
+
+        logger.info(f"Document created successfully with ID: {doc_ref.id}")
 
         return jsonify({
             'message': 'Document created successfully',
-            'document_id': doc_ref[1].id
+            'document_id': doc_ref.id
         }), 201
 
     except ValueError as ve:
         logger.error(f"ValueError: {str(ve)}")
         return jsonify({'error': 'Invalid JSON in request body'}), 400
-    except firestore.exceptions.FirebaseError as fe:
+    except exceptions.GoogleAPICallError as fe:
         logger.error(f"Firestore error: {str(fe)}")
         return jsonify({'error': 'Database operation failed'}), 500
     except Exception as e:
@@ -0,0 +1,63 @@
+"""
+Benchmark for next_eligible_times: a per-contact pytz loop (what calculate_next_morning did once per
+request) against the vectorized batch, plus the one-off cost of building a zone's offset table from
+pytz's transition table and from the sampled fallback.
+
+    python bench_scheduling_windows.py [--contacts 20000]
+"""
+import argparse
+import datetime
+import random
+import time
+import pytz
+import scheduling_windows
+from scheduling_windows import ALL_WEEKDAYS, next_eligible_times
+
+ZONES = ['US/Eastern', 'US/Central', 'US/Mountain', 'US/Pacific', 'America/Phoenix', 'US/Alaska', 'Pacific/Honolulu', 'Europe/London']
+MORNING_SECONDS = 9 * 3600
+
+
+def per_contact_next_morning(current_seconds, timezone_str):
+    tz = pytz.timezone(timezone_str)
+    current = datetime.datetime.fromtimestamp(current_seconds, tz)
+    morning = tz.localize(datetime.datetime.combine(current.date(), datetime.time(9)))
+    if morning <= current:
+        morning = tz.localize(datetime.datetime.combine(current.date() + datetime.timedelta(days=1), datetime.time(9)))
+    return int(morning.timestamp())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--contacts', type=int, default=20000)
+    args = parser.parse_args()
+    rng = random.Random(0)
+    zones = rng.choices(ZONES, k=args.contacts)
+    # Spread over a year so the batch crosses both DST changes
+    base = int(datetime.datetime(2026, 1, 1, tzinfo=pytz.UTC).timestamp())
+    current = [base + rng.randrange(0, 365 * 86400) for _ in range(args.contacts)]
+
+    started = time.perf_counter()
+    for seconds, zone in zip(current, zones):
+        per_contact_next_morning(seconds, zone)
+    loop_ms = (time.perf_counter() - started) * 1000.0
+
+    next_eligible_times(current[:1], zones[:1], [MORNING_SECONDS], [MORNING_SECONDS + 1], [ALL_WEEKDAYS], at_window_start=True)
+    started = time.perf_counter()
+    next_eligible_times(
+        current, zones, [MORNING_SECONDS] * args.contacts, [MORNING_SECONDS + 1] * args.contacts,
+        [ALL_WEEKDAYS] * args.contacts, at_window_start=True
+    )
+    batch_ms = (time.perf_counter() - started) * 1000.0
+
+    tz = pytz.timezone('US/Eastern')
+    started = time.perf_counter()
+    scheduling_windows._transition_table(tz)
+    table_ms = (time.perf_counter() - started) * 1000.0
+    started = time.perf_counter()
+    scheduling_windows._sampled_table(tz)
+    sampled_ms = (time.perf_counter() - started) * 1000.0
+
+    print(f"per-contact pytz:       {loop_ms:8.2f} ms for {args.contacts} contacts")
+    print(f"next_eligible_times:    {batch_ms:8.2f} ms for {args.contacts} contacts")
+    print(f"offset table (pytz):    {table_ms:8.2f} ms per zone, once per instance")
+    print(f"offset table (sampled): {sampled_ms:8.2f} ms per zone, once per instance")
@@ -1,21 +1,74 @@
 import datetime
 import pytz
 import json
+import os
+import numpy as np
+from scheduling_windows import ALL_WEEKDAYS, next_eligible_times, parse_rules, parse_timestamp, format_timestamp
+
+MORNING_SECONDS = 9 * 3600
+MAX_BATCH_CONTACTS = int(os.environ.get('MAX_BATCH_CONTACTS', 20000))
 
 def calculate_next_morning(request):
     request_json = request.get_json()
     current_time_str = request_json['current_time']
     timezone_str = request_json['timezone']
-    
-    timezone = pytz.timezone(timezone_str)
-    current_time = datetime.datetime.strptime(current_time_str, "%Y-%m-%dT%H:%M:%S.%fZ")
-    current_time = current_time.astimezone(timezone)
-    
-    # Calculate the next 9 AM
-    next_morning = (current_time + datetime.timedelta(days=1)).replace(hour=9, minute=0, second=0, microsecond=0)
-    if current_time.hour >= 9:
-        next_morning = next_morning + datetime.timedelta(days=1)
-    
-    time_difference = (next_morning - current_time).total_seconds()
-    
-    return json.dumps({'next_morning_seconds': int(time_difference)})
\ No newline at end of file
+
+    pytz.timezone(timezone_str)  # Unknown timezones fail here, before any arithmetic
+    current_time = datetime.datetime.strptime(current_time_str, "%Y-%m-%dT%H:%M:%S.%fZ").replace(tzinfo=pytz.UTC)
+    current_seconds = int(current_time.timestamp())
+
+    # Calculate the next 9 AM: today's if it is still ahead, otherwise tomorrow's
+    next_morning = next_eligible_times(
+        [current_seconds], [timezone_str], [MORNING_SECONDS], [MORNING_SECONDS + 1], [ALL_WEEKDAYS], at_window_start=True
+    )[0]
+
+    time_difference = int(next_morning) - current_seconds
+
+    return json.dumps({'next_morning_seconds': int(time_difference)})
+
+def calculate_next_windows(request):
+    """
+    Batch form of calculate_next_morning.
+
+    Expects {"contacts": [{"id", "current_time", "timezone", "rules"?}], "rules"?: {...}} where rules
+    are window_start/window_end or quiet_hours plus weekdays (see scheduling_windows.parse_rules);
+    per-contact rules override the request's. Returns the next eligible time for every contact.
+    """
+    request_json = request.get_json(silent=True) or {}
+    contacts = request_json.get('contacts') or []
+    if not isinstance(contacts, list) or not contacts:
+        return json.dumps({'error': 'contacts must be a non-empty list'}), 400, {'Content-Type': 'application/json'}
+    if len(contacts) > MAX_BATCH_CONTACTS:
+        return json.dumps({'error': f'Too many contacts: {len(contacts)} (max {MAX_BATCH_CONTACTS})'}), 400, {'Content-Type': 'application/json'}
+
+    default_rules = request_json.get('rules') or {}
+    parsed_rules = {}
+    current_seconds, timezones, window_starts, window_ends, weekday_masks = [], [], [], [], []
+    try:
+        for index, contact in enumerate(contacts):
+            rules = {**default_rules, **(contact.get('rules') or {})}
+            # Most contacts share their rules, so each distinct rule set is parsed once
+            rules_key = json.dumps(rules, sort_keys=True)
+            if rules_key not in parsed_rules:
+                parsed_rules[rules_key] = parse_rules(rules)
+            window_start, window_end, weekday_mask = parsed_rules[rules_key]
+
+            timezone_str = contact.get('timezone') or 'UTC'
+            pytz.timezone(timezone_str)
+            current_seconds.append(parse_timestamp(contact['current_time']))
+            timezones.append(timezone_str)
+            window_starts.append(window_start)
+            window_ends.append(window_end)
+            weekday_masks.append(weekday_mask)
+    except (KeyError, ValueError, TypeError, AttributeError, pytz.UnknownTimeZoneError) as e:
+        return json.dumps({'error': f'Invalid contact at index {index}: {str(e)}'}), 400, {'Content-Type': 'application/json'}
+
+    current_seconds = np.array(current_seconds, dtype=np.int64)
+    next_times = next_eligible_times(current_seconds, timezones, window_starts, window_ends, weekday_masks)
+    seconds_until = next_times - current_seconds
+
+    results = [
+        {'id': contact.get('id'), 'next_time': format_timestamp(next_time), 'seconds_until': int(wait)}
+        for contact, next_time, wait in zip(contacts, next_times, seconds_until)
+    ]
+    return json.dumps({'results': results}), 200, {'Content-Type': 'application/json'}
@@ -0,0 +1,235 @@
+import datetime
+import functools
+import numpy as np
+import pytz
+
+SECONDS_PER_DAY = 86400
+ALL_WEEKDAYS = 0b1111111  # Monday is bit 0
+# 1970-01-01 was a Thursday
+EPOCH_WEEKDAY = 3
+
+DEFAULT_RULES = {'window_start': '09:00', 'window_end': '20:00', 'weekdays': [0, 1, 2, 3, 4, 5, 6]}
+
+# Range scanned for offset changes when a timezone's pytz transition table cannot be used
+SAMPLED_RANGE = (datetime.datetime(1970, 1, 1, tzinfo=pytz.UTC), datetime.datetime(2100, 1, 1, tzinfo=pytz.UTC))
+SAMPLE_STEP_SECONDS = SECONDS_PER_DAY
+
+
+def _seconds_of_day(value):
+    hours, minutes = (int(part) for part in value.split(':'))
+    if not (0 <= hours <= 24 and 0 <= minutes < 60) or hours * 3600 + minutes * 60 > SECONDS_PER_DAY:
+        raise ValueError(f"Invalid time of day: {value}")
+    return hours * 3600 + minutes * 60
+
+
+def parse_rules(rules):
+    """
+    Normalizes window rules to (window_start_seconds, window_end_seconds, weekday_mask).
+
+    Rules are {'window_start': 'HH:MM', 'window_end': 'HH:MM', 'weekdays': [0-6, Monday=0]}, or
+    {'quiet_hours': {'start': 'HH:MM', 'end': 'HH:MM'}, 'weekdays': [...]} where the quiet hours
+    must wrap the night (e.g. 21:00-08:00), leaving a single daytime window.
+
+    Raises:
+        ValueError: If the rules do not describe a single non-empty window.
+    """
+    rules = {**DEFAULT_RULES, **(rules or {})}
+    quiet_hours = rules.get('quiet_hours')
+    if quiet_hours:
+        quiet_start = _seconds_of_day(quiet_hours['start'])
+        quiet_end = _seconds_of_day(quiet_hours['end'])
+        if quiet_start > quiet_end:
+            start, end = quiet_end, quiet_start
+        elif quiet_start == 0:
+            start, end = quiet_end, SECONDS_PER_DAY
+        else:
+            raise ValueError("Quiet hours must cover midnight or start at 00:00")
+    else:
+        start = _seconds_of_day(rules['window_start'])
+        end = _seconds_of_day(rules['window_end'])
+    if start >= end:
+        raise ValueError("Window start must be before window end")
+
+    weekday_mask = 0
+    for weekday in rules.get('weekdays') or []:
+        if not 0 <= int(weekday) <= 6:
+            raise ValueError(f"Invalid weekday: {weekday}")
+        weekday_mask |= 1 << int(weekday)
+    if not weekday_mask:
+        raise ValueError("At least one weekday is required")
+    return start, end, weekday_mask
+
+
+def _transition_table(tz):
+    """
+    Reads pytz's transition table directly. These are private attributes of pytz's DstTzInfo, so
+    anything unexpected raises and _offset_table falls back to _sampled_table.
+    """
+    if not hasattr(tz, '_utc_transition_times'):
+        offset = tz.utcoffset(datetime.datetime(2000, 1, 1))
+        return [np.iinfo(np.int64).min], [int(offset.total_seconds())]
+
+    transitions = tz._utc_transition_times
+    infos = tz._transition_info
+    if not transitions or len(transitions) != len(infos):
+        raise ValueError(f"Unexpected transition table for {tz.zone}")
+    epoch = datetime.datetime(1970, 1, 1)
+    starts = [np.iinfo(np.int64).min] + [int((moment - epoch).total_seconds()) for moment in transitions[1:]]
+    if any(later <= earlier for earlier, later in zip(starts, starts[1:])):
+        raise ValueError(f"Unordered transition table for {tz.zone}")
+    offsets = [int(info[0].total_seconds()) for info in infos]
+    return starts, offsets
+
+
+def _offset_at(tz, utc_seconds):
+    return int(datetime.datetime.fromtimestamp(utc_seconds, tz).utcoffset().total_seconds())
+
+
+def _sampled_table(tz):
+    """
+    Same table built through pytz's public API: offsets are sampled every SAMPLE_STEP_SECONDS over
+    SAMPLED_RANGE and each change is bisected to the exact second. Slower, but only built once per zone.
+    """
+    low, high = (int(moment.timestamp()) for moment in SAMPLED_RANGE)
+    starts = [np.iinfo(np.int64).min]
+    offsets = [_offset_at(tz, low)]
+    previous = low
+    for sample in range(low + SAMPLE_STEP_SECONDS, high + 1, SAMPLE_STEP_SECONDS):
+        offset = _offset_at(tz, sample)
+        if offset != offsets[-1]:
+            before, after = previous, sample
+            while after - before > 1:
+                middle = (before + after) // 2
+                if _offset_at(tz, middle) == offsets[-1]:
+                    before = middle
+                else:
+                    after = middle
+            starts.append(after)
+            offsets.append(offset)
+        previous = sample
+    return starts, offsets
+
+
+@functools.lru_cache(maxsize=512)
+def _offset_table(timezone_str):
+    """
+    UTC transition instants (epoch seconds) and the UTC offset in force from each, so offsets for
+    a whole array of instants are one searchsorted instead of a pytz call per element.
+    """
+    tz = pytz.timezone(timezone_str)
+    try:
+        starts, offsets = _transition_table(tz)
+    except (AttributeError, IndexError, TypeError, ValueError) as e:
+        print(f"Falling back to sampled UTC offsets for {timezone_str}: {str(e)}")
+        starts, offsets = _sampled_table(tz)
+    return np.array(starts, dtype=np.int64), np.array(offsets, dtype=np.int64)
+
+
+def _utc_offsets(timezone_str, utc_seconds):
+    starts, offsets = _offset_table(timezone_str)
+    return offsets[np.searchsorted(starts, utc_seconds, side='right') - 1]
+
+
+def _local_to_utc(timezone_str, local_seconds):
+    """
+    First instant the local clock reads local_seconds: the earlier of the two for a wall time repeated
+    by a backward change, and the change itself for one skipped by a forward change.
+    """
+    starts, offsets = _offset_table(timezone_str)
+    limits = np.append(starts[1:], np.iinfo(np.int64).max)
+    # Offset periods are months long, so the answer lies in the period of this estimate or a neighbour
+    estimate = np.searchsorted(starts, local_seconds - _utc_offsets(timezone_str, local_seconds), side='right') - 1
+
+    result = np.full(local_seconds.shape, np.iinfo(np.int64).max, dtype=np.int64)
+    skipped_to = np.full(local_seconds.shape, np.iinfo(np.int64).max, dtype=np.int64)
+    for shift in (-1, 0, 1):
+        period = np.clip(estimate + shift, 0, len(starts) - 1)
+        utc = local_seconds - offsets[period]
+        in_period = (utc >= starts[period]) & (utc < limits[period])
+        result = np.where(in_period, np.minimum(result, utc), result)
+        # Reading the wall time with this period's offset lands before the period began: the change
+        # into it skipped the wall time
+        skipped_to = np.where(utc < starts[period], np.minimum(skipped_to, starts[period]), skipped_to)
+    return np.where(result == np.iinfo(np.int64).max, skipped_to, result)
+
+
+def _next_in_zone(timezone_str, utc_seconds, window_start, window_end, weekday_mask, at_window_start):
+    local = utc_seconds + _utc_offsets(timezone_str, utc_seconds)
+    local_day = np.floor_divide(local, SECONDS_PER_DAY)
+    second_of_day = local - local_day * SECONDS_PER_DAY
+
+    result = np.full(utc_seconds.shape, -1, dtype=np.int64)
+    pending = np.ones(utc_seconds.shape, dtype=bool)
+
+    # Today, then each following day; a week plus one day always reaches an allowed weekday
+    for days_ahead in range(8):
+        day = local_day + days_ahead
+        weekday_allowed = (weekday_mask >> ((day + EPOCH_WEEKDAY) % 7)) & 1 == 1
+        candidate = pending & weekday_allowed
+        if days_ahead == 0:
+            if at_window_start:
+                candidate &= second_of_day < window_start
+            else:
+                inside = candidate & (second_of_day >= window_start) & (second_of_day < window_end)
+                result[inside] = utc_seconds[inside]
+                pending &= ~inside
+                candidate &= second_of_day < window_start
+        if candidate.any():
+            local_start = day[candidate] * SECONDS_PER_DAY + window_start[candidate]
+            opening = _local_to_utc(timezone_str, local_start)
+            if days_ahead == 0:
+                # Past the first of a repeated wall time, today's window opens at its second occurrence
+                now = utc_seconds[candidate]
+                passed = opening < now
+                opening[passed] = local_start[passed] - _utc_offsets(timezone_str, now[passed])
+            result[candidate] = opening
+            pending &= ~candidate
+        if not pending.any():
+            break
+
+    return result
+
+
+def next_eligible_times(utc_seconds, timezones, window_starts, window_ends, weekday_masks, at_window_start=False):
+    """
+    Next instant each contact may be called, for many contacts at once.
+
+    Args:
+        utc_seconds: Epoch seconds of each contact's current time.
+        timezones: Timezone name of each contact.
+        window_starts, window_ends: Allowed local window per contact, in seconds of the day.
+        weekday_masks: Allowed local weekdays per contact, Monday as bit 0.
+        at_window_start: Only return window openings, even if a contact is inside its window now.
+
+    Returns:
+        np.ndarray of epoch seconds. Contacts are grouped by timezone so the offset lookups and day
+        arithmetic run once per zone over NumPy arrays.
+    """
+    utc_seconds = np.asarray(utc_seconds, dtype=np.int64)
+    window_starts = np.asarray(window_starts, dtype=np.int64)
+    window_ends = np.asarray(window_ends, dtype=np.int64)
+    weekday_masks = np.asarray(weekday_masks, dtype=np.int64)
+    zone_names, zone_index = np.unique(np.asarray(timezones, dtype=object).astype(str), return_inverse=True)
+
+    result = np.empty(utc_seconds.shape, dtype=np.int64)
+    for index, timezone_str in enumerate(zone_names):
+        members = zone_index == index
+        result[members] = _next_in_zone(
+            timezone_str, utc_seconds[members], window_starts[members], window_ends[members],
+            weekday_masks[members], at_window_start
+        )
+    return result
+
+
+def parse_timestamp(value):
+    """Epoch seconds from an ISO 8601 string ('Z' or offset; naive means UTC) or a number."""
+    if isinstance(value, (int, float)):
+        return int(value)
+    parsed = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=pytz.UTC)
+    return int(parsed.timestamp())
+
+
+def format_timestamp(seconds):
+    return datetime.datetime.fromtimestamp(int(seconds), pytz.UTC).strftime('%Y-%m-%dT%H:%M:%SZ')
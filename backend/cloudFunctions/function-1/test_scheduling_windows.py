@@ -0,0 +1,218 @@
+import datetime
+import random
+
+import numpy as np
+import pytest
+import pytz
+
+import scheduling_windows
+from scheduling_windows import ALL_WEEKDAYS, next_eligible_times, parse_rules, parse_timestamp
+
+
+def reference_next_time(utc_seconds, timezone_str, window_start, window_end, weekday_mask, at_window_start=False):
+    """
+    Minute-by-minute walk with pytz's public API. A day's window opens at the first instant its local
+    wall time reaches window_start, which is the DST change itself when window_start falls in a gap.
+    """
+    tz = pytz.timezone(timezone_str)
+
+    def local(seconds):
+        moment = datetime.datetime.fromtimestamp(seconds, tz)
+        return moment.date(), moment.hour * 3600 + moment.minute * 60 + moment.second
+
+    today, second_of_day = local(utc_seconds)
+    if not at_window_start and weekday_mask >> today.weekday() & 1 and window_start <= second_of_day < window_end:
+        return utc_seconds
+
+    first_minute = -(-utc_seconds // 60) * 60
+    for days_ahead in range(8):
+        day = today + datetime.timedelta(days=days_ahead)
+        if not weekday_mask >> day.weekday() & 1:
+            continue
+        if days_ahead == 0 and second_of_day >= window_start:
+            continue
+        naive_start = datetime.datetime.combine(day, datetime.time()) + datetime.timedelta(seconds=window_start)
+        # No zone is more than 14 hours off UTC, so this is always before the opening
+        seconds = max(first_minute, int(pytz.UTC.localize(naive_start).timestamp()) - 16 * 3600)
+        while True:
+            moment_day, moment_second = local(seconds)
+            if moment_day > day:
+                break
+            if moment_day == day and moment_second >= window_start:
+                return seconds
+            seconds += 60
+    raise AssertionError("No opening within eight days")
+
+
+def utc(*args):
+    return int(datetime.datetime(*args, tzinfo=pytz.UTC).timestamp())
+
+
+def next_time(utc_seconds, timezone_str, window_start, window_end, weekday_mask=ALL_WEEKDAYS, at_window_start=False):
+    return int(next_eligible_times(
+        [utc_seconds], [timezone_str], [window_start], [window_end], [weekday_mask], at_window_start=at_window_start
+    )[0])
+
+
+def hm(hours, minutes=0):
+    return hours * 3600 + minutes * 60
+
+
+# (zone, UTC instant of the change, forward?)
+TRANSITIONS = [
+    ('America/New_York', (2026, 3, 8, 7, 0), True),        # 02:00 EST -> 03:00 EDT
+    ('America/New_York', (2026, 11, 1, 6, 0), False),      # 02:00 EDT -> 01:00 EST
+    ('Europe/Berlin', (2026, 3, 29, 1, 0), True),          # 02:00 CET -> 03:00 CEST
+    ('Europe/Berlin', (2026, 10, 25, 1, 0), False),        # 03:00 CEST -> 02:00 CET
+    ('Australia/Sydney', (2026, 4, 4, 16, 0), False),      # southern hemisphere, 03:00 -> 02:00
+    ('Australia/Sydney', (2026, 10, 3, 16, 0), True),      # 02:00 -> 03:00
+    ('Australia/Lord_Howe', (2026, 10, 3, 15, 30), True),  # half-hour change, 02:00 -> 02:30
+    ('America/Sao_Paulo', (2018, 11, 4, 3, 0), True),      # midnight skipped, 00:00 -> 01:00
+]
+
+
+@pytest.mark.parametrize('zone, change, forward', TRANSITIONS)
+def test_window_openings_around_dst_changes(zone, change, forward):
+    change_seconds = utc(*change)
+    # Window starts on both sides of and inside the skipped or repeated hour
+    starts = [hm(0), hm(0, 30), hm(1, 30), hm(2), hm(2, 15), hm(2, 30), hm(3), hm(9)]
+    for window_start in starts:
+        for hours_before in (30, 20, 6, 2, 1, 0.5, 0, -0.5, -1):
+            now = change_seconds - int(hours_before * 3600)
+            for at_window_start in (False, True):
+                expected = reference_next_time(now, zone, window_start, hm(21), ALL_WEEKDAYS, at_window_start)
+                assert next_time(now, zone, window_start, hm(21), at_window_start=at_window_start) == expected, (
+                    zone, window_start, hours_before, at_window_start
+                )
+
+
+def test_start_in_spring_forward_gap_opens_at_the_change():
+    # 02:30 does not exist in New York on 2026-03-08; the clock first passes it at 03:00 EDT
+    assert next_time(utc(2026, 3, 8, 5, 0), 'America/New_York', hm(2, 30), hm(20)) == utc(2026, 3, 8, 7, 0)
+    # Berlin is east of UTC, so the two-pass estimate lands on the other side of the change
+    assert next_time(utc(2026, 3, 28, 23, 0), 'Europe/Berlin', hm(2, 30), hm(20)) == utc(2026, 3, 29, 1, 0)
+
+
+def test_skipped_midnight_opens_the_day_at_the_change():
+    assert next_time(utc(2018, 11, 3, 23, 0), 'America/Sao_Paulo', hm(0), hm(20), at_window_start=True) == utc(2018, 11, 4, 3, 0)
+
+
+def test_repeated_hour_opens_at_first_occurrence():
+    # 01:30 happens at 05:30 UTC (EDT) and again at 06:30 UTC (EST) on 2026-11-01
+    assert next_time(utc(2026, 11, 1, 4, 0), 'America/New_York', hm(1, 30), hm(20)) == utc(2026, 11, 1, 5, 30)
+
+
+def test_repeated_hour_after_first_occurrence_never_returns_the_past():
+    # 01:10 EST, after the first 01:30 has passed: the window reopens at the second 01:30
+    now = utc(2026, 11, 1, 6, 10)
+    assert next_time(now, 'America/New_York', hm(1, 30), hm(20)) == utc(2026, 11, 1, 6, 30)
+
+
+def test_inside_window_is_now_unless_at_window_start():
+    now = utc(2026, 3, 8, 15, 0)  # 11:00 EDT
+    assert next_time(now, 'America/New_York', hm(9), hm(20)) == now
+    assert next_time(now, 'America/New_York', hm(9), hm(20), at_window_start=True) == utc(2026, 3, 9, 13, 0)
+
+
+def test_morning_across_spring_forward_uses_new_offset():
+    # 9 AM on Saturday is 14:00 UTC (EST), on Sunday 13:00 UTC (EDT)
+    now = utc(2026, 3, 7, 15, 0)
+    assert next_time(now, 'America/New_York', hm(9), hm(9) + 1, at_window_start=True) == utc(2026, 3, 8, 13, 0)
+
+
+@pytest.mark.parametrize('weekdays, expected', [
+    ([0, 1, 2, 3, 4], utc(2026, 3, 9, 13, 0)),   # weekdays only: Saturday evening -> Monday 09:00 EDT
+    ([6], utc(2026, 3, 8, 13, 0)),               # Sundays only: the spring-forward Sunday itself
+    ([5], utc(2026, 3, 14, 13, 0)),              # Saturdays only: today's window is over, next week
+])
+def test_weekday_masks_across_spring_forward(weekdays, expected):
+    _, _, weekday_mask = parse_rules({'window_start': '09:00', 'window_end': '17:00', 'weekdays': weekdays})
+    now = utc(2026, 3, 7, 23, 0)  # Saturday 18:00 EST
+    assert next_time(now, 'America/New_York', hm(9), hm(17), weekday_mask) == expected
+
+
+def test_weekday_is_local_not_utc():
+    # Monday 01:00 UTC is still Sunday evening in New York; Sunday is not allowed
+    _, _, weekday_mask = parse_rules({'window_start': '18:00', 'window_end': '22:00', 'weekdays': [0]})
+    now = utc(2026, 3, 9, 1, 0)
+    assert next_time(now, 'America/New_York', hm(18), hm(22), weekday_mask) == utc(2026, 3, 9, 22, 0)
+
+
+def test_randomized_against_reference():
+    rng = random.Random(45)
+    zones = ['America/New_York', 'America/Los_Angeles', 'Europe/London', 'Europe/Berlin', 'Australia/Sydney',
+             'Australia/Lord_Howe', 'Asia/Kolkata', 'Pacific/Chatham', 'America/Phoenix', 'UTC']
+    cases = []
+    for _ in range(200):
+        zone = rng.choice(zones)
+        window_start = rng.randrange(0, 23 * 60) * 60
+        window_end = rng.randrange(window_start // 60 + 1, 24 * 60 + 1) * 60
+        weekday_mask = rng.randrange(1, ALL_WEEKDAYS + 1)
+        now = utc(2026, 1, 1) + rng.randrange(0, 365 * 86400)
+        cases.append((now, zone, window_start, window_end, weekday_mask, rng.random() < 0.5))
+
+    for at_window_start in (False, True):
+        batch = [case for case in cases if case[5] == at_window_start]
+        columns = [list(column) for column in zip(*batch)]
+        result = next_eligible_times(*columns[:5], at_window_start=at_window_start)
+        for case, actual in zip(batch, result):
+            assert int(actual) == reference_next_time(*case), case
+
+
+def test_sampled_table_matches_pytz_table():
+    for zone in ('America/New_York', 'Europe/Berlin', 'Australia/Lord_Howe', 'Asia/Kolkata'):
+        tz = pytz.timezone(zone)
+        sampled_starts, sampled_offsets = (np.array(part) for part in scheduling_windows._sampled_table(tz))
+        table_starts, table_offsets = (np.array(part) for part in scheduling_windows._transition_table(tz))
+        instants = np.arange(utc(1971, 1, 1), utc(2037, 1, 1), 3571, dtype=np.int64)
+        sampled = sampled_offsets[np.searchsorted(sampled_starts, instants, side='right') - 1]
+        table = table_offsets[np.searchsorted(table_starts, instants, side='right') - 1]
+        assert (sampled == table).all(), zone
+
+
+def test_falls_back_when_pytz_internals_change(monkeypatch):
+    def broken_table(tz):
+        raise AttributeError("'DstTzInfo' object has no attribute '_utc_transition_times'")
+
+    monkeypatch.setattr(scheduling_windows, '_transition_table', broken_table)
+    scheduling_windows._offset_table.cache_clear()
+    try:
+        now = utc(2026, 3, 8, 5, 0)
+        assert next_time(now, 'America/New_York', hm(2, 30), hm(20)) == utc(2026, 3, 8, 7, 0)
+        assert next_time(now, 'America/New_York', hm(9), hm(20)) == utc(2026, 3, 8, 13, 0)
+    finally:
+        scheduling_windows._offset_table.cache_clear()
+
+
+def test_fixed_offset_zone():
+    now = utc(2026, 3, 8, 20, 0)  # 01:30 IST
+    assert next_time(now, 'Asia/Kolkata', hm(9), hm(20)) == utc(2026, 3, 9, 3, 30)
+    now = utc(2026, 3, 8, 5, 0)
+    assert next_time(now, 'UTC', hm(9), hm(20)) == utc(2026, 3, 8, 9, 0)
+
+
+@pytest.mark.parametrize('rules', [
+    {'window_start': '20:00', 'window_end': '09:00'},
+    {'window_start': '09:00', 'window_end': '09:00'},
+    {'window_start': '25:00'},
+    {'window_start': '09:60'},
+    {'weekdays': []},
+    {'weekdays': [7]},
+    {'quiet_hours': {'start': '08:00', 'end': '21:00'}},
+])
+def test_parse_rules_rejects(rules):
+    with pytest.raises(ValueError):
+        parse_rules(rules)
+
+
+def test_parse_rules():
+    assert parse_rules(None) == (hm(9), hm(20), ALL_WEEKDAYS)
+    assert parse_rules({'quiet_hours': {'start': '21:00', 'end': '08:00'}, 'weekdays': [0, 6]}) == (hm(8), hm(21), 0b1000001)
+    assert parse_rules({'quiet_hours': {'start': '00:00', 'end': '07:30'}})[:2] == (hm(7, 30), 86400)
+
+
+def test_parse_timestamp():
+    assert parse_timestamp('2026-03-08T07:00:00Z') == utc(2026, 3, 8, 7, 0)
+    assert parse_timestamp('2026-03-08T02:00:00-05:00') == utc(2026, 3, 8, 7, 0)
+    assert parse_timestamp('2026-03-08T07:00:00') == utc(2026, 3, 8, 7, 0)
+    assert parse_timestamp(1234) == 1234
@@ -0,0 +1,162 @@
+"""
+Benchmark for team-member phone lookups through get_data_from_firestore, against an in-memory
+Firestore that counts operations. Each phase reports the Firestore reads, queries and writes per
+lookup, the latency they add up to at the given per-operation costs, and the measured in-process
+time (the fake answers queries with a linear scan, so compare paths by the Firestore columns):
+
+    cold index   every member resolved once through TeamMemberPhones (two point reads)
+    old scan     the same lookups through the where('phone', '==') query used before the index
+    backfill     members without an index entry: index miss, query, index write
+    miss         unknown phones: index miss and query, then served by the negative cache
+    warm         a skewed stream of repeat lookups served by PhoneCache
+
+    python bench_phone_cache.py [--members 10000] [--lookups 20000] [--max-entries 2000] [--read-ms 10] [--query-ms 30]
+"""
+import argparse
+import contextlib
+import os
+import random
+import time
+from google.cloud import firestore
+
+
+class FakeSnapshot:
+    def __init__(self, doc_id, data):
+        self.id = doc_id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self):
+        return dict(self._data) if self._data is not None else None
+
+
+class FakeDocument:
+    def __init__(self, db, collection, doc_id):
+        self._db = db
+        self._collection = collection
+        self.id = doc_id
+
+    def get(self):
+        self._db.counts['reads'] += 1
+        return FakeSnapshot(self.id, self._db.data[self._collection].get(self.id))
+
+    def set(self, data):
+        self._db.counts['writes'] += 1
+        self._db.data[self._collection][self.id] = data
+
+
+class FakeQuery:
+    def __init__(self, db, collection, field, value):
+        self._db = db
+        self._collection = collection
+        self._field = field
+        self._value = value
+
+    def limit(self, count):
+        return self
+
+    def stream(self):
+        self._db.counts['queries'] += 1
+        for doc_id, data in self._db.data[self._collection].items():
+            if data.get(self._field) == self._value:
+                self._db.counts['reads'] += 1
+                yield FakeSnapshot(doc_id, data)
+                return
+
+
+class FakeCollection:
+    def __init__(self, db, name):
+        self._db = db
+        self._name = name
+
+    def document(self, doc_id):
+        return FakeDocument(self._db, self._name, doc_id)
+
+    def where(self, field, op, value):
+        return FakeQuery(self._db, self._name, field, value)
+
+
+class FakeDB:
+    def __init__(self):
+        self.data = {'TeamMembers': {}, 'TeamMemberPhones': {}}
+        self.counts = {'reads': 0, 'queries': 0, 'writes': 0}
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+
+def phone(index):
+    return f"1555{index:07d}"
+
+
+def run_phase(db, lookup, phones, read_ms, query_ms, write_ms):
+    for key in db.counts:
+        db.counts[key] = 0
+    # main logs every lookup
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        started = time.perf_counter()
+        for number in phones:
+            lookup(number)
+        elapsed = time.perf_counter() - started
+    count = len(phones)
+    modeled_ms = db.counts['reads'] * read_ms + db.counts['queries'] * query_ms + db.counts['writes'] * write_ms
+    return {
+        'reads': db.counts['reads'] / count,
+        'queries': db.counts['queries'] / count,
+        'writes': db.counts['writes'] / count,
+        'firestore_ms': modeled_ms / count,
+        'in_process_us': elapsed * 1e6 / count,
+    }
+
+
+def run(members, lookups, max_entries, read_ms, query_ms, write_ms, seed=0):
+    db = FakeDB()
+    # main creates its Firestore client at import
+    firestore.Client = lambda *args, **kwargs: db
+    import main
+    from phone_cache import PhoneCache
+
+    for index in range(members):
+        db.data['TeamMembers'][f"member-{index}"] = {'phone': phone(index), 'name': f"Agent {index}"}
+    indexed = range(members // 2)
+    for index in indexed:
+        db.data['TeamMemberPhones'][phone(index)] = {'team_member_id': f"member-{index}"}
+
+    def cold(number):
+        main.invalidate_phone_cache()
+        return main.get_data_from_firestore(number)
+
+    rng = random.Random(seed)
+    # Zipf-like skew: a few agents' phones receive most of the inbound calls
+    weights = [1.0 / (rank + 1) for rank in range(members)]
+    warm_stream = [phone(index) for index in rng.choices(range(members), weights=weights, k=lookups)]
+    unknown = [phone(members + index) for index in range(min(members, lookups) // 2)]
+
+    results = {}
+    results['cold index'] = run_phase(db, cold, [phone(index) for index in indexed], read_ms, query_ms, write_ms)
+    results['old scan'] = run_phase(db, main.query_by_phone, [phone(index) for index in indexed], read_ms, query_ms, write_ms)
+    results['backfill'] = run_phase(db, cold, [phone(index) for index in range(members // 2, members)], read_ms, query_ms, write_ms)
+    main.invalidate_phone_cache()
+    # Each unknown phone is looked up twice in a row; the second lookup hits the negative cache
+    repeated = [number for number in unknown for _ in range(2)]
+    results['miss'] = run_phase(db, main.get_data_from_firestore, repeated, read_ms, query_ms, write_ms)
+    main._phone_cache = PhoneCache(max_entries)
+    results['warm'] = run_phase(db, main.get_data_from_firestore, warm_stream, read_ms, query_ms, write_ms)
+    results['warm']['cache_entries'] = len(main._phone_cache)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--members', type=int, default=10000)
+    parser.add_argument('--lookups', type=int, default=20000)
+    parser.add_argument('--max-entries', type=int, default=2000)
+    parser.add_argument('--read-ms', type=float, default=10.0)
+    parser.add_argument('--query-ms', type=float, default=30.0)
+    parser.add_argument('--write-ms', type=float, default=15.0)
+    args = parser.parse_args()
+    results = run(args.members, args.lookups, args.max_entries, args.read_ms, args.query_ms, args.write_ms)
+    for phase, result in results.items():
+        print(f"{phase}: " + ', '.join(
+            f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}" for key, value in result.items()
+        ))
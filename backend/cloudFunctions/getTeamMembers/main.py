@@ -1,5 +1,24 @@
+import os
 from flask import jsonify, request
 from google.cloud import firestore
+from phone_cache import PhoneCache
+
+# Firestore client, reused across requests on a warm instance
+db = firestore.Client()
+
+# Phone -> team member index keyed by document ID, so lookups are point reads instead of queries
+PHONE_INDEX_COLLECTION = 'TeamMemberPhones'
+
+# Seconds a warm instance serves a phone lookup from memory before re-reading Firestore
+CACHE_TTL_SECONDS = int(os.environ.get('TEAM_MEMBER_CACHE_TTL_SECONDS', 300))
+# Misses are cached briefly so a newly added team member is picked up quickly
+NEGATIVE_CACHE_TTL_SECONDS = int(os.environ.get('TEAM_MEMBER_NEGATIVE_CACHE_TTL_SECONDS', 30))
+
+# Bounds the memory of a long-lived warm instance; least recently used phones are evicted first
+CACHE_MAX_ENTRIES = int(os.environ.get('TEAM_MEMBER_CACHE_MAX_ENTRIES', 2000))
+
+# phone_number -> (team_member_data, doc_id)
+_phone_cache = PhoneCache(CACHE_MAX_ENTRIES)
 
 def google_function(request):
     # Parse the request JSON data
@@ -22,12 +41,58 @@ def google_function(request):
     return jsonify(response_data)
 
 def get_data_from_firestore(phone_number):
-    db = firestore.Client()
+    if not phone_number:
+        print("No phone number provided")
+        return None, None
+
+    # Serve from the warm in-memory map when possible
+    cached = _phone_cache.get(phone_number)
+    if cached is not None:
+        doc_data, doc_id = cached
+        print("Team member served from cache for phone number:", phone_number)
+        return (dict(doc_data) if doc_data else None), doc_id
+
+    doc_data, doc_id = lookup_by_phone_index(phone_number)
+    if doc_data is None:
+        doc_data, doc_id = query_by_phone(phone_number)
+        if doc_data is not None:
+            update_phone_index(phone_number, doc_id)
+
+    ttl = CACHE_TTL_SECONDS if doc_data is not None else NEGATIVE_CACHE_TTL_SECONDS
+    _phone_cache.put(phone_number, (doc_data, doc_id), ttl)
+
+    return (dict(doc_data) if doc_data else None), doc_id
+
+def lookup_by_phone_index(phone_number):
+    """Resolves a phone number through the TeamMemberPhones index with two point reads."""
+    index_doc = db.collection(PHONE_INDEX_COLLECTION).document(phone_number).get()
+    if not index_doc.exists:
+        return None, None
+
+    team_member_id = index_doc.to_dict().get('team_member_id')
+    if not team_member_id:
+        return None, None
+
+    doc = db.collection('TeamMembers').document(team_member_id).get()
+    if not doc.exists:
+        print("Stale phone index entry for phone number:", phone_number)
+        return None, None
+
+    doc_data = doc.to_dict()
+    # The member's phone may have changed since the index entry was written
+    if doc_data.get('phone') != phone_number:
+        print("Phone index entry no longer matches team member:", team_member_id)
+        return None, None
+
+    print("Document found via phone index:", doc_data)
+    return doc_data, doc.id
+
+def query_by_phone(phone_number):
     # Reference to the TeamMembers collection
     team_members_ref = db.collection('TeamMembers')
 
     # Search for the document with the specified clean phone number
-    docs = team_members_ref.where('phone', '==', phone_number).stream()
+    docs = team_members_ref.where('phone', '==', phone_number).limit(1).stream()
 
     # Assuming that phone numbers are unique and there will only be one match
     for doc in docs:
@@ -39,6 +104,20 @@ def get_data_from_firestore(phone_number):
     print("No document found for phone number:", phone_number)  # Debug: Print a message if no document is found
     return None, None
 
+def update_phone_index(phone_number, team_member_id):
+    """Writes the phone -> team member index entry so the next cold lookup skips the query."""
+    try:
+        db.collection(PHONE_INDEX_COLLECTION).document(phone_number).set({
+            'team_member_id': team_member_id,
+            'updated_at': firestore.SERVER_TIMESTAMP
+        })
+    except Exception as e:
+        print(f"Error updating phone index for {phone_number}: {e}")
+
+def invalidate_phone_cache(phone_number=None):
+    """Drops one phone number (or every entry) from the in-memory lookup cache."""
+    _phone_cache.invalidate(phone_number)
+
 def format_response_data(team_member_data, doc_id):
     if not team_member_data:
         print("No team member data to format")  # Debug: Print a message if no data to format
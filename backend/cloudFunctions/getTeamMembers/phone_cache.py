@@ -0,0 +1,48 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class PhoneCache:
+    """
+    Bounded, thread-safe LRU of phone lookups with per-entry expiry. Expired entries are dropped when
+    read, and the least recently used entry is evicted once max_entries is reached.
+    """
+
+    def __init__(self, max_entries, clock=time.monotonic):
+        self.max_entries = max(1, max_entries)
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the cached (team_member_data, doc_id), or None on a miss or expired entry."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= self._clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (self._clock() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key=None):
+        """Drops one key, or every entry when key is None."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
@@ -0,0 +1,77 @@
+import re
+import json
+
+# Characters that can change brace depth or string state; everything else is skipped in bulk
+_SIGNIFICANT_RE = re.compile(r'[{}"\\]')
+# Log lines some model responses interleave with the JSON body
+_TIMESTAMP_LINE_RE = re.compile(r'^\s*\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}.*$\n?', re.MULTILINE)
+
+
+def _top_level_objects(text):
+    """
+    Yields (start, end) for every balanced top-level {...} span in text, in one left-to-right scan.
+
+    Brace depth and string/escape state are tracked as the scan goes; quotes and stray closing braces
+    outside an object are ignored. Each character is visited once, so the cost is linear in len(text)
+    even for unbalanced or adversarial input.
+    """
+    depth = 0
+    in_string = False
+    start = -1
+    pos = 0
+    while True:
+        match = _SIGNIFICANT_RE.search(text, pos)
+        if match is None:
+            return
+        char = match.group()
+        pos = match.end()
+        if depth == 0:
+            if char == '{':
+                depth = 1
+                in_string = False
+                start = match.start()
+            continue
+        if in_string:
+            if char == '\\':
+                # Skip the escaped character
+                pos += 1
+            elif char == '"':
+                in_string = False
+        elif char == '"':
+            in_string = True
+        elif char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth == 0:
+                yield start, match.start()
+
+
+def extract_json_object(response_text):
+    """
+    Extracts the first JSON object from free-form model output in a single forward scan.
+
+    Code fences, prose before or after the object and stray timestamped log lines are tolerated.
+    Top-level candidates that fail to parse are skipped; objects nested inside them are not retried,
+    and an object left unterminated (truncated output) is not a candidate.
+
+    Returns:
+        dict: The parsed object.
+
+    Raises:
+        ValueError: If no parseable JSON object is found.
+    """
+    text = response_text or ''
+    for start, end in _top_level_objects(text):
+        candidate = text[start:end + 1]
+        try:
+            return json.loads(candidate)
+        except ValueError:
+            cleaned = _TIMESTAMP_LINE_RE.sub('', candidate)
+            if cleaned != candidate:
+                try:
+                    return json.loads(cleaned)
+                except ValueError:
+                    pass
+
+    raise ValueError("No JSON content found in the response")
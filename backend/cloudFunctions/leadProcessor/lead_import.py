@@ -0,0 +1,149 @@
+import csv
+import json
+import os
+from google.cloud import storage
+
+# Import state lives in ContactImports/{import_id}; results are written next to the source file
+IMPORT_COLLECTION = 'ContactImports'
+
+# CSV columns that make up the nested address of a lead (same shape extract_lead_info returns)
+ADDRESS_COLUMNS = ('zip', 'city', 'state', 'street')
+
+READ_BLOCK_BYTES = 256 * 1024
+
+
+def split_uri(uri):
+    """(scheme, bucket, path) for gs://bucket/path, or ('file', None, path) for file:///path."""
+    if uri.startswith('gs://'):
+        bucket, _, path = uri[len('gs://'):].partition('/')
+        return 'gs', bucket, path
+    if uri.startswith('file://'):
+        return 'file', None, uri[len('file://'):]
+    raise ValueError(f"Unsupported import URI: {uri}")
+
+
+def open_source(uri, offset=0):
+    """Binary stream over an import file, positioned at byte offset. GCS objects are read in chunks, never whole."""
+    scheme, bucket, path = split_uri(uri)
+    if scheme == 'gs':
+        stream = storage.Client().bucket(bucket).blob(path).open('rb')
+    else:
+        stream = open(path, 'rb')
+    if offset:
+        stream.seek(offset)
+    return stream
+
+
+def results_prefix(source_uri, import_id):
+    """Where the per-row result parts of an import go: {source dir}/import_results/{import_id}/."""
+    directory = source_uri.rsplit('/', 1)[0]
+    return f"{directory}/import_results/{import_id}/"
+
+
+def write_result_part(prefix, first_row, results):
+    """Writes one chunk of per-row results as NDJSON to {prefix}{first_row:09d}.ndjson and returns its URI."""
+    uri = f"{prefix}{first_row:09d}.ndjson"
+    body = ''.join(json.dumps(result, default=str) + '\n' for result in results)
+    scheme, bucket, path = split_uri(uri)
+    if scheme == 'gs':
+        storage.Client().bucket(bucket).blob(path).upload_from_string(body, content_type='application/x-ndjson')
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as part_file:
+            part_file.write(body)
+    return uri
+
+
+def detect_format(uri, requested=None):
+    if requested:
+        if requested not in ('csv', 'ndjson'):
+            raise ValueError(f"Unsupported import format: {requested}")
+        return requested
+    return 'ndjson' if uri.endswith(('.ndjson', '.jsonl')) else 'csv'
+
+
+class RowReader:
+    """
+    Reads records one at a time from a binary stream, keeping the byte offset just past the last record
+    returned so an import can checkpoint it and seek straight back.
+
+    CSV rows are mapped with the header, which is read at offset 0 and must be passed back in
+    (fieldnames) when resuming. Yields (row_number, record, error) with 1-based data row numbers.
+    """
+
+    def __init__(self, stream, file_format, offset=0, rows_read=0, fieldnames=None):
+        self.stream = stream
+        self.file_format = file_format
+        self.offset = offset
+        self.rows_read = rows_read
+        self.fieldnames = fieldnames
+
+    def _lines(self):
+        # Splits fixed-size reads ourselves; line iteration on a GCS BlobReader falls back to byte-wise reads
+        pending = b''
+        while True:
+            block = self.stream.read(READ_BLOCK_BYTES)
+            if not block:
+                break
+            lines = (pending + block).split(b'\n')
+            pending = lines.pop()
+            for raw in lines:
+                self.offset += len(raw) + 1
+                yield raw.decode('utf-8-sig') + '\n'
+        if pending:
+            self.offset += len(pending)
+            yield pending.decode('utf-8-sig')
+
+    def __iter__(self):
+        if self.file_format == 'csv':
+            return self._csv_records()
+        return self._ndjson_records()
+
+    def _csv_records(self):
+        # csv.reader only pulls the lines of the current record, so offset stays exact even for quoted newlines
+        reader = csv.reader(self._lines())
+        if self.fieldnames is None:
+            self.fieldnames = [name.strip() for name in next(reader, [])]
+        for values in reader:
+            if not any(value.strip() for value in values):
+                continue
+            self.rows_read += 1
+            if len(values) > len(self.fieldnames):
+                yield self.rows_read, None, f"Expected {len(self.fieldnames)} columns, got {len(values)}"
+                continue
+            yield self.rows_read, csv_row_to_lead_info(dict(zip(self.fieldnames, values))), None
+
+    def _ndjson_records(self):
+        for line in self._lines():
+            line = line.strip()
+            if not line:
+                continue
+            self.rows_read += 1
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield self.rows_read, None, f"Invalid JSON: {str(e)}"
+                continue
+            if not isinstance(record, dict):
+                yield self.rows_read, None, "Expected a JSON object"
+                continue
+            yield self.rows_read, record, None
+
+
+def csv_row_to_lead_info(row):
+    """Maps a CSV row to the lead_info shape: blanks dropped, address columns nested, tags split on , or ;."""
+    lead_info = {}
+    address = {}
+    for column, value in row.items():
+        value = (value or '').strip()
+        if not column or not value:
+            continue
+        if column in ADDRESS_COLUMNS:
+            address[column] = value
+        elif column == 'tags':
+            lead_info['tags'] = [tag.strip() for tag in value.replace(';', ',').split(',') if tag.strip()]
+        else:
+            lead_info[column] = value
+    if address:
+        lead_info['address'] = address
+    return lead_info
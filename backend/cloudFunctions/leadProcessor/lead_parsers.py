@@ -0,0 +1,172 @@
+import re
+import html
+
+# Parsers keyed by sender domain; a parser also needs its template marker in the body
+_parsers_by_domain = {}
+
+_TAG_RE = re.compile(r'<(?:br|/p|/div|/tr|/li)[^>]*>', re.IGNORECASE)
+_ANY_TAG_RE = re.compile(r'<[^>]+>')
+_ADDRESS_RE = re.compile(r'^(?P<street>[^,]+),\s*(?P<city>[^,]+),\s*(?P<state>[A-Z]{2})\s*(?P<zip>\d{5})?')
+
+
+class LeadParser:
+    """
+    Deterministic extractor for one lead source.
+
+    A parser is only selected for mail from one of its sender_domains whose body also contains its
+    marker_pattern, the template's own wording. Fields are read from the lead block alone, the lines
+    from block_start up to block_end, so a 'Phone:' in the agent's signature or the portal's footer is
+    never taken for the lead's. field_patterns map lead fields ('name', 'firstName', 'lastName',
+    'phoneNumber', 'email', 'address') to compiled regexes whose first group holds the value.
+    """
+
+    def __init__(self, name, sender_domains, marker_pattern, block_start, block_end, field_patterns):
+        self.name = name
+        self.sender_domains = tuple(sender_domains)
+        self.marker_re = re.compile(marker_pattern, re.IGNORECASE)
+        self.block_start_re = re.compile(block_start, re.IGNORECASE | re.MULTILINE)
+        self.block_end_re = re.compile(block_end, re.IGNORECASE | re.MULTILINE)
+        self.field_patterns = field_patterns
+
+    def matches(self, text):
+        return bool(self.marker_re.search(text))
+
+    def lead_block(self, text):
+        """The template's lead section, or None when the email does not contain one."""
+        start = self.block_start_re.search(text)
+        if not start:
+            return None
+        end = self.block_end_re.search(text, start.end())
+        return text[start.end():end.start() if end else len(text)]
+
+    def parse(self, text):
+        """Returns lead_info in the Gemini schema, or None when the email does not fit the format."""
+        block = self.lead_block(text)
+        if block is None:
+            return None
+        values = {}
+        for field, pattern in self.field_patterns.items():
+            match = pattern.search(block)
+            if match:
+                values[field] = match.group(1).strip()
+
+        phone = ''.join(filter(str.isdigit, values.get('phoneNumber', '')))
+        if len(phone) == 11 and phone.startswith('1'):
+            phone = phone[1:]
+        if len(phone) != 10:
+            return None
+
+        first_name = values.get('firstName', '')
+        last_name = values.get('lastName', '')
+        if 'name' in values and not (first_name or last_name):
+            first_name, _, last_name = values['name'].partition(' ')
+
+        return {
+            "firstName": first_name.strip(),
+            "lastName": last_name.strip(),
+            "phoneNumber": phone,
+            # Buyer or seller is not stated reliably in the templates; tags are left to the caller
+            "tags": [],
+            "email": values.get('email', ''),
+            "address": parse_address(values.get('address', ''))
+        }
+
+
+def parse_address(address_line):
+    address = {"zip": "", "city": "", "state": "", "street": ""}
+    match = _ADDRESS_RE.match(address_line.strip())
+    if match:
+        address.update({key: (value or '').strip() for key, value in match.groupdict().items()})
+    elif address_line:
+        address["street"] = address_line.strip()
+    return address
+
+
+def html_to_text(email_body):
+    """Flattens an HTML email body to one field per line; plain text passes through unchanged."""
+    if '<' not in email_body:
+        return email_body
+    text = _TAG_RE.sub('\n', email_body)
+    return html.unescape(_ANY_TAG_RE.sub(' ', text))
+
+
+def sender_domain(sender):
+    match = re.search(r'@([\w.-]+)', sender or '')
+    return match.group(1).lower() if match else ''
+
+
+def register_parser(parser):
+    """Adds a parser to the registry, keyed by each of its sender domains."""
+    for domain in parser.sender_domains:
+        _parsers_by_domain.setdefault(domain.lower(), []).append(parser)
+    return parser
+
+
+def find_parser(sender, text):
+    """
+    The parser for mail from a registered portal domain whose body has that parser's marker. Mail
+    without a matching sender is never fingerprinted by content alone, since forwarded threads and
+    agents' own mail mention the portals freely.
+    """
+    domain = sender_domain(sender)
+    # Match the domain and its parent domains, e.g. mail.zillow.com -> zillow.com
+    parts = domain.split('.')
+    for start in range(len(parts) - 1):
+        for parser in _parsers_by_domain.get('.'.join(parts[start:]), []):
+            if parser.matches(text):
+                return parser
+    return None
+
+
+def parse_lead_email(email_body, sender=''):
+    """
+    Tries the registered deterministic parsers.
+
+    Returns:
+        (lead_info, parser_name), or (None, None) when no parser recognizes the email.
+    """
+    text = html_to_text(email_body or '')
+    parser = find_parser(sender, text)
+    if parser is None:
+        return None, None
+    lead_info = parser.parse(text)
+    if lead_info is None:
+        return None, None
+    return lead_info, parser.name
+
+
+def _labeled(*labels):
+    """Compiles a regex for a 'Label: value' line, accepting any of the given labels."""
+    return re.compile(r'^[ \t]*(?:' + '|'.join(labels) + r')[ \t]*:[ \t]*(.+?)[ \t]*$', re.IGNORECASE | re.MULTILINE)
+
+
+register_parser(LeadParser(
+    'zillow',
+    sender_domains=('zillow.com',),
+    marker_pattern=r'new (?:lead|contact) from zillow premier agent',
+    # The buyer's details sit between this heading and their message
+    block_start=r'^[ \t]*(?:buyer\'s )?contact information[ \t]*$',
+    block_end=r'^[ \t]*(?:message|note from the buyer|what happens next)\b',
+    field_patterns={
+        'name': _labeled('Name', 'Contact Name'),
+        'phoneNumber': _labeled('Phone', 'Phone Number'),
+        'email': _labeled('Email', 'Email Address'),
+        'address': _labeled('Property', 'Property Address'),
+    }
+))
+
+register_parser(LeadParser(
+    'realtor',
+    sender_domains=('realtor.com', 'move.com'),
+    marker_pattern=r'new lead from realtor\.com|realtor\.com(?:®|&reg;)? connections',
+    block_start=r'^[ \t]*(?:lead|consumer) (?:information|details)[ \t]*$',
+    block_end=r'^[ \t]*(?:comments?|message|lead source)\b',
+    field_patterns={
+        'firstName': _labeled('First Name'),
+        'lastName': _labeled('Last Name'),
+        'name': _labeled('Name', 'Lead Name'),
+        'phoneNumber': _labeled('Phone', 'Phone Number', 'Primary Phone'),
+        'email': _labeled('Email', 'Email Address'),
+        'address': _labeled('Property Address', 'Listing Address'),
+    }
+))
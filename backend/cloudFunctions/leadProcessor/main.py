@@ -2,6 +2,7 @@ import functions_framework
 from flask import jsonify
 import json
 import os
+import random
 import re
 import google.generativeai as genai
 from google.cloud import firestore
@@ -9,6 +10,15 @@ import datetime
 from google.auth import default
 from google.auth.transport.requests import Request
 import requests
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from google.api_core import exceptions
+from lead_parsers import parse_lead_email
+from json_extract import extract_json_object
+from log_utils import log_event, log_debug
+from lead_import import IMPORT_COLLECTION, RowReader, detect_format, open_source, results_prefix, write_result_part
 
 # Initialize Firestore
 db = firestore.Client()
@@ -26,22 +36,48 @@ credentials.refresh(Request())
 # Configure genai with credentials
 genai.configure(credentials=credentials)
 
+def parse_positive_int(value, default, minimum=1):
+    """Parses an integer setting, falling back to default when it is missing or malformed."""
+    try:
+        return max(minimum, int(value))
+    except (TypeError, ValueError):
+        if value not in (None, ''):
+            print(f"Ignoring invalid integer setting {value!r}; using {default}")
+        return default
+
+# Batch ingestion limits
+LEAD_BATCH_CONCURRENCY = parse_positive_int(os.environ.get('LEAD_BATCH_CONCURRENCY'), 8)
+LEAD_BATCH_MAX_ITEMS = parse_positive_int(os.environ.get('LEAD_BATCH_MAX_ITEMS'), 1000)
+BULK_WRITE_MAX_ATTEMPTS = 5
+
+# Extraction-path counters are spread over this many documents per day (~1 write/s per document)
+EXTRACTION_STATS_SHARDS = parse_positive_int(os.environ.get('LEAD_EXTRACTION_STATS_SHARDS'), 10)
+
+# Firestore allows at most 30 values in an 'in' filter
+FIRESTORE_IN_LIMIT = 30
+
+# Bulk contact imports: rows stored (and checkpointed) per chunk, and the run time before handing back
+IMPORT_CHUNK_ROWS = parse_positive_int(os.environ.get('LEAD_IMPORT_CHUNK_ROWS'), 500)
+IMPORT_TIME_BUDGET_SECONDS = parse_positive_int(os.environ.get('LEAD_IMPORT_TIME_BUDGET_SECONDS'), 480)
+# A run may overshoot its budget by the chunk in progress; the lease covers that before it lapses
+IMPORT_LEASE_SECONDS = parse_positive_int(os.environ.get('LEAD_IMPORT_LEASE_SECONDS'), IMPORT_TIME_BUDGET_SECONDS + 120)
+
 @functions_framework.http
 def process_lead_email(request):
     print(f"Function started. Using project ID: {project_id}")
     # Parse the payload
     payload = request.get_json()
-    print(f"Received payload: {payload}")
+    log_event("Received payload", payload=payload)
 
     # Extract the email body and client email
     email_body = payload.get('email_body', '')
     client_email = payload.get('client_email', '')
-    print(f"Extracted client_email: {client_email}")
+    log_event("Extracted client_email", client_email=client_email)
 
     # Process the email to extract lead information
     try:
-        lead_info = extract_lead_info(email_body)
-        print(f"Extracted lead_info: {lead_info}")
+        lead_info = extract_lead_info(email_body, payload.get('sender', ''), payload.get('subject', ''))
+        log_event("Extracted lead_info", lead_info=lead_info)
     except Exception as e:
         print(f"Error in extract_lead_info: {str(e)}")
         return jsonify({"error": f"Failed to extract lead info: {str(e)}"}), 500
@@ -57,8 +93,43 @@ def process_lead_email(request):
     # Return the result as JSON
     return jsonify(result)
 
-def extract_lead_info(email_body):
+def record_extraction_counts(counts):
+    """
+    Adds per-path extraction counts (a parser name or 'gemini' -> emails) to a random shard of today's
+    LeadExtractionStats. Shards are {date}_{shard} documents carrying a 'date' field; sum them to read a day.
+    """
+    counts = {path: count for path, count in counts.items() if count}
+    if not counts:
+        return
+    try:
+        day = datetime.date.today().isoformat()
+        shard = random.randrange(EXTRACTION_STATS_SHARDS)
+        stats_ref = db.collection('LeadExtractionStats').document(f"{day}_{shard}")
+        stats_ref.set({
+            'date': day,
+            **{path: firestore.Increment(count) for path, count in counts.items()},
+            'total': firestore.Increment(sum(counts.values()))
+        }, merge=True)
+    except Exception as e:
+        print(f"Error recording extraction path: {str(e)}")
+
+def record_extraction_path(path, extraction_paths=None):
+    """Counts the path that handled one email, or collects it into extraction_paths for a batch write."""
+    if extraction_paths is not None:
+        extraction_paths.append(path)
+    else:
+        record_extraction_counts({path: 1})
+
+def extract_lead_info(email_body, sender='', subject='', extraction_paths=None):
     print("Starting extract_lead_info")
+    # Fixed-format portal emails are parsed deterministically; Gemini is the fallback
+    lead_info, parser_name = parse_lead_email(email_body, sender)
+    if lead_info is not None:
+        log_event("Lead extracted by parser", parser=parser_name, lead_info=lead_info)
+        record_extraction_path(parser_name, extraction_paths)
+        return lead_info
+    record_extraction_path('gemini', extraction_paths)
+
     # Initialize the Gemini model
     model = genai.GenerativeModel('gemini-1.5-pro')
 
@@ -117,17 +188,13 @@ def extract_lead_info(email_body):
                 top_k=40,
             )
         )
-        print(f"Received response from Gemini: {response.text}")
+        log_debug("Received response from Gemini", response=response.text)
     except Exception as e:
         print(f"Error generating content from Gemini: {str(e)}")
         raise
     # Parse the response
     try:
-        # Clean up the response text
-        clean_response = clean_json_response(response.text)
-        print(f"Cleaned response: {clean_response}")
-        
-        lead_info = json.loads(clean_response)
+        lead_info = extract_json_object(response.text)
         
         # Ensure phone number is just digits
         if lead_info.get('phoneNumber'):
@@ -139,47 +206,56 @@ def extract_lead_info(email_body):
         elif not isinstance(lead_info.get('tags'), list):
             lead_info['tags'] = []
 
-        print(f"Final lead_info: {lead_info}")
+        log_debug("Final lead_info", lead_info=lead_info)
         return lead_info
     except Exception as e:
         print(f"Error parsing Gemini response: {str(e)}")
-        print(f"Response text: {response.text}")
-        print(f"Cleaned response: {clean_response}")
+        log_event("Unparseable Gemini response", severity='WARNING', response=response.text)
         raise
 
-def clean_json_response(response_text):
-    print("Starting clean_json_response")
-    print(f"Original response text: {response_text}")
-    # Find JSON content between triple backticks
-    json_match = re.search(r'```json\s*([\s\S]*?)\s*```', response_text)
-    if json_match:
-        json_content = json_match.group(1)
-    else:
-        # If no JSON block is found, try to find content between curly braces
-        json_match = re.search(r'\{[\s\S]*\}', response_text)
-        if json_match:
-            json_content = json_match.group(0)
-        else:
-            print("No JSON content found in the response")
-            raise ValueError("No JSON content found in the response")
+def sanitize_lead_phone(phone_number):
+    """Returns (sanitized_phone_number, error) for a lead phone number."""
+    sanitized_phone_number = re.sub("[^0-9]", "", phone_number or '')
+    if len(sanitized_phone_number) == 10:
+        sanitized_phone_number = '1' + sanitized_phone_number
+    elif len(sanitized_phone_number) < 11:
+        return None, "Phone number is too short"
+    return sanitized_phone_number, None
 
-    # Remove any lines that start with a timestamp
-    lines = json_content.split('\n')
-    clean_lines = [line for line in lines if not re.match(r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}', line.strip())]
-    
-    # Join the remaining lines
-    clean_text = '\n'.join(clean_lines)
-    
-    # Instead of removing all non-JSON characters, let's parse the JSON and then re-serialize it
-    try:
-        json_obj = json.loads(clean_text)
-        clean_text = json.dumps(json_obj, ensure_ascii=False)
-    except json.JSONDecodeError as e:
-        print(f"Error parsing JSON: {str(e)}")
-        raise
-    
-    print(f"Cleaned JSON: {clean_text}")
-    return clean_text.strip()
+def build_active_flow(flow_doc, current_time):
+    return {
+        'flow_id': flow_doc.id,
+        'flow_name': flow_doc.get('name'),
+        'status': 'pending',
+        'createdAt': current_time,
+        'callCounter': 0,
+        'type': 'Convert'
+    }
+
+def prepare_contact_update(lead_info, flow_doc, contact_data, current_time):
+    """Returns (update_data, error) for a lead that matches an existing contact."""
+    # Check if there's already an active flow
+    if 'activeFlows' in contact_data and contact_data['activeFlows'] and len(contact_data['activeFlows']) > 0:
+        return None, "Contact already has an active flow"
+
+    # Update the contact with new information and add active flow
+    return {
+        **lead_info,
+        'updatedAt': current_time,
+        'activeFlows': [build_active_flow(flow_doc, current_time)]
+    }, None
+
+def prepare_new_contact(lead_info, flow_doc, sanitized_phone_number, current_time):
+    return {
+        **lead_info,
+        'organization_id': flow_doc.get('organization_id'),
+        'lead_source': flow_doc.get('lead_source'),
+        'phoneNumber': sanitized_phone_number,
+        'phoneStatus': 'active',
+        'createdAt': current_time,
+        'updatedAt': current_time,
+        'activeFlows': [build_active_flow(flow_doc, current_time)]
+    }
 
 def store_lead_info(client_email, lead_info):
     print("Starting store_lead_info")
@@ -190,15 +266,12 @@ def store_lead_info(client_email, lead_info):
 
     flow_doc = flow_ref[0]
     organization_id = flow_doc.get('organization_id')
-    lead_source = flow_doc.get('lead_source')
     flow_id = flow_doc.id
 
     # Sanitize phone number
-    sanitized_phone_number = re.sub("[^0-9]", "", lead_info['phoneNumber'])
-    if len(sanitized_phone_number) == 10:
-        sanitized_phone_number = '1' + sanitized_phone_number
-    elif len(sanitized_phone_number) < 11:
-        return {"error": "Phone number is too short"}
+    sanitized_phone_number, error = sanitize_lead_phone(lead_info.get('phoneNumber'))
+    if error:
+        return {"error": error}
 
     # Check if the lead already exists
     contacts_ref = db.collection('Contacts')
@@ -211,44 +284,14 @@ def store_lead_info(client_email, lead_info):
         contact_doc = existing_contact[0]
         contact_id = contact_doc.id
         contact_data = contact_doc.to_dict()
-        print (contact_data)
-        # Check if there's already an active flow
-        if 'activeFlows' in contact_data and contact_data['activeFlows'] and len(contact_data['activeFlows']) > 0:
-            return {"error": "Contact already has an active flow"}
-
-        # Update the contact with new information and add active flow
-        update_data = {
-            **lead_info,
-            'updatedAt': current_time,
-            'activeFlows': [{
-                'flow_id': flow_id,
-                'flow_name': flow_doc.get('name'),
-                'status': 'pending',
-                'createdAt': current_time,
-                'callCounter': 0,
-                'type': 'Convert'
-            }]
-        }
+        log_debug("Existing contact", contact_id=contact_id, contact=contact_data)
+        update_data, error = prepare_contact_update(lead_info, flow_doc, contact_data, current_time)
+        if error:
+            return {"error": error}
         contacts_ref.document(contact_id).update(update_data)
     else:
         # Add new contact
-        new_contact_data = {
-            **lead_info,
-            'organization_id': organization_id,
-            'lead_source': lead_source,
-            'phoneNumber': sanitized_phone_number,
-            'phoneStatus': 'active',
-            'createdAt': current_time,
-            'updatedAt': current_time,
-            'activeFlows': [{
-                'flow_id': flow_id,
-                'flow_name': flow_doc.get('name'),
-                'status': 'pending',
-                'createdAt': current_time,
-                'callCounter': 0,
-                'type': 'Convert'
-            }]
-        }
+        new_contact_data = prepare_new_contact(lead_info, flow_doc, sanitized_phone_number, current_time)
         new_contact = contacts_ref.add(new_contact_data)
         contact_id = new_contact[1].id
 
@@ -263,3 +306,368 @@ def store_lead_info(client_email, lead_info):
         "flow_id": flow_id
     }
 
+def parse_batch_payload(request):
+    """Reads lead emails from a JSON array, a {"emails": [...]} object or an NDJSON body."""
+    if request.content_type and 'ndjson' in request.content_type:
+        items = []
+        for line in request.stream:
+            line = line.strip()
+            if line:
+                items.append(json.loads(line))
+        payload = items
+    else:
+        payload = request.get_json(silent=True)
+        if isinstance(payload, dict):
+            payload = payload.get('emails')
+    if not isinstance(payload, list):
+        raise ValueError("Expected a JSON array of emails, an object with an 'emails' array, or an NDJSON body")
+    if not all(isinstance(item, dict) for item in payload):
+        raise ValueError("Each email must be an object with 'email_body' and 'client_email'")
+    return payload
+
+def chunked(values, size):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+def fetch_flows_by_lead_email(client_emails):
+    """Resolves many client emails to their flow documents with batched 'in' queries."""
+    flows = {}
+    for chunk in chunked(set(client_emails), FIRESTORE_IN_LIMIT):
+        for flow_doc in db.collection('Flows').where('lead_email', 'in', chunk).stream():
+            flows.setdefault(flow_doc.get('lead_email'), flow_doc)
+    return flows
+
+def fetch_contacts_by_phone(organization_id, phone_numbers):
+    """Resolves many phone numbers within an organization to contact documents with batched 'in' queries."""
+    contacts = {}
+    for chunk in chunked(set(phone_numbers), FIRESTORE_IN_LIMIT):
+        query = db.collection('Contacts').where('organization_id', '==', organization_id).where('phoneNumber', 'in', chunk)
+        for contact_doc in query.stream():
+            contacts.setdefault(contact_doc.get('phoneNumber'), contact_doc)
+    return contacts
+
+def store_lead_batch(items, lead_infos):
+    """
+    Stores many extracted leads with the same rules as store_lead_info, resolving flows and
+    contacts with batched lookups and writing everything through one BulkWriter.
+    Returns one result dict per item (items that already failed extraction are left untouched).
+    """
+    results = [None] * len(items)
+    flows = fetch_flows_by_lead_email(items[i].get('client_email', '') for i in lead_infos)
+
+    indexes = []
+    entries = []
+    for index, lead_info in lead_infos.items():
+        flow_doc = flows.get(items[index].get('client_email', ''))
+        if flow_doc is None:
+            results[index] = {"error": "No matching flow found for the given client email"}
+            continue
+        indexes.append(index)
+        entries.append((lead_info, flow_doc))
+
+    for index, result in zip(indexes, store_resolved_leads(entries)):
+        results[index] = result
+    return results
+
+def store_resolved_leads(entries, bulk_writer=None):
+    """
+    Stores (lead_info, flow_doc) pairs with the same rules as store_lead_info: phones are sanitized,
+    contacts are matched per organization with batched lookups, and the Contacts and flow_contacts
+    writes go through a BulkWriter.
+
+    A given bulk_writer is flushed rather than closed, so a caller streaming many chunks can reuse it;
+    each call returns only once its writes have settled. Returns one result dict per entry.
+    """
+    results = [None] * len(entries)
+
+    # Sanitize phones and group leads by organization for the contact lookup
+    pending = {}
+    for index, (lead_info, flow_doc) in enumerate(entries):
+        sanitized_phone_number, error = sanitize_lead_phone(lead_info.get('phoneNumber'))
+        if error:
+            results[index] = {"error": error}
+            continue
+        pending[index] = (flow_doc, sanitized_phone_number)
+
+    contacts_by_org = {}
+    for flow_doc, phone in pending.values():
+        contacts_by_org.setdefault(flow_doc.get('organization_id'), set()).add(phone)
+    existing = {
+        organization_id: fetch_contacts_by_phone(organization_id, phones)
+        for organization_id, phones in contacts_by_org.items()
+    }
+
+    current_time = datetime.datetime.now().isoformat()
+    contacts_ref = db.collection('Contacts')
+    owns_bulk_writer = bulk_writer is None
+    if owns_bulk_writer:
+        bulk_writer = db.bulk_writer()
+    write_errors = {}
+
+    def on_write_error(failure, _bulk_writer):
+        write_errors[failure.operation.reference.path] = failure.message
+        return failure.attempts < BULK_WRITE_MAX_ATTEMPTS
+
+    def on_write_result(reference, _result, _bulk_writer):
+        write_errors.pop(reference.path, None)
+
+    bulk_writer.on_write_error(on_write_error)
+    bulk_writer.on_write_result(on_write_result)
+
+    # (organization_id, phone) -> contact ID claimed earlier in this batch
+    claimed = {}
+    written_refs = {}
+    for index, (flow_doc, phone) in pending.items():
+        lead_info = entries[index][0]
+        organization_id = flow_doc.get('organization_id')
+        key = (organization_id, phone)
+        if key in claimed:
+            results[index] = {"error": "Contact already has an active flow"}
+            continue
+
+        contact_doc = existing[organization_id].get(phone)
+        if contact_doc is not None:
+            update_data, error = prepare_contact_update(lead_info, flow_doc, contact_doc.to_dict(), current_time)
+            if error:
+                results[index] = {"error": error}
+                continue
+            contact_ref = contacts_ref.document(contact_doc.id)
+            bulk_writer.update(contact_ref, update_data)
+        else:
+            contact_ref = contacts_ref.document()
+            bulk_writer.create(contact_ref, prepare_new_contact(lead_info, flow_doc, phone, current_time))
+
+        flow_contact_ref = db.collection('Flows').document(flow_doc.id).collection('flow_contacts').document(contact_ref.id)
+        bulk_writer.set(flow_contact_ref, lead_info)
+
+        claimed[key] = contact_ref.id
+        written_refs[index] = (contact_ref.path, flow_contact_ref.path)
+        results[index] = {
+            "success": True,
+            "message": "Lead information stored successfully",
+            "contact_id": contact_ref.id,
+            "flow_id": flow_doc.id
+        }
+
+    if owns_bulk_writer:
+        bulk_writer.close()
+    else:
+        bulk_writer.flush()
+
+    for index, paths in written_refs.items():
+        failed = [write_errors[path] for path in paths if path in write_errors]
+        if failed:
+            results[index] = {"error": f"Failed to store lead info: {failed[0]}"}
+
+    return results
+
+@functions_framework.http
+def process_lead_emails_batch(request):
+    """
+    Batch counterpart of process_lead_email for backfills. Gemini extraction runs concurrently
+    (LEAD_BATCH_CONCURRENCY, overridable with ?concurrency=), then all leads are stored in one pass.
+    """
+    try:
+        items = parse_batch_payload(request)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid batch payload: {str(e)}"}), 400
+
+    if len(items) > LEAD_BATCH_MAX_ITEMS:
+        return jsonify({"error": f"Batch too large: {len(items)} emails (max {LEAD_BATCH_MAX_ITEMS})"}), 400
+
+    concurrency = min(parse_positive_int(request.args.get('concurrency'), LEAD_BATCH_CONCURRENCY), LEAD_BATCH_CONCURRENCY)
+    print(f"Processing batch of {len(items)} lead emails with concurrency {concurrency}")
+
+    results = [None] * len(items)
+    lead_infos = {}
+    # Extraction paths of the whole batch, written to the stats once
+    extraction_paths = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {
+            executor.submit(extract_lead_info, item.get('email_body', ''), item.get('sender', ''), item.get('subject', ''), extraction_paths): index
+            for index, item in enumerate(items)
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                lead_infos[index] = future.result()
+            except Exception as e:
+                print(f"Error in extract_lead_info for item {index}: {str(e)}")
+                results[index] = {"error": f"Failed to extract lead info: {str(e)}"}
+    record_extraction_counts(Counter(extraction_paths))
+
+    try:
+        stored = store_lead_batch(items, lead_infos)
+    except Exception as e:
+        print(f"Error in store_lead_batch: {str(e)}")
+        return jsonify({"error": f"Failed to store lead batch: {str(e)}"}), 500
+
+    for index, result in enumerate(stored):
+        if result is not None:
+            results[index] = result
+
+    succeeded = sum(1 for result in results if result and result.get('success'))
+    return jsonify({
+        "processed": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "results": [{"index": index, **result} for index, result in enumerate(results)]
+    })
+
+def start_contact_import(request_json):
+    """Creates the ContactImports document for a new import and returns its snapshot."""
+    source_uri = request_json.get('source_uri')
+    if not source_uri:
+        raise ValueError("source_uri is required")
+    flow_id = request_json.get('flow_id')
+    if flow_id:
+        flow_doc = db.collection('Flows').document(flow_id).get()
+        if not flow_doc.exists:
+            raise ValueError(f"Flow {flow_id} not found")
+    else:
+        flows = fetch_flows_by_lead_email([request_json.get('client_email', '')])
+        if not flows:
+            raise ValueError("Either flow_id or a client_email matching a flow is required")
+        flow_id = next(iter(flows.values())).id
+
+    import_id = request_json.get('import_id') or uuid.uuid4().hex
+    import_ref = db.collection(IMPORT_COLLECTION).document(import_id)
+    import_ref.create({
+        'source_uri': source_uri,
+        'format': detect_format(source_uri, request_json.get('format')),
+        'flow_id': flow_id,
+        'results_prefix': results_prefix(source_uri, import_id),
+        'status': 'running',
+        'byte_offset': 0,
+        'rows_read': 0,
+        'succeeded': 0,
+        'failed': 0,
+        'fieldnames': None,
+        'createdAt': datetime.datetime.now().isoformat()
+    })
+    return import_ref.get()
+
+def claim_import(import_snapshot):
+    """
+    Leases an import to this run before any row is read, so two runs of the same import_id never both
+    store rows (new contacts get auto IDs, so both would create them). The lease is written with the
+    snapshot's update time as precondition; a live lease or a lost race raises FailedPrecondition.
+
+    Returns the import snapshot as of the lease.
+    """
+    import_ref = import_snapshot.reference
+    now = datetime.datetime.now(datetime.timezone.utc)
+    lease_expires_at = (import_snapshot.to_dict() or {}).get('lease_expires_at')
+    if lease_expires_at and lease_expires_at > now:
+        raise exceptions.FailedPrecondition(f"Import {import_ref.id} is leased until {lease_expires_at.isoformat()}")
+    import_ref.update({
+        'lease_id': uuid.uuid4().hex,
+        'lease_expires_at': now + datetime.timedelta(seconds=IMPORT_LEASE_SECONDS)
+    }, option=db.write_option(last_update_time=import_snapshot.update_time))
+    return import_ref.get()
+
+def run_contact_import(import_snapshot):
+    """
+    Streams an import from its checkpoint until the file ends or the time budget runs out.
+
+    The import is leased first (claim_import) and the lease dropped when the run ends. Rows are stored
+    IMPORT_CHUNK_ROWS at a time through store_resolved_leads on one BulkWriter, which is flushed per
+    chunk so at most one chunk of writes is in flight. After each chunk its results are written as a
+    part file and the checkpoint (byte offset, row count, totals) is advanced, conditioned on the
+    checkpoint read before it.
+
+    A run that stops between storing a chunk and checkpointing it redoes that chunk on resume; its
+    already-imported rows then report "Contact already has an active flow".
+    """
+    import_snapshot = claim_import(import_snapshot)
+    deadline = time.monotonic() + IMPORT_TIME_BUDGET_SECONDS
+    state = import_snapshot.to_dict()
+    import_ref = import_snapshot.reference
+    update_time = import_snapshot.update_time
+    flow_doc = db.collection('Flows').document(state['flow_id']).get()
+
+    stream = open_source(state['source_uri'], state['byte_offset'])
+    reader = RowReader(stream, state['format'], state['byte_offset'], state['rows_read'], state.get('fieldnames'))
+    rows = iter(reader)
+    bulk_writer = db.bulk_writer()
+    finished = False
+    try:
+        while time.monotonic() < deadline:
+            chunk = []
+            for row_number, lead_info, error in rows:
+                chunk.append((row_number, lead_info, error))
+                if len(chunk) >= IMPORT_CHUNK_ROWS:
+                    break
+            if not chunk:
+                finished = True
+                break
+
+            valid = [(row_number, lead_info) for row_number, lead_info, error in chunk if error is None]
+            stored = store_resolved_leads([(lead_info, flow_doc) for _, lead_info in valid], bulk_writer)
+            results_by_row = {row_number: result for (row_number, _), result in zip(valid, stored)}
+            results = [
+                {"row": row_number, **(results_by_row[row_number] if error is None else {"error": error})}
+                for row_number, _, error in chunk
+            ]
+            write_result_part(state['results_prefix'], chunk[0][0], results)
+
+            succeeded = sum(1 for result in results if result.get('success'))
+            state.update({
+                'byte_offset': reader.offset,
+                'rows_read': reader.rows_read,
+                'fieldnames': reader.fieldnames,
+                'succeeded': state['succeeded'] + succeeded,
+                'failed': state['failed'] + len(results) - succeeded,
+                'updatedAt': datetime.datetime.now().isoformat()
+            })
+            checkpoint = {key: state[key] for key in ('byte_offset', 'rows_read', 'fieldnames', 'succeeded', 'failed', 'updatedAt')}
+            update_time = import_ref.update(checkpoint, option=db.write_option(last_update_time=update_time)).update_time
+            log_event("Import chunk stored", import_id=import_ref.id, rows_read=reader.rows_read, succeeded=succeeded)
+    finally:
+        bulk_writer.close()
+        stream.close()
+        release = {'lease_id': firestore.DELETE_FIELD, 'lease_expires_at': firestore.DELETE_FIELD}
+        if finished:
+            release['status'] = 'completed'
+        try:
+            import_ref.update(release, option=db.write_option(last_update_time=update_time))
+        except exceptions.FailedPrecondition:
+            # Someone else advanced the import; their lease is theirs to release
+            finished = False
+
+    if finished:
+        state['status'] = 'completed'
+    return {"import_id": import_ref.id, **{key: state.get(key) for key in ('status', 'rows_read', 'succeeded', 'failed', 'results_prefix')}}
+
+@functions_framework.http
+def import_contacts(request):
+    """
+    Bulk contact import from a CSV (with a header row) or NDJSON file in GCS (gs://) or on disk (file://).
+
+    Start with {"source_uri", "flow_id" or "client_email", optional "format" and "import_id"}; rows use
+    the lead_info fields (firstName, lastName, phoneNumber, email, tags, zip/city/state/street). Resume
+    with {"import_id"} while the returned status is 'running'. Per-row results are NDJSON part files
+    under results_prefix.
+    """
+    request_json = request.get_json(silent=True) or {}
+    try:
+        import_snapshot = None
+        if request_json.get('import_id'):
+            import_snapshot = db.collection(IMPORT_COLLECTION).document(request_json['import_id']).get()
+            if not import_snapshot.exists:
+                import_snapshot = None
+        if import_snapshot is None:
+            import_snapshot = start_contact_import(request_json)
+        elif import_snapshot.get('status') == 'completed':
+            return jsonify({"import_id": import_snapshot.id, **import_snapshot.to_dict()})
+    except ValueError as e:
+        return jsonify({"error": f"Invalid import request: {str(e)}"}), 400
+
+    try:
+        return jsonify(run_contact_import(import_snapshot))
+    except exceptions.FailedPrecondition:
+        return jsonify({"error": "Import is being run by another invocation"}), 409
+    except Exception as e:
+        print(f"Error in import_contacts: {str(e)}")
+        return jsonify({"error": f"Failed to import contacts: {str(e)}"}), 500
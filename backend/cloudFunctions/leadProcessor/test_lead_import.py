@@ -0,0 +1,121 @@
+import io
+
+import pytest
+
+pytest.importorskip('google.cloud.storage')
+
+import lead_import
+from lead_import import RowReader, csv_row_to_lead_info, detect_format, split_uri
+
+CSV = (
+    '\ufefffirstName,lastName,phoneNumber,notes,zip,city,state,street,tags\n'
+    'Ana,Diaz,5125550100,"likes\n""big"" yards",78751,Austin,TX,4417 Avenue F,buyer; hot\n'
+    '\n'
+    'Ben,Ng,5125550101,,,,,,\n'
+    'Cy,Oh,5125550102,a,b,c,d,e,f,extra\n'
+    'Di,Fu,5125550103,"multi\nline\nnote",,,,,seller\n'
+).encode('utf-8')
+
+NDJSON = (
+    b'{"firstName": "Ana", "phoneNumber": "5125550100"}\n'
+    b'\n'
+    b'{"firstName": "Ben", \n'
+    b'["not", "an", "object"]\n'
+    b'{"firstName": "Cy", "phoneNumber": "5125550102"}'
+)
+
+
+def read_all(data, file_format, offset=0, rows_read=0, fieldnames=None):
+    stream = io.BytesIO(data)
+    stream.seek(offset)
+    reader = RowReader(stream, file_format, offset, rows_read, fieldnames)
+    return reader, list(reader)
+
+
+def test_csv_rows_with_bom_and_quoted_newlines():
+    reader, rows = read_all(CSV, 'csv')
+    assert [row_number for row_number, _, _ in rows] == [1, 2, 3, 4]
+    assert reader.fieldnames[0] == 'firstName'
+    assert rows[0][1]['notes'] == 'likes\n"big" yards'
+    assert rows[0][1]['tags'] == ['buyer', 'hot']
+    assert rows[0][1]['address'] == {'zip': '78751', 'city': 'Austin', 'state': 'TX', 'street': '4417 Avenue F'}
+    assert rows[2][1] is None and 'Expected 9 columns' in rows[2][2]
+    assert rows[3][1]['notes'] == 'multi\nline\nnote'
+    assert reader.offset == len(CSV)
+
+
+def test_csv_resume_from_every_checkpoint():
+    full_reader, full_rows = read_all(CSV, 'csv')
+    # Record the offset after each row, then resume from each one
+    stream = io.BytesIO(CSV)
+    reader = RowReader(stream, 'csv')
+    checkpoints = []
+    for row in reader:
+        checkpoints.append((reader.offset, reader.rows_read, row))
+    for index, (offset, rows_read, _) in enumerate(checkpoints):
+        resumed, rows = read_all(CSV, 'csv', offset, rows_read, full_reader.fieldnames)
+        assert rows == full_rows[index + 1:]
+        assert resumed.offset == len(CSV)
+
+
+def test_csv_small_read_blocks(monkeypatch):
+    # Records and multi-byte characters straddle block boundaries
+    monkeypatch.setattr(lead_import, 'READ_BLOCK_BYTES', 7)
+    data = CSV.replace(b'Ana', 'Aña'.encode('utf-8'))
+    reader, rows = read_all(data, 'csv')
+    assert rows[0][1]['firstName'] == 'Aña'
+    assert len(rows) == 4 and reader.offset == len(data)
+
+
+def test_ndjson_bad_lines_are_reported_and_skipped():
+    reader, rows = read_all(NDJSON, 'ndjson')
+    assert [(row_number, record, error is not None) for row_number, record, error in rows] == [
+        (1, {'firstName': 'Ana', 'phoneNumber': '5125550100'}, False),
+        (2, None, True),
+        (3, None, True),
+        (4, {'firstName': 'Cy', 'phoneNumber': '5125550102'}, False),
+    ]
+    assert rows[1][2].startswith('Invalid JSON')
+    assert rows[2][2] == 'Expected a JSON object'
+    assert reader.offset == len(NDJSON)
+
+
+def test_ndjson_resume():
+    stream = io.BytesIO(NDJSON)
+    reader = RowReader(stream, 'ndjson')
+    rows = iter(reader)
+    next(rows)
+    next(rows)
+    resumed, remaining = read_all(NDJSON, 'ndjson', reader.offset, reader.rows_read)
+    assert [row_number for row_number, _, _ in remaining] == [3, 4]
+    assert remaining[1][1]['firstName'] == 'Cy'
+
+
+def test_csv_row_to_lead_info():
+    assert csv_row_to_lead_info({
+        'firstName': ' Ana ',
+        'lastName': '',
+        'phoneNumber': '512-555-0100',
+        'zip': '78751',
+        'street': '4417 Avenue F',
+        'tags': 'buyer, hot;;vip ,',
+        '': 'unnamed column',
+        'email': None,
+    }) == {
+        'firstName': 'Ana',
+        'phoneNumber': '512-555-0100',
+        'tags': ['buyer', 'hot', 'vip'],
+        'address': {'zip': '78751', 'street': '4417 Avenue F'},
+    }
+    assert csv_row_to_lead_info({'city': ' ', 'tags': ' '}) == {}
+
+
+def test_split_uri_and_format():
+    assert split_uri('gs://bucket/dir/leads.csv') == ('gs', 'bucket', 'dir/leads.csv')
+    assert split_uri('file:///tmp/leads.ndjson') == ('file', None, '/tmp/leads.ndjson')
+    with pytest.raises(ValueError):
+        split_uri('s3://bucket/leads.csv')
+    assert detect_format('gs://b/leads.jsonl') == 'ndjson'
+    assert detect_format('gs://b/leads.txt') == 'csv'
+    with pytest.raises(ValueError):
+        detect_format('gs://b/leads.csv', 'xlsx')
@@ -0,0 +1,81 @@
+import os
+
+import pytest
+
+from lead_parsers import LeadParser, html_to_text, parse_lead_email, sender_domain
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures')
+
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name)) as fixture_file:
+        return fixture_file.read()
+
+
+def test_zillow_lead():
+    lead_info, parser_name = parse_lead_email(fixture('zillow_lead.html'), 'Zillow <leads@mail.zillow.com>')
+    assert parser_name == 'zillow'
+    # The agent's signature above the lead block and the footer below both carry a Phone: line
+    assert lead_info == {
+        'firstName': 'Maria',
+        'lastName': 'Lopez',
+        'phoneNumber': '5125550142',
+        'tags': [],
+        'email': 'maria.lopez@example.com',
+        'address': {'zip': '78751', 'city': 'Austin', 'state': 'TX', 'street': '4417 Avenue F'},
+    }
+
+
+def test_realtor_lead():
+    lead_info, parser_name = parse_lead_email(fixture('realtor_lead.txt'), 'leads@email.realtor.com')
+    assert parser_name == 'realtor'
+    assert lead_info == {
+        'firstName': 'James',
+        'lastName': "O'Neil",
+        'phoneNumber': '3035550187',
+        'tags': [],
+        'email': 'jamesoneil@example.net',
+        'address': {'zip': '80211', 'city': 'Denver', 'state': 'CO', 'street': '2250 Grove St'},
+    }
+
+
+def test_portal_mail_that_is_not_a_lead_falls_back():
+    # Right sender and a 'Contact information' block, but not the lead template
+    assert parse_lead_email(fixture('zillow_market_report.txt'), 'no-reply@zillow.com') == (None, None)
+
+
+@pytest.mark.parametrize('sender', ['dana@whitfieldrealty.com', '', 'leads@notzillow.com'])
+def test_mail_that_only_mentions_portals_falls_back(sender):
+    assert parse_lead_email(fixture('agent_mentions_portals.txt'), sender) == (None, None)
+
+
+def test_template_from_another_sender_falls_back():
+    assert parse_lead_email(fixture('realtor_lead.txt'), 'agent@gmail.com') == (None, None)
+    assert parse_lead_email(fixture('zillow_lead.html'), 'leads@realtor.com') == (None, None)
+
+
+def test_marker_without_lead_block_falls_back():
+    body = fixture('realtor_lead.txt').replace('Lead Information', 'Listing summary')
+    assert parse_lead_email(body, 'leads@realtor.com') == (None, None)
+
+
+def test_lead_block_without_phone_falls_back():
+    body = fixture('realtor_lead.txt').replace('Phone: 1-303-555-0187\n', '')
+    # The customer care number after the block must not be used instead
+    assert parse_lead_email(body, 'leads@realtor.com') == (None, None)
+
+
+def test_lead_block_is_bounded():
+    parser = LeadParser('test', ('example.com',), r'marker', r'^begin$', r'^end\b', {})
+    assert parser.lead_block('marker\nbegin\nPhone: 1\nend\nPhone: 2') == '\nPhone: 1\n'
+    assert parser.lead_block('marker\nPhone: 1') is None
+
+
+def test_html_to_text_splits_rows():
+    lines = html_to_text('<tr><td>Name: A</td></tr><tr><td>Phone: 1</td></tr>').split('\n')
+    assert [line.strip() for line in lines[:2]] == ['Name: A', 'Phone: 1']
+
+
+def test_sender_domain():
+    assert sender_domain('Zillow <Leads@Mail.Zillow.com>') == 'mail.zillow.com'
+    assert sender_domain('') == ''